@@ -12,5 +12,12 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'rag_api.settings')
+# Serve the API through the native async views (rag_app.async_views)
+os.environ.setdefault('RAG_ASYNC_VIEWS', '1')
 
 application = get_asgi_application()
+
+# Read the hot pages and prime this process' caches when RAG_WARMUP['ON_START'] is set
+from rag_app.warmup import start_background  # noqa: E402
+
+start_background()
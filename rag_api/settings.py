@@ -78,12 +78,27 @@ WSGI_APPLICATION = 'rag_api.wsgi.application'
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
 
 DATABASES = {
+    # Writer: migrations, query history and index maintenance
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR.parent / 'db1.sqlite3',
-    }
+        'CONN_MAX_AGE': None,
+        'CONN_HEALTH_CHECKS': True,
+        'OPTIONS': {'timeout': 20},
+    },
+    # Read-only view of the same file for the hotwash queries (see rag_app.db)
+    'reader': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': f"file:{BASE_DIR.parent / 'db1.sqlite3'}?mode=ro",
+        'CONN_MAX_AGE': None,
+        'CONN_HEALTH_CHECKS': True,
+        'OPTIONS': {'timeout': 20},
+        'TEST': {'MIRROR': 'default'},
+    },
 }
 
+DATABASE_ROUTERS = ['rag_app.db.ReadWriteRouter']
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -136,8 +151,172 @@ REST_FRAMEWORK = {
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.AllowAny',
     ],
+    # 'rag_app.renderers.FastJSONRenderer' is a faster drop-in, most of all with orjson installed
     'DEFAULT_RENDERER_CLASSES': [
         'rest_framework.renderers.JSONRenderer',
     ],
 }
 
+# RAG query settings
+# Upper bound on the number of distinct parameterized SQL templates kept in memory
+RAG_SQL_TEMPLATE_CACHE_SIZE = 64
+
+# Result cache in front of /query/. BACKEND may be
+# 'rag_app.result_cache.LocMemResultCache' (per-process LRU),
+# 'rag_app.result_cache.DjangoResultCache' (uses CACHES[OPTIONS['alias']]) or None to disable.
+# Entries are tagged with a change counter that triggers on the hotwash tables bump
+# (install them with build_data_version; until then nothing is cached).
+# WATERMARK_TTL bounds how often the counter is re-read, in seconds.
+RAG_RESULT_CACHE = {
+    'BACKEND': 'rag_app.result_cache.LocMemResultCache',
+    'OPTIONS': {'maxsize': 512},
+    'WATERMARK_TTL': 1.0,
+}
+
+# Concurrent /query/ requests for the same question (same result cache key) share one
+# run of the query. Waiters not answered within TIMEOUT seconds run it themselves.
+RAG_COALESCE = {
+    'ENABLED': True,
+    'TIMEOUT': 10.0,
+}
+
+# Admission control for /query/. Each question's statements are costed as rows examined
+# from EXPLAIN QUERY PLAN and sqlite_stat1 (keep it current with ANALYZE). Above
+# EXPENSIVE_ROWS a question runs in a lane of EXPENSIVE_CONCURRENCY at a time, waiting at
+# most LANE_TIMEOUT seconds for a slot (then 503), and is interrupted after BUDGET seconds.
+# Above REJECT_ROWS it is not run at all. Interrupted and rejected questions are answered
+# with a count of the matching rows, itself limited to COUNT_BUDGET seconds. A LIMIT is
+# assumed to stop an unsorted scan after LIMIT_SCAN_FACTOR rows per row returned.
+RAG_ADMISSION = {
+    'ENABLED': True,
+    'EXPENSIVE_ROWS': 100000,
+    'REJECT_ROWS': 5000000,
+    'EXPENSIVE_CONCURRENCY': 2,
+    'LANE_TIMEOUT': 5.0,
+    'BUDGET': 2.0,
+    'COUNT_BUDGET': 1.0,
+    'LIMIT_SCAN_FACTOR': 20,
+}
+
+# Use the rag_cell_fts index (manage.py build_cell_fts) for user mentions in cell_data
+# when it exists; otherwise /query/ falls back to LIKE matching.
+RAG_USE_CELL_FTS = True
+
+# Background QueryHistory writer. Rows are queued and written by one worker thread in
+# batches of BATCH_SIZE at least every FLUSH_INTERVAL seconds. Rows arriving while
+# MAX_QUEUE rows are pending are dropped and counted. Set ENABLED to False to write
+# synchronously inside the request.
+RAG_HISTORY_WRITER = {
+    'ENABLED': True,
+    'BATCH_SIZE': 200,
+    'FLUSH_INTERVAL': 0.5,
+    'MAX_QUEUE': 10000,
+}
+
+# Compression codec for stored result payloads: 'zlib', or 'zstd' on Python 3.14+
+RAG_PAYLOAD_CODEC = 'zlib'
+# History older than this many days is removed by manage.py compact_history
+RAG_HISTORY_RETENTION_DAYS = 30
+# /history/ entries per page by default and at most
+RAG_HISTORY_PAGE_SIZE = 20
+RAG_MAX_HISTORY_PAGE_SIZE = 200
+
+# /query/ paging: rows per page by default and at most, and the most rows one
+# streamed (NDJSON) response may carry before the client must follow next_cursor.
+RAG_DEFAULT_PAGE_SIZE = 50
+RAG_MAX_PAGE_SIZE = 500
+RAG_MAX_STREAM_ROWS = 100000
+
+# Summary questions ("tasks for user 5 this week") are answered by aggregate SQL over
+# the whole window. Only RAG_SUMMARY_SAMPLE_SIZE rows are fetched unless the request
+# sets page_size, and each of the per user, workspace and status breakdowns lists at
+# most RAG_SUMMARY_GROUP_LIMIT groups.
+RAG_SUMMARY_SAMPLE_SIZE = 10
+RAG_SUMMARY_GROUP_LIMIT = 10
+
+# Offline retrieval index (manage.py build_retrieval_index) used by /retrieve/ and by
+# /query/ with retrieval=true. Needs numpy.
+RAG_RETRIEVAL_INDEX_DIR = BASE_DIR.parent / 'rag_index'
+RAG_RETRIEVAL_FEATURES = 2 ** 18
+
+# The schema served by /schema/ is introspected once and reloaded when SQLite's
+# schema_version changes, which is re-checked at most this often (seconds).
+RAG_SCHEMA_CHECK_INTERVAL = 5.0
+
+# /query/batch/: the most questions one request may carry, and how many distinct
+# bindings of the same SQL template are merged into one UNION ALL statement.
+RAG_MAX_BATCH_SIZE = 50
+RAG_BATCH_MERGE_LIMIT = 16
+
+# Native async views, switched on by rag_api/asgi.py. Their blocking database work runs
+# on a pool of MAX_WORKERS threads with at most MAX_QUEUE requests waiting; requests
+# beyond that are answered 503 with Retry-After.
+RAG_ASYNC_VIEWS = os.environ.get('RAG_ASYNC_VIEWS') == '1'
+RAG_DB_EXECUTOR = {
+    'MAX_WORKERS': 8,
+    'MAX_QUEUE': 32,
+}
+
+# Pragmas applied to every new connection, per DATABASES alias. WAL on the writer lets
+# readers keep reading while history rows are inserted; the reader gets a larger page
+# cache, memory-mapped I/O and query_only as a second guard against writes.
+RAG_READ_DATABASE = 'reader'
+RAG_SQLITE_PRAGMAS = {
+    'default': {
+        'journal_mode': 'wal',
+        'synchronous': 'normal',
+    },
+    'reader': {
+        'query_only': 1,
+        'cache_size': -65536,  # KiB, i.e. 64 MiB
+        'mmap_size': 268435456,
+        'temp_store': 'memory',
+    },
+}
+
+# Per-stage request timing: /metrics/ reports quantiles over the last RAG_METRICS_WINDOW
+# requests per stage. Statements slower than RAG_SLOW_QUERY_MS are logged with their
+# EXPLAIN QUERY PLAN to the rag_app.slow_query logger; None turns the log off.
+RAG_METRICS_WINDOW = 1024
+RAG_SLOW_QUERY_MS = None
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'rag_app': {'handlers': ['console'], 'level': 'INFO'},
+    },
+}
+
+# Read the denormalized task_facts table (manage.py build_task_facts) instead of the
+# five-way join when it exists.
+RAG_USE_TASK_FACTS = True
+
+# Optional sharded layout (manage.py split_shards): the hotwash tables split into COUNT
+# SQLite files under DIR, all workspaces of one owner in the same file. With ENABLED,
+# /query/ reads the shards: a user_id question goes to the shards holding that user's
+# workspaces and mentions, anything else to every shard at once on MAX_WORKERS threads,
+# with the pages merged in cell_date order. Shards are a snapshot; split again after loads.
+RAG_SHARDS = {
+    'ENABLED': False,
+    'DIR': BASE_DIR.parent / 'shards',
+    'COUNT': 4,
+    'MAX_WORKERS': 4,
+}
+
+# Warm-up after a deploy (manage.py warmup, or check_db.py): preflight checks, ANALYZE of
+# stale tables, a read of the hot pages and the QUERIES most frequent history questions
+# answered once. With ON_START each server process also reads the pages and primes its
+# own template and result caches on a background thread when it starts.
+RAG_WARMUP = {
+    'ON_START': False,
+    'QUERIES': 20,
+}
+
+# Summaries read closed days from the daily roll-ups (manage.py build_rollups) when
+# they cover the whole window and no day of it changed since it was rolled up; the
+# open end of a window is always queried live.
+RAG_USE_ROLLUPS = True
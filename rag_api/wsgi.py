@@ -14,3 +14,8 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'rag_api.settings')
 
 application = get_wsgi_application()
+
+# Read the hot pages and prime this process' caches when RAG_WARMUP['ON_START'] is set
+from rag_app.warmup import start_background  # noqa: E402
+
+start_background()
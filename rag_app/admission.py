@@ -0,0 +1,344 @@
+import contextlib
+import math
+import re
+import threading
+import time
+from collections import defaultdict
+from typing import NamedTuple
+
+from django.conf import settings
+from django.db import DatabaseError
+from django.utils import timezone
+
+from .cache import LRUCache
+from .db import read_connection
+from .sql_templates import resolve_date_window
+
+# Each statement is costed as the rows it examines, from its EXPLAIN QUERY PLAN and the
+# row counts ANALYZE leaves in sqlite_stat1. There is no sqlite_stat4 histogram, so a
+# date range is costed as window days times the average rows per distinct date, and
+# anything else SQLite can't see through uses the planner's own rough assumptions.
+VERDICTS = ('cheap', 'expensive', 'rejected')
+
+# Share of an index a range constraint keeps when the window's width is unknown;
+# SQLite's planner assumes about the same without stat4
+OPEN_RANGE_FRACTION = 1 / 4
+CLOSED_RANGE_FRACTION = 1 / 64
+# Share of an FTS index one MATCH is assumed to return
+MATCH_FRACTION = 1 / 16
+# Rows a GROUP BY is assumed to fold into one
+GROUP_BY_FOLD = 10
+
+# sqlite_stat1 is re-read at most this often (seconds); plans are cached until then
+STATS_TTL = 60.0
+# VM instructions between checks of a running statement's time budget
+PROGRESS_INTERVAL = 1000
+
+TABLE_STEP_RE = re.compile(r'^(?:SCAN|SEARCH) (\S+)(.*)$')
+CONSTRAINTS_RE = re.compile(r' \((.*)\)(?: LEFT-JOIN)?$')
+INDEX_RE = re.compile(r'(?:AUTOMATIC )?(?:COVERING )?INDEX (\S+)')
+ALIAS_RE = re.compile(r'\b(?:FROM|JOIN)\s+(\w+)(?:\s+(?:AS\s+)?(\w+))?', re.IGNORECASE)
+LIMIT_RE = re.compile(r'\bLIMIT %s\s*$')
+# Sorting only the trailing ORDER BY terms sorts one group of equal leading terms at a
+# time, so rows still come out in order and a LIMIT stops early
+PARTIAL_SORT_RE = re.compile(r'FOR (?:RIGHT PART|LAST (?:\d+ )?TERMS?) OF ORDER BY')
+
+
+class Estimate(NamedTuple):
+    verdict: str  # one of VERDICTS
+    rows: float  # rows the statements are expected to examine; inf without statistics
+    plan: list
+
+    def describe(self):
+        return {
+            "class": self.verdict,
+            "estimated_rows": None if math.isinf(self.rows) else int(self.rows),
+        }
+
+
+class LaneSaturated(Exception):
+    """No slot in the expensive lane freed up in time"""
+
+
+def window_days(date_window, today=None):
+    """Distinct dates a date window can cover, counting an open end up to today"""
+    today = today or timezone.now().date()
+    start, end = resolve_date_window(date_window, today)
+    return max(((end or today) - start).days + 1, 1)
+
+
+def load_statistics():
+    """({index: [rows, rows per distinct prefix...]}, {table: rows}) from sqlite_stat1"""
+    stats = {}
+    with read_connection().cursor() as cursor:
+        cursor.execute("SELECT count(*) FROM sqlite_master WHERE name = 'sqlite_stat1'")
+        if not cursor.fetchone()[0]:
+            return stats, {}
+        cursor.execute("SELECT tbl, idx, stat FROM sqlite_stat1")
+        tables = {}
+        for table, index, stat in cursor.fetchall():
+            numbers = [int(part) for part in stat.split() if part.isdigit()]
+            if not numbers:
+                continue
+            tables[table] = max(tables.get(table, 0), numbers[0])
+            if index:
+                stats[index] = numbers
+        return stats, tables
+
+
+class PlanCost:
+    """Walks one EXPLAIN QUERY PLAN tree, costing nested loops against sqlite_stat1"""
+
+    def __init__(self, rows, sql, stats, tables, days=None):
+        self.children = defaultdict(list)
+        for node, parent, _, detail in rows:
+            self.children[parent].append((node, detail))
+        self.aliases = {alias: table for table, alias in ALIAS_RE.findall(sql) if alias}
+        self.stats = stats
+        self.tables = tables
+        self.days = days
+        self.materialized = {}
+
+    def table_rows(self, name):
+        name = self.aliases.get(name, name)
+        if name in self.materialized:
+            return self.materialized[name]
+        return self.tables.get(name, math.inf)
+
+    def step_rows(self, name, detail):
+        """Rows one SCAN/SEARCH step yields per outer row"""
+        if 'VIRTUAL TABLE' in detail:
+            # FTS5 keeps its row count in the shadow docsize table; before that is
+            # analyzed, the index is as large as the cells table it covers
+            rows = self.tables.get(name + '_docsize', self.tables.get('hotwash_rowcell_data', math.inf))
+            return rows * MATCH_FRACTION
+        constraints = CONSTRAINTS_RE.search(detail)
+        if constraints is None:
+            return self.table_rows(name)
+        terms = constraints.group(1).split(' AND ')
+        if 'PRIMARY KEY' in detail and all(term.endswith('=?') for term in terms):
+            return 1
+        index = INDEX_RE.search(detail)
+        if index is None or index.group(1) not in self.stats:
+            # An automatic index is built for this statement from a join key
+            return 1 if 'AUTOMATIC' in detail else self.table_rows(name)
+        stat = self.stats[index.group(1)]
+        rows, position = stat[0], 0
+        for term in terms:
+            if position + 1 >= len(stat):
+                break
+            if term.startswith('ANY('):
+                # Skip-scan: one seek per distinct value of the column
+                position += 1
+            elif term.endswith('=?') and term[-3] not in '<>':
+                rows = rows * stat[position + 1] / stat[position]
+                position += 1
+            elif self.days is not None:
+                # Ranges in these templates are date windows
+                rows = min(rows, rows * stat[position + 1] / stat[position] * self.days)
+                break
+            else:
+                rows *= OPEN_RANGE_FRACTION if len(terms) - position == 1 else CLOSED_RANGE_FRACTION
+                break
+        return max(rows, 1)
+
+    def walk(self, parent=0, branch=False):
+        """(cost, rows, blocking) of the steps under parent, each run once per row so far"""
+        cost, rows, driving, blocking = 0.0, 1.0, 1.0, False
+        for node, detail in self.children.get(parent, ()):
+            if detail == 'COMPOUND QUERY':
+                parts = [self.walk(child) for child, _ in self.children.get(node, ())]
+                cost += sum(part[0] for part in parts)
+                rows *= sum(part[1] for part in parts)
+                blocking = blocking or any(part[2] for part in parts)
+            elif detail.startswith(('MATERIALIZE ', 'CO-ROUTINE ')):
+                sub_cost, sub_rows, _ = self.walk(node)
+                cost += sub_cost
+                self.materialized[detail.split(' ', 1)[1]] = sub_rows
+            elif detail.startswith('CORRELATED '):
+                cost += self.walk(node)[0] * rows
+            elif detail.startswith(('LIST SUBQUERY', 'SCALAR SUBQUERY')):
+                sub_cost, sub_rows, _ = self.walk(node)
+                cost += sub_cost
+                if branch:
+                    # In a MULTI-INDEX OR branch the IN list drives the lookup that follows
+                    driving = sub_rows
+            elif detail == 'MULTI-INDEX OR':
+                branches = [self.walk(child, branch=True) for child, _ in self.children.get(node, ())]
+                cost += rows * sum(part[0] for part in branches)
+                rows *= sum(part[1] for part in branches)
+                blocking = True
+            elif detail.startswith('USE TEMP B-TREE'):
+                cost += rows
+                if 'GROUP BY' in detail:
+                    rows = max(rows / GROUP_BY_FOLD, 1)
+                blocking = blocking or not PARTIAL_SORT_RE.search(detail)
+            else:
+                step = TABLE_STEP_RE.match(detail)
+                if step is None or 'CONSTANT ROW' in detail:
+                    continue
+                rows *= self.step_rows(step.group(1), step.group(2)) * driving
+                driving = 1.0
+                cost += rows
+        return cost, rows, blocking
+
+
+def estimate_rows(sql, params, stats, tables, days=None, limit_scan_factor=20):
+    """(rows examined, plan) for one statement"""
+    with read_connection().cursor() as cursor:
+        cursor.execute('EXPLAIN QUERY PLAN ' + sql, params or [])
+        rows = cursor.fetchall()
+    cost, produced, blocking = PlanCost(rows, sql, stats, tables, days).walk()
+    # Read in output order with nothing to sort, a LIMIT stops the outer loop early;
+    # assume one row in limit_scan_factor passes the remaining filters
+    if LIMIT_RE.search(sql) and not blocking and params and produced and not math.isinf(cost):
+        cost = min(cost, cost * params[-1] * limit_scan_factor / produced)
+    return cost, [row[3] for row in rows]
+
+
+class AdmissionController:
+    """Classifies /query/ statements by estimated cost and runs the expensive ones apart.
+
+    Expensive statements take one of concurrency slots in a separate lane, waiting at
+    most lane_timeout seconds for one, so a burst of heavy questions can't occupy every
+    worker; budget() interrupts a statement that runs past its time limit.
+    """
+
+    def __init__(self, concurrency=2, lane_timeout=5.0):
+        self.concurrency = concurrency
+        self.lane_timeout = lane_timeout
+        self._lane = threading.BoundedSemaphore(concurrency)
+        self._lock = threading.Lock()
+        self._plans = LRUCache(getattr(settings, 'RAG_SQL_TEMPLATE_CACHE_SIZE', 64))
+        self._stats = None
+        self._stats_loaded = 0.0
+        self.classified = dict.fromkeys(VERDICTS, 0)
+        self.degraded = {'budget': 0, 'rejected': 0}
+        self.lane_active = 0
+        self.lane_timeouts = 0
+
+    def statistics(self):
+        now = time.monotonic()
+        if self._stats is None or now - self._stats_loaded > STATS_TTL:
+            stats = load_statistics()
+            with self._lock:
+                self._stats, self._stats_loaded = stats, now
+            self._plans.clear()
+        return self._stats
+
+    def estimate(self, statements, days=None):
+        """Classify a request by the summed cost of its (sql, params) statements"""
+        config = getattr(settings, 'RAG_ADMISSION', {})
+        total, plan = 0.0, []
+        try:
+            stats, tables = self.statistics()
+            for sql, params in statements:
+                key = (sql, days, params[-1] if LIMIT_RE.search(sql) and params else None)
+                cost, steps = self._plans.get_or_create(key, lambda: estimate_rows(
+                    sql, params, stats, tables, days, config.get('LIMIT_SCAN_FACTOR', 20),
+                ))[0]
+                total += cost
+                plan += steps
+        except (DatabaseError, OverflowError):
+            # A statement that can't be planned isn't refused for it; it runs as it would without admission
+            total, plan = None, []
+        if total is None:
+            verdict = 'cheap'
+        elif math.isinf(total):
+            # Without statistics nothing is refused outright, only run on a budget
+            verdict = 'expensive'
+        elif total > config.get('REJECT_ROWS', 5000000):
+            verdict = 'rejected'
+        elif total > config.get('EXPENSIVE_ROWS', 100000):
+            verdict = 'expensive'
+        else:
+            verdict = 'cheap'
+        with self._lock:
+            self.classified[verdict] += 1
+        return Estimate(verdict, math.inf if total is None else total, plan)
+
+    def count_degraded(self, reason):
+        with self._lock:
+            self.degraded[reason] += 1
+
+    @contextlib.contextmanager
+    def expensive_lane(self):
+        """Hold a slot in the expensive lane; raises LaneSaturated when none frees up in time"""
+        if not self._lane.acquire(timeout=self.lane_timeout):
+            with self._lock:
+                self.lane_timeouts += 1
+            raise LaneSaturated(
+                f"{self.concurrency} expensive queries are already running; try again shortly"
+            )
+        with self._lock:
+            self.lane_active += 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                self.lane_active -= 1
+            self._lane.release()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "classified": dict(self.classified),
+                "degraded": dict(self.degraded),
+                "lane_active": self.lane_active,
+                "lane_timeouts": self.lane_timeouts,
+            }
+
+
+class TimeBudget:
+    """Interrupts statements on the read connection that run past seconds.
+
+    SQLite calls the progress handler every PROGRESS_INTERVAL VM instructions and
+    abandons the statement when it returns true; expired tells callers that an
+    error they caught was this interrupt.
+    """
+
+    def __init__(self, seconds):
+        self.seconds = seconds
+        self.expired = False
+
+    def check(self):
+        if time.monotonic() > self.deadline:
+            self.expired = True
+        return self.expired
+
+    def __enter__(self):
+        connection = read_connection()
+        connection.ensure_connection()
+        self.raw = connection.connection
+        self.deadline = time.monotonic() + self.seconds
+        self.raw.set_progress_handler(self.check, PROGRESS_INTERVAL)
+        return self
+
+    def __exit__(self, *exc_info):
+        self.raw.set_progress_handler(None, 0)
+        return False
+
+
+_controller = None
+_controller_lock = threading.Lock()
+
+
+def get_admission_controller():
+    """The process-wide controller configured by settings.RAG_ADMISSION, or None when disabled"""
+    global _controller
+    config = getattr(settings, 'RAG_ADMISSION', {})
+    if not config.get('ENABLED', True):
+        return None
+    if _controller is None:
+        with _controller_lock:
+            if _controller is None:
+                _controller = AdmissionController(
+                    concurrency=config.get('EXPENSIVE_CONCURRENCY', 2),
+                    lane_timeout=config.get('LANE_TIMEOUT', 5.0),
+                )
+    return _controller
+
+
+def budget_seconds(kind='BUDGET'):
+    """The time budget for expensive statements ('BUDGET') or count-only fallbacks ('COUNT_BUDGET')"""
+    return getattr(settings, 'RAG_ADMISSION', {}).get(kind, {'BUDGET': 2.0, 'COUNT_BUDGET': 1.0}[kind])
@@ -4,3 +4,10 @@ from django.apps import AppConfig
 class RagAppConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'rag_app'
+
+    def ready(self):
+        from django.db.backends.signals import connection_created
+
+        from .db import configure_connection
+
+        connection_created.connect(configure_connection, dispatch_uid='rag_app.configure_connection')
@@ -0,0 +1,89 @@
+from django.http import JsonResponse, StreamingHttpResponse
+from django.utils.decorators import classonlymethod
+from django.views import View
+
+from .executor import ExecutorSaturated, get_db_executor
+from .views import (
+    BatchQueryView, OfflineRAGView, QueryHistoryItemView, QueryHistoryView, RetrievalView, SchemaInfoView,
+)
+
+
+class AsyncDatabaseView(View):
+    """Native async wrapper that runs a synchronous DRF view on the database executor.
+
+    Under ASGI a sync view borrows a thread through sync_to_async; here the event
+    loop only awaits a bounded pool, and requests beyond its queue get a 503 with
+    Retry-After instead of waiting for a thread.
+    """
+    sync_view_class = None
+    sync_view = None
+
+    @classonlymethod
+    def as_view(cls, **initkwargs):
+        initkwargs.setdefault('sync_view', cls.sync_view_class.as_view())
+        view = super().as_view(**initkwargs)
+        view.csrf_exempt = True
+        return view
+
+    def render(self, request, *args, **kwargs):
+        response = self.sync_view(request, *args, **kwargs)
+        # Render on the worker thread too, so the event loop never serializes rows
+        if hasattr(response, 'render') and callable(response.render):
+            response.render()
+        return response
+
+    async def handle(self, request, *args, **kwargs):
+        executor = get_db_executor()
+        try:
+            response = await executor.run(self.render, request, *args, **kwargs)
+            if isinstance(response, StreamingHttpResponse) and not response.is_async:
+                response.streaming_content = executor.stream(response.streaming_content)
+        except ExecutorSaturated as e:
+            response = JsonResponse(
+                {"error": f"Server busy: {e}", "executor": executor.stats()},
+                status=503,
+            )
+            response['Retry-After'] = '1'
+        return response
+
+
+class AsyncOfflineRAGView(AsyncDatabaseView):
+    sync_view_class = OfflineRAGView
+
+    async def post(self, request, *args, **kwargs):
+        return await self.handle(request, *args, **kwargs)
+
+
+class AsyncBatchQueryView(AsyncDatabaseView):
+    sync_view_class = BatchQueryView
+
+    async def post(self, request, *args, **kwargs):
+        return await self.handle(request, *args, **kwargs)
+
+
+class AsyncRetrievalView(AsyncDatabaseView):
+    sync_view_class = RetrievalView
+
+    async def post(self, request, *args, **kwargs):
+        return await self.handle(request, *args, **kwargs)
+
+
+class AsyncSchemaInfoView(AsyncDatabaseView):
+    sync_view_class = SchemaInfoView
+
+    async def get(self, request, *args, **kwargs):
+        return await self.handle(request, *args, **kwargs)
+
+
+class AsyncQueryHistoryView(AsyncDatabaseView):
+    sync_view_class = QueryHistoryView
+
+    async def get(self, request, *args, **kwargs):
+        return await self.handle(request, *args, **kwargs)
+
+
+class AsyncQueryHistoryItemView(AsyncDatabaseView):
+    sync_view_class = QueryHistoryItemView
+
+    async def get(self, request, *args, **kwargs):
+        return await self.handle(request, *args, **kwargs)
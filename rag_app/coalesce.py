@@ -0,0 +1,92 @@
+import threading
+
+from django.conf import settings
+
+
+class _Call:
+    __slots__ = ('done', 'result', 'error')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """Runs one copy of identical concurrent work and hands its result to every caller.
+
+    The first caller for a key runs the function; callers arriving while it runs wait
+    for that result instead of repeating the work. A waiter that isn't answered within
+    timeout seconds, or whose leader failed, runs the function itself. Waiting blocks
+    the calling thread, which under ASGI is a database executor worker, so it holds
+    in both deployments.
+    """
+
+    def __init__(self, timeout=10.0):
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._calls = {}
+        self.leaders = 0
+        self.coalesced = 0
+        self.timeouts = 0
+        self.failures = 0
+
+    def do(self, key, fn):
+        """Return (result, shared); shared is True when another caller's run was reused"""
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                self.leaders += 1
+
+        if leader:
+            try:
+                call.result = fn()
+            except BaseException as e:
+                call.error = e
+                raise
+            finally:
+                with self._lock:
+                    del self._calls[key]
+                call.done.set()
+            return call.result, False
+
+        if not call.done.wait(self.timeout):
+            with self._lock:
+                self.timeouts += 1
+            return fn(), False
+        if call.error is not None:
+            with self._lock:
+                self.failures += 1
+            return fn(), False
+        with self._lock:
+            self.coalesced += 1
+        return call.result, True
+
+    def stats(self):
+        with self._lock:
+            return {
+                "in_flight": len(self._calls),
+                "leaders": self.leaders,
+                "coalesced": self.coalesced,
+                "timeouts": self.timeouts,
+                "failures": self.failures,
+            }
+
+
+_single_flight = None
+_single_flight_lock = threading.Lock()
+
+
+def get_single_flight():
+    """The process-wide coalescer configured by settings.RAG_COALESCE, or None when disabled"""
+    global _single_flight
+    config = getattr(settings, 'RAG_COALESCE', {})
+    if not config.get('ENABLED', True):
+        return None
+    if _single_flight is None:
+        with _single_flight_lock:
+            if _single_flight is None:
+                _single_flight = SingleFlight(timeout=config.get('TIMEOUT', 10.0))
+    return _single_flight
@@ -0,0 +1,58 @@
+import logging
+
+from django.conf import settings
+from django.db import connections
+
+logger = logging.getLogger(__name__)
+
+# Models stored in the database the app writes to; everything else is read-only data
+WRITE_APP_LABELS = frozenset({'rag_app'})
+
+
+def read_alias():
+    """Alias of the read-only hotwash connection, or 'default' when none is configured"""
+    alias = getattr(settings, 'RAG_READ_DATABASE', 'reader')
+    return alias if alias in settings.DATABASES else 'default'
+
+
+def read_connection():
+    """Connection for the analytical reads behind /query/, /schema/ and /retrieve/"""
+    return connections[read_alias()]
+
+
+def configure_connection(sender, connection, **kwargs):
+    """connection_created hook applying RAG_SQLITE_PRAGMAS[alias] to each new SQLite connection"""
+    if connection.vendor != 'sqlite':
+        return
+    pragmas = getattr(settings, 'RAG_SQLITE_PRAGMAS', {}).get(connection.alias, {})
+    if not pragmas:
+        return
+    with connection.cursor() as cursor:
+        for name, value in pragmas.items():
+            cursor.execute(f'PRAGMA {name} = {value}')
+            if name == 'journal_mode':
+                mode = cursor.fetchone()[0]
+                if mode.lower() != str(value).lower():
+                    logger.warning("SQLite connection %r is in journal_mode=%s, not %s", connection.alias, mode, value)
+
+
+class ReadWriteRouter:
+    """Send ORM reads of the app's own tables to the reader and all writes to default.
+
+    Raw hotwash queries pick their connection with read_connection() instead.
+    """
+
+    def db_for_read(self, model, **hints):
+        if model._meta.app_label in WRITE_APP_LABELS:
+            return read_alias()
+        return 'default'
+
+    def db_for_write(self, model, **hints):
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Both aliases open the same database file
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == 'default'
@@ -0,0 +1,155 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import close_old_connections
+
+_STREAM_END = object()
+
+
+class ExecutorSaturated(Exception):
+    """Every worker is busy and the queue is full"""
+
+
+class DatabaseExecutor:
+    """Fixed pool of threads for blocking SQLite work issued by the async views.
+
+    At most max_workers jobs run at once and at most max_queue more wait for a
+    worker; anything beyond that is refused with ExecutorSaturated instead of
+    piling up, so callers can answer 503 right away.
+    """
+
+    def __init__(self, max_workers=8, max_queue=32):
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='rag-db')
+        self._slots = threading.BoundedSemaphore(max_workers + max_queue)
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._active = 0
+        self._completed = 0
+        self._rejected = 0
+
+    def _admit(self):
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self._rejected += 1
+            raise ExecutorSaturated(
+                f"All {self.max_workers} database workers are busy and {self.max_queue} requests are queued"
+            )
+        with self._lock:
+            self._pending += 1
+
+    def _release(self):
+        with self._lock:
+            self._pending -= 1
+            self._completed += 1
+        self._slots.release()
+
+    def _call(self, func, args, kwargs):
+        with self._lock:
+            self._active += 1
+        # Same connection lifecycle as a synchronous request
+        close_old_connections()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            close_old_connections()
+            with self._lock:
+                self._active -= 1
+
+    def _submit(self, func, args, kwargs):
+        """Queue func on the pool, holding a slot until the worker is done with it"""
+        try:
+            future = self._pool.submit(self._call, func, args, kwargs)
+        except BaseException:
+            self._release()
+            raise
+        # A request that is cancelled (the client went away) stops awaiting, but the
+        # worker keeps running; the slot is freed when the job itself finishes
+        future.add_done_callback(lambda _future: self._release())
+        return asyncio.wrap_future(future)
+
+    async def run(self, func, *args, **kwargs):
+        """Run func on a worker thread; raises ExecutorSaturated when the queue is full"""
+        self._admit()
+        return await self._submit(func, args, kwargs)
+
+    def stream(self, iterable, max_buffer=64):
+        """Async iterator over a blocking iterable that is consumed on one worker thread.
+
+        The whole iteration runs as a single job, so a cursor held by a generator
+        stays on the thread that opened it. At most max_buffer items are read ahead
+        of the consumer. The slot is taken when iteration starts, so a stream that
+        is never consumed holds none; ExecutorSaturated is raised from the first item.
+        """
+        return self._stream(iterable, max_buffer)
+
+    async def _stream(self, iterable, max_buffer):
+        self._admit()
+        loop = asyncio.get_running_loop()
+        queue = asyncio.Queue(max_buffer)
+        stopped = threading.Event()
+
+        def produce():
+            try:
+                for item in iterable:
+                    if stopped.is_set():
+                        break
+                    asyncio.run_coroutine_threadsafe(queue.put(item), loop).result()
+            except BaseException as e:
+                item = e
+            else:
+                item = _STREAM_END
+            finally:
+                close = getattr(iterable, 'close', None)
+                if close is not None:
+                    close()
+            if not stopped.is_set():
+                asyncio.run_coroutine_threadsafe(queue.put(item), loop).result()
+
+        producer = self._submit(produce, (), {})
+        try:
+            while True:
+                item = await queue.get()
+                if item is _STREAM_END:
+                    break
+                if isinstance(item, BaseException):
+                    raise item
+                yield item
+        finally:
+            stopped.set()
+            # Unblock a producer waiting on a full buffer so the worker is freed
+            while not queue.empty():
+                queue.get_nowait()
+            await producer
+
+    def stats(self):
+        with self._lock:
+            return {
+                "workers": self.max_workers,
+                "max_queue": self.max_queue,
+                "active": self._active,
+                "queued": max(self._pending - self._active, 0),
+                "completed": self._completed,
+                "rejected": self._rejected,
+            }
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_db_executor(create=True):
+    """The process-wide executor configured by RAG_DB_EXECUTOR; None if create is false and none has started"""
+    global _executor
+    if _executor is None and create:
+        with _executor_lock:
+            if _executor is None:
+                config = getattr(settings, 'RAG_DB_EXECUTOR', {})
+                _executor = DatabaseExecutor(
+                    max_workers=config.get('MAX_WORKERS', 8),
+                    max_queue=config.get('MAX_QUEUE', 32),
+                )
+    return _executor
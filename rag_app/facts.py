@@ -0,0 +1,236 @@
+import functools
+
+from django.conf import settings
+from django.db import DatabaseError, connection, transaction
+
+# task_facts holds the /query/ join pre-computed: one row per hotwash_rowcell_data
+# row and matching status_dropdown entry, carrying every column the views return or
+# filter on. Triggers on the six source tables re-derive the affected rows on each
+# write, so the table never lags the live join.
+FACTS_TABLE = 'task_facts'
+
+# The join /query/ runs against the live tables, and task_facts materializes
+LIVE_JOIN = """
+        FROM hotwash_rowcell_data gcd
+        LEFT JOIN hotwash_groups_header gh ON gcd.column_id = gh.id
+        LEFT JOIN hotwash_sheet hs ON gcd.sheet_id = hs.id
+        LEFT JOIN hotwash_workspace hw ON hs.workspace_id = hw.id
+        LEFT JOIN authentication_user au ON hw.user_id = au.id
+        LEFT JOIN hotwash_status_dropdown sd ON (gcd.sheet_id = sd.sheet_id AND gcd.column_id = sd.column_id)
+        """
+
+# (column, declared type, expression over LIVE_JOIN). The keys of the source tables
+# (sheet_id, column_id, workspace_id, owner_id) are kept so triggers can find the
+# rows a change to a dimension table affects.
+COLUMNS = [
+    ('cell_id', 'integer NOT NULL', 'gcd.id'),
+    ('status_id', 'integer NOT NULL', 'COALESCE(sd.id, 0)'),
+    ('cell_data', 'text', 'gcd.cell_data'),
+    ('cell_date', 'date', 'gcd.cell_date'),
+    ('created_at', 'datetime', 'gcd.created_at'),
+    ('updated_at', 'datetime', 'gcd.updated_at'),
+    ('column_type', 'varchar(50)', 'gcd.column_type'),
+    ('column_index', 'integer', 'gcd.column_index'),
+    ('sheet_id', 'integer', 'gcd.sheet_id'),
+    ('column_id', 'integer', 'gcd.column_id'),
+    ('workspace_id', 'integer', 'hs.workspace_id'),
+    ('owner_id', 'integer', 'hw.user_id'),
+    ('column_name', 'varchar(255)', 'gh.name'),
+    ('header_type', 'varchar(50)', 'gh.column_type'),
+    ('sheet_name', 'varchar(255)', 'hs.name'),
+    ('workspace_name', 'varchar(255)', 'hw.workspace_name'),
+    ('user_id', 'integer', 'au.id'),
+    ('user_name', 'varchar(150)', 'au.name'),
+    ('username', 'varchar(150)', 'au.username'),
+    ('status', 'varchar(100)', 'sd.status_text'),
+    ('status_color', 'varchar(20)', 'sd.status_color'),
+]
+COLUMN_NAMES = ', '.join(name for name, _type, _expr in COLUMNS)
+LIVE_SELECT = "SELECT " + ', '.join(f"{expr} AS {name}" for name, _type, expr in COLUMNS) + LIVE_JOIN
+
+CREATE_TABLE_SQL = (
+    f"CREATE TABLE IF NOT EXISTS {FACTS_TABLE} ("
+    + ', '.join(f"{name} {decl}" for name, decl, _expr in COLUMNS)
+    + ", PRIMARY KEY (cell_id, status_id))"
+)
+
+INDEXES = {
+    # Date windows, ORDER BY and keyset pagination
+    f'{FACTS_TABLE}_keyset': (
+        f"CREATE INDEX IF NOT EXISTS {FACTS_TABLE}_keyset ON {FACTS_TABLE} (cell_date, created_at, cell_id, status_id)"
+    ),
+    f'{FACTS_TABLE}_user_date': f"CREATE INDEX IF NOT EXISTS {FACTS_TABLE}_user_date ON {FACTS_TABLE} (user_id, cell_date)",
+    f'{FACTS_TABLE}_username': f"CREATE INDEX IF NOT EXISTS {FACTS_TABLE}_username ON {FACTS_TABLE} (username, cell_date)",
+    # Covers the summary roll-up of a date window
+    f'{FACTS_TABLE}_summary': f"CREATE INDEX IF NOT EXISTS {FACTS_TABLE}_summary ON {FACTS_TABLE} (cell_date, user_id, workspace_id, status)",
+    f'{FACTS_TABLE}_updated_at': f"CREATE INDEX IF NOT EXISTS {FACTS_TABLE}_updated_at ON {FACTS_TABLE} (updated_at)",
+    # Used by the triggers on the dimension tables
+    f'{FACTS_TABLE}_sheet': f"CREATE INDEX IF NOT EXISTS {FACTS_TABLE}_sheet ON {FACTS_TABLE} (sheet_id, column_id)",
+    f'{FACTS_TABLE}_column': f"CREATE INDEX IF NOT EXISTS {FACTS_TABLE}_column ON {FACTS_TABLE} (column_id)",
+    f'{FACTS_TABLE}_workspace': f"CREATE INDEX IF NOT EXISTS {FACTS_TABLE}_workspace ON {FACTS_TABLE} (workspace_id)",
+    f'{FACTS_TABLE}_owner': f"CREATE INDEX IF NOT EXISTS {FACTS_TABLE}_owner ON {FACTS_TABLE} (owner_id)",
+}
+# Replaced by an index above; dropped when the table is created again
+SUPERSEDED_INDEXES = [f'{FACTS_TABLE}_date']
+
+
+def _refresh(facts_condition, cells_condition):
+    """Trigger body that drops the facts matching one condition and re-derives the cells matching another"""
+    return (
+        f"DELETE FROM {FACTS_TABLE} WHERE {facts_condition};\n"
+        f"            INSERT OR REPLACE INTO {FACTS_TABLE} ({COLUMN_NAMES}) {LIVE_SELECT} WHERE {cells_condition};"
+    )
+
+
+# For each source table: (fact column(s), cell condition) per row image. Cells are
+# re-derived from the join, so moves between sheets, workspaces and owners are handled.
+_SOURCES = {
+    'hotwash_rowcell_data': (
+        lambda row: f"cell_id = {row}.id",
+        lambda row: f"gcd.id = {row}.id",
+    ),
+    'hotwash_groups_header': (
+        lambda row: f"column_id = {row}.id",
+        lambda row: f"gcd.column_id = {row}.id",
+    ),
+    'hotwash_sheet': (
+        lambda row: f"sheet_id = {row}.id",
+        lambda row: f"gcd.sheet_id = {row}.id",
+    ),
+    'hotwash_workspace': (
+        lambda row: f"workspace_id = {row}.id",
+        lambda row: f"gcd.sheet_id IN (SELECT id FROM hotwash_sheet WHERE workspace_id = {row}.id)",
+    ),
+    'authentication_user': (
+        lambda row: f"owner_id = {row}.id",
+        lambda row: (
+            "gcd.sheet_id IN (SELECT hs.id FROM hotwash_sheet hs "
+            f"JOIN hotwash_workspace hw ON hs.workspace_id = hw.id WHERE hw.user_id = {row}.id)"
+        ),
+    ),
+    'hotwash_status_dropdown': (
+        lambda row: f"(sheet_id = {row}.sheet_id AND column_id = {row}.column_id)",
+        lambda row: f"(gcd.sheet_id = {row}.sheet_id AND gcd.column_id = {row}.column_id)",
+    ),
+}
+
+
+def _build_triggers():
+    triggers = {}
+    for table, (facts_condition, cells_condition) in _SOURCES.items():
+        for event, rows in (('insert', ('new',)), ('delete', ('old',)), ('update', ('old', 'new'))):
+            name = f'{FACTS_TABLE}_{table}_{event}'
+            if event == 'delete' and table == 'hotwash_rowcell_data':
+                body = f"DELETE FROM {FACTS_TABLE} WHERE cell_id = old.id;"
+            else:
+                body = _refresh(
+                    ' OR '.join(facts_condition(row) for row in rows),
+                    ' OR '.join(cells_condition(row) for row in rows),
+                )
+            triggers[name] = (
+                f"CREATE TRIGGER IF NOT EXISTS {name} AFTER {event.upper()} ON {table} BEGIN\n"
+                f"            {body}\n"
+                f"        END"
+            )
+    return triggers
+
+
+TRIGGERS = _build_triggers()
+
+
+@functools.lru_cache(maxsize=None)
+def facts_available():
+    """Whether /query/ should read task_facts instead of the live join; checked once per process"""
+    if not getattr(settings, 'RAG_USE_TASK_FACTS', True):
+        return False
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = %s", [FACTS_TABLE])
+            return cursor.fetchone() is not None
+    except DatabaseError:
+        return False
+
+
+def create_table():
+    with connection.cursor() as cursor:
+        cursor.execute(CREATE_TABLE_SQL)
+        for name in SUPERSEDED_INDEXES:
+            cursor.execute(f"DROP INDEX IF EXISTS {name}")
+        for ddl in INDEXES.values():
+            cursor.execute(ddl)
+
+
+def install_triggers():
+    with connection.cursor() as cursor:
+        for ddl in TRIGGERS.values():
+            cursor.execute(ddl)
+
+
+def drop_triggers():
+    with connection.cursor() as cursor:
+        for name in TRIGGERS:
+            cursor.execute(f"DROP TRIGGER IF EXISTS {name}")
+
+
+def drop_table():
+    drop_triggers()
+    with connection.cursor() as cursor:
+        cursor.execute(f"DROP TABLE IF EXISTS {FACTS_TABLE}")
+    facts_available.cache_clear()
+
+
+def rebuild():
+    """Re-derive every row from the live join; returns the number of facts"""
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {FACTS_TABLE}")
+        cursor.execute(f"INSERT INTO {FACTS_TABLE} ({COLUMN_NAMES}) {LIVE_SELECT}")
+        cursor.execute(f"ANALYZE {FACTS_TABLE}")
+        cursor.execute(f"SELECT COUNT(*) FROM {FACTS_TABLE}")
+        return cursor.fetchone()[0]
+
+
+def refresh():
+    """Catch up without triggers: re-derive cells updated since the newest fact and drop deleted cells.
+
+    Returns (refreshed, removed). Edits to the dimension tables are only picked up
+    by the triggers or a rebuild.
+    """
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(f"SELECT COALESCE(MAX(updated_at), '') FROM {FACTS_TABLE}")
+        watermark = cursor.fetchone()[0]
+        cursor.execute(
+            f"DELETE FROM {FACTS_TABLE} WHERE cell_id IN "
+            "(SELECT id FROM hotwash_rowcell_data WHERE updated_at > %s)", [watermark]
+        )
+        cursor.execute(
+            f"INSERT OR REPLACE INTO {FACTS_TABLE} ({COLUMN_NAMES}) {LIVE_SELECT} WHERE gcd.updated_at > %s",
+            [watermark]
+        )
+        refreshed = cursor.rowcount
+        cursor.execute(
+            f"DELETE FROM {FACTS_TABLE} WHERE NOT EXISTS "
+            f"(SELECT 1 FROM hotwash_rowcell_data WHERE id = {FACTS_TABLE}.cell_id)"
+        )
+        return refreshed, cursor.rowcount
+
+
+def check_consistency(sample=10):
+    """Compare task_facts with the live join row by row.
+
+    Returns counts of facts, live rows, rows missing from task_facts and stale or
+    extra rows in it, plus up to sample cell ids of each kind.
+    """
+    facts = f"SELECT {COLUMN_NAMES} FROM {FACTS_TABLE}"
+    with connection.cursor() as cursor:
+        cursor.execute(f"SELECT COUNT(*) FROM {FACTS_TABLE}")
+        fact_rows = cursor.fetchone()[0]
+        cursor.execute(f"SELECT COUNT(*) {LIVE_JOIN}")
+        live_rows = cursor.fetchone()[0]
+        report = {"facts": fact_rows, "live": live_rows}
+        for label, query in (('missing', f"{LIVE_SELECT} EXCEPT {facts}"), ('stale', f"{facts} EXCEPT {LIVE_SELECT}")):
+            cursor.execute(f"SELECT COUNT(*) FROM ({query})")
+            report[label] = cursor.fetchone()[0]
+            cursor.execute(f"SELECT DISTINCT cell_id FROM ({query}) ORDER BY cell_id LIMIT %s", [sample])
+            report[f"{label}_ids"] = [row[0] for row in cursor.fetchall()]
+    report["consistent"] = report["missing"] == report["stale"] == 0
+    return report
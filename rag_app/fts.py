@@ -0,0 +1,85 @@
+import functools
+
+from django.conf import settings
+from django.db import DatabaseError, connection
+
+# External-content FTS5 index over hotwash_rowcell_data.cell_data. The index
+# stores only tokens; rows are joined back to the source table by rowid (= id).
+FTS_TABLE = 'rag_cell_fts'
+
+CREATE_TABLE_SQL = (
+    f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5("
+    "cell_data, content='hotwash_rowcell_data', content_rowid='id')"
+)
+
+# Keep the index in step with writes made by the application that owns the hotwash tables
+TRIGGERS = {
+    f'{FTS_TABLE}_ai': f"""
+        CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ai AFTER INSERT ON hotwash_rowcell_data BEGIN
+            INSERT INTO {FTS_TABLE}(rowid, cell_data) VALUES (new.id, new.cell_data);
+        END
+    """,
+    f'{FTS_TABLE}_ad': f"""
+        CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ad AFTER DELETE ON hotwash_rowcell_data BEGIN
+            INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, cell_data) VALUES ('delete', old.id, old.cell_data);
+        END
+    """,
+    f'{FTS_TABLE}_au': f"""
+        CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_au AFTER UPDATE OF cell_data ON hotwash_rowcell_data BEGIN
+            INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, cell_data) VALUES ('delete', old.id, old.cell_data);
+            INSERT INTO {FTS_TABLE}(rowid, cell_data) VALUES (new.id, new.cell_data);
+        END
+    """,
+}
+
+
+@functools.lru_cache(maxsize=None)
+def fts_available():
+    """Whether /query/ should use the FTS index; checked once per process"""
+    if not getattr(settings, 'RAG_USE_CELL_FTS', True):
+        return False
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT 1 FROM sqlite_master WHERE name = %s", [FTS_TABLE])
+            return cursor.fetchone() is not None
+    except DatabaseError:
+        return False
+
+
+def create_index():
+    with connection.cursor() as cursor:
+        cursor.execute(CREATE_TABLE_SQL)
+    fts_available.cache_clear()
+
+
+def install_triggers():
+    with connection.cursor() as cursor:
+        for ddl in TRIGGERS.values():
+            cursor.execute(ddl)
+
+
+def drop_index():
+    with connection.cursor() as cursor:
+        for name in TRIGGERS:
+            cursor.execute(f"DROP TRIGGER IF EXISTS {name}")
+        cursor.execute(f"DROP TABLE IF EXISTS {FTS_TABLE}")
+    fts_available.cache_clear()
+
+
+def rebuild_index():
+    """Re-tokenize every row of the content table"""
+    with connection.cursor() as cursor:
+        cursor.execute(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')")
+        # Admission control sizes MATCH lookups from the docsize row count in sqlite_stat1
+        cursor.execute(f"ANALYZE {FTS_TABLE}_docsize")
+
+
+def optimize_index():
+    """Merge the index b-trees into one segment for faster MATCH lookups"""
+    with connection.cursor() as cursor:
+        cursor.execute(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('optimize')")
+
+
+def phrase(text):
+    """Quote text as a single FTS5 phrase"""
+    return '"' + text.replace('"', '""') + '"'
@@ -0,0 +1,145 @@
+import atexit
+import logging
+import queue
+import threading
+import time
+
+from django.conf import settings
+from django.db import connection, transaction
+
+from .models import QueryHistory, QueryPayload
+
+logger = logging.getLogger(__name__)
+
+
+class HistoryWriter:
+    """Background sink that persists QueryHistory rows in batches.
+
+    Requests enqueue the row's fields and return immediately; a single worker
+    thread drains the queue and writes each batch with write_history in one
+    transaction. When the queue is full the row is dropped and counted rather
+    than making the request wait.
+    """
+
+    def __init__(self, batch_size=200, flush_interval=0.5, max_queue=10000):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.dropped = 0
+        self.written = 0
+        self.failed = 0
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def submit(self, **fields):
+        self._ensure_started()
+        try:
+            self._queue.put_nowait(fields)
+        except queue.Full:
+            with self._lock:
+                self.dropped += 1
+
+    def _ensure_started(self):
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='rag-history-writer', daemon=True)
+                self._thread.start()
+                atexit.register(self.stop)
+
+    def _run(self):
+        try:
+            while not (self._stop.is_set() and self._queue.empty()):
+                batch = self._drain()
+                if batch:
+                    self._write(batch)
+        finally:
+            connection.close()
+
+    def _drain(self):
+        """Collect up to batch_size rows, waiting at most flush_interval for them"""
+        batch = []
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=timeout))
+            except queue.Empty:
+                break
+        return batch
+
+    def _write(self, batch):
+        try:
+            write_history(batch)
+        except Exception:
+            logger.exception("Failed to write %d query history rows", len(batch))
+            with self._lock:
+                self.failed += len(batch)
+            connection.close()
+        else:
+            with self._lock:
+                self.written += len(batch)
+
+    def stop(self, timeout=10.0):
+        """Flush everything still queued and stop the worker"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "queued": self._queue.qsize(),
+                "written": self.written,
+                "dropped": self.dropped,
+                "failed": self.failed,
+            }
+
+
+def write_history(entries):
+    """Insert history rows, storing each distinct data_fetched payload only once"""
+    payloads = {}
+    rows = []
+    for fields in entries:
+        fields = dict(fields)
+        payload = QueryPayload.from_data(fields.pop('data_fetched'))
+        payloads.setdefault(payload.digest, payload)
+        rows.append(QueryHistory(payload_id=payload.digest, **fields))
+    with transaction.atomic():
+        # Payloads already stored by earlier requests are left untouched
+        QueryPayload.objects.bulk_create(payloads.values(), ignore_conflicts=True)
+        QueryHistory.objects.bulk_create(rows)
+
+
+_writer = None
+_writer_lock = threading.Lock()
+
+
+def get_history_writer():
+    """The process-wide writer configured by settings.RAG_HISTORY_WRITER, or None when disabled"""
+    global _writer
+    config = getattr(settings, 'RAG_HISTORY_WRITER', {})
+    if not config.get('ENABLED', True):
+        return None
+    if _writer is None:
+        with _writer_lock:
+            if _writer is None:
+                _writer = HistoryWriter(
+                    batch_size=config.get('BATCH_SIZE', 200),
+                    flush_interval=config.get('FLUSH_INTERVAL', 0.5),
+                    max_queue=config.get('MAX_QUEUE', 10000),
+                )
+    return _writer
+
+
+def record_query(**fields):
+    """Persist a QueryHistory row without blocking the caller when the writer is enabled"""
+    writer = get_history_writer()
+    if writer is None:
+        write_history([fields])
+    else:
+        writer.submit(**fields)
@@ -0,0 +1,138 @@
+from django.db import connection
+
+from .db import read_connection
+from .facts import facts_available
+from .fts import fts_available
+from .rollups import summary_query as rollup_summary_query
+from .sql_templates import (
+    DATE_CONDITIONS, USER_CONDITIONS, QueryIntent, build_count_template, build_shard_template,
+    build_sql_template, build_summary_template, date_params, retrieval_template, summary_intent,
+    user_params,
+)
+
+# Indexes the /query/ join needs on the hotwash tables. Those tables belong to
+# another application, so these are created by the advise_indexes command
+# rather than by a migration.
+RECOMMENDED_INDEXES = [
+    (
+        'rag_rowcell_date_created',
+        'hotwash_rowcell_data',
+        'CREATE INDEX IF NOT EXISTS rag_rowcell_date_created '
+        'ON hotwash_rowcell_data (cell_date, created_at)',
+    ),
+    (
+        'rag_rowcell_updated_at',
+        'hotwash_rowcell_data',
+        'CREATE INDEX IF NOT EXISTS rag_rowcell_updated_at '
+        'ON hotwash_rowcell_data (updated_at)',
+    ),
+    (
+        'rag_status_sheet_column',
+        'hotwash_status_dropdown',
+        'CREATE INDEX IF NOT EXISTS rag_status_sheet_column '
+        'ON hotwash_status_dropdown (sheet_id, column_id, status_text, status_color)',
+    ),
+]
+
+
+SAMPLE_USERS = {'user_id': '1', 'username': 'sample'}
+SAMPLE_GROUP_LIMIT = 10
+
+
+def sources():
+    """The sources the view can read: task_facts when it exists, and the live join it falls back to"""
+    return ('join', 'facts') if facts_available() else ('join',)
+
+
+def iter_intents():
+    """Every intent the view can emit, with sample bind parameters"""
+    match_modes = ('fts', 'fts_ranked') if fts_available() else ('like',)
+    for source in sources():
+        for user_filter in (None, *USER_CONDITIONS):
+            sample_user = SAMPLE_USERS.get(user_filter)
+            for match_mode in (match_modes if user_filter else ('like',)):
+                for date_window in DATE_CONDITIONS:
+                    # Ranked results are ordered by relevance and are never paginated
+                    for paginated in ((False,) if match_mode == 'fts_ranked' else (False, True)):
+                        intent = QueryIntent(user_filter, date_window, match_mode, paginated, source)
+                        params = user_params(user_filter, sample_user, match_mode) + date_params(date_window)
+                        if paginated:
+                            params += ['9999-12-31', '9999-12-31 00:00:00', 0, 0]
+                        yield intent, params + [50]
+
+
+def iter_templates():
+    """(kind, intent, sql, params) for every statement the views can run.
+
+    kind is 'rows', 'shard' (the rows template with its sort key, planned here because
+    the shard files carry the same indexes), 'summary', 'count', 'rollup' (a summary read
+    from the daily roll-ups) or 'retrieval', whose intent is None.
+    """
+    for intent, params in iter_intents():
+        yield 'rows', intent, build_sql_template(intent), params
+        yield 'shard', intent, build_shard_template(intent), params
+        # Summaries and counts cover the whole window, unranked, so one per unpaginated intent
+        if intent.paginated or intent.match_mode == 'fts_ranked':
+            continue
+        sample_user = SAMPLE_USERS.get(intent.user_filter)
+        window_params = user_params(intent.user_filter, sample_user, intent.match_mode) + date_params(intent.date_window)
+        yield 'summary', intent, build_summary_template(intent), window_params + [SAMPLE_GROUP_LIMIT] * 3
+        yield 'count', intent, build_count_template(summary_intent(intent)), window_params
+        rollup = rollup_summary_query(intent, sample_user, SAMPLE_GROUP_LIMIT)
+        if rollup is not None:
+            yield ('rollup', intent, *rollup)
+    for source in sources():
+        yield 'retrieval', None, retrieval_template(source), ['[1, 2, 3]']
+
+
+def explain(sql, params=None):
+    """Return the EXPLAIN QUERY PLAN detail lines for a statement"""
+    with read_connection().cursor() as cursor:
+        cursor.execute('EXPLAIN QUERY PLAN ' + sql, params or [])
+        return [row[3] for row in cursor.fetchall()]
+
+
+def full_scans(plan):
+    """Plan steps that read a whole table or index instead of searching it"""
+    # Scanning a materialized, co-routine or FROM-clause subquery reads its (already
+    # filtered) result, and json_each walks a bound list, not a table
+    materialized = {detail.split()[1] for detail in plan if detail.startswith(('MATERIALIZE ', 'CO-ROUTINE '))}
+    return [
+        detail for detail in plan
+        if detail.startswith('SCAN ') and 'CONSTANT ROW' not in detail
+        and detail.split()[1] not in materialized
+        and not detail.split()[1].startswith(('(subquery-', 'json_each'))
+        # FTS5 reports a MATCH lookup as a virtual table scan with an 'M' plan
+        and not ('VIRTUAL TABLE INDEX' in detail and ':M' in detail)
+    ]
+
+
+def existing_indexes():
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT name FROM sqlite_master WHERE type = 'index'")
+        return {row[0] for row in cursor.fetchall()}
+
+
+def missing_indexes():
+    """Recommended indexes whose table exists but whose index does not"""
+    tables = set(connection.introspection.table_names())
+    present = existing_indexes()
+    return [
+        (name, table, ddl) for name, table, ddl in RECOMMENDED_INDEXES
+        if table in tables and name not in present
+    ]
+
+
+def create_indexes(indexes):
+    with connection.cursor() as cursor:
+        for _name, table, ddl in indexes:
+            cursor.execute(ddl)
+            # Refresh sqlite_stat1 so the planner knows about the new index
+            cursor.execute(f'ANALYZE {table}')
+
+
+def analyze_templates():
+    """Yield (kind, intent, plan, scans) for every SQL template the views can emit"""
+    for kind, intent, sql, params in iter_templates():
+        plan = explain(sql, params)
+        yield kind, intent, plan, full_scans(plan)
@@ -0,0 +1,154 @@
+import functools
+import re
+from typing import NamedTuple, Optional
+
+from django.conf import settings
+
+# Every ASCII character that can't be part of a token becomes a separator, so one
+# translate + split pass tokenizes the query
+SEPARATORS = str.maketrans({
+    chr(code): ' ' for code in range(128)
+    if not (chr(code).isalnum() or chr(code) in '_@"')
+})
+USER_ID_TOKEN_RE = re.compile(r'user(?:id)?(\d+)')
+NAME_RE = re.compile(r'[a-z0-9_]+')
+
+# Keyword phrases, as token sequences, mapped to (category, value)
+KEYWORDS = {
+    ('today',): ('date', 'today'),
+    ('yesterday',): ('date', 'yesterday'),
+    ('past', '7', 'days'): ('date', 'past_7_days'),
+    ('last', 'week'): ('date', 'past_7_days'),
+    ('this', 'week'): ('date', 'this_week'),
+    ('status',): ('style', 'detail'),
+    ('what',): ('style', 'detail'),
+    ('user',): ('user', 'any'),
+    ('user', 'id'): ('user', 'id'),
+    ('userid',): ('user', 'id'),
+    ('user', 'name'): ('user', 'name'),
+    ('username',): ('user', 'name'),
+}
+
+# When several date phrases appear the earliest in this list wins
+DATE_PRIORITY = ['today', 'yesterday', 'past_7_days', 'this_week']
+DEFAULT_DATE_WINDOW = 'past_7_days'
+
+# Words that follow "user" in ordinary phrasing and are never usernames
+STOPWORDS = frozenset("""
+    a an and any are as at by did do does done for from has have in is it its
+    last of on or past s status task tasks the this to today was were what
+    which who with yesterday week
+""".split())
+
+
+def _build_trie(keywords):
+    root = {}
+    for phrase, match in keywords.items():
+        node = root
+        for token in phrase:
+            node = node.setdefault(token, {})
+        node[None] = (len(phrase), match)
+    return root
+
+
+KEYWORD_TRIE = _build_trie(KEYWORDS)
+
+
+class ParsedQuery(NamedTuple):
+    """Everything the view needs to know about a question, from one tokenizer pass"""
+    user_id: Optional[str]
+    username: Optional[str]
+    date_window: str
+    style: str  # 'detail' lists individual tasks, 'summary' aggregates them
+
+    @property
+    def user_filter(self):
+        if self.user_id is not None:
+            return 'user_id'
+        if self.username is not None:
+            return 'username'
+        return None
+
+    @property
+    def user_value(self):
+        return self.user_id if self.user_id is not None else self.username
+
+
+def tokenize(text):
+    """Return (token, kind) pairs where kind is 'word', 'quoted' or 'handle'"""
+    tokens = []
+    for chunk in text.lower().translate(SEPARATORS).split():
+        if chunk[0] == '@':
+            # A bare @, or one not followed by a name, refers to nobody
+            if NAME_RE.fullmatch(chunk[1:]):
+                tokens.append((chunk[1:], 'handle'))
+        elif '"' in chunk:
+            tokens.append((chunk.replace('"', ''), 'quoted'))
+        else:
+            tokens.append((chunk, 'word'))
+    return tokens
+
+
+def _longest_keyword(tokens, start):
+    node = KEYWORD_TRIE
+    found = None
+    for i in range(start, len(tokens)):
+        token, kind = tokens[i]
+        node = node.get(token) if kind == 'word' else None
+        if node is None:
+            break
+        found = node.get(None, found)
+    return found
+
+
+def _user_reference(marker, token, kind):
+    """Interpret the token after a user keyword as (user_id, username)"""
+    if kind != 'word':
+        return (None, token) if NAME_RE.fullmatch(token) else (None, None)
+    if token.isdigit():
+        return token, None
+    if marker != 'id' and token not in STOPWORDS:
+        return None, token
+    return None, None
+
+
+@functools.lru_cache(maxsize=getattr(settings, 'RAG_INTENT_CACHE_SIZE', 4096))
+def parse_query(text):
+    """Parse a question into a ParsedQuery; memoized because dashboards repeat questions"""
+    tokens = tokenize(text)
+    user_id = username = None
+    dates = set()
+    style = 'summary'
+
+    i = 0
+    while i < len(tokens):
+        token, kind = tokens[i]
+        match = _longest_keyword(tokens, i) if token in KEYWORD_TRIE else None
+        if match is None:
+            if kind == 'handle' and username is None:
+                username = token
+            elif kind == 'word' and user_id is None and token.startswith('user'):
+                # "user12" / "userid12" written without a space
+                id_match = USER_ID_TOKEN_RE.fullmatch(token)
+                if id_match:
+                    user_id = id_match.group(1)
+            i += 1
+            continue
+
+        length, (category, value) = match
+        i += length
+        if category == 'date':
+            dates.add(value)
+        elif category == 'style':
+            style = value
+        elif category == 'user' and i < len(tokens):
+            found_id, found_name = _user_reference(value, *tokens[i])
+            if found_id is not None and user_id is None:
+                user_id = found_id
+            if found_name is not None and username is None:
+                username = found_name
+            if found_id is not None or found_name is not None:
+                i += 1
+
+    date_window = next((window for window in DATE_PRIORITY if window in dates), DEFAULT_DATE_WINDOW)
+    return ParsedQuery(user_id, None if user_id is not None else username, date_window, style)
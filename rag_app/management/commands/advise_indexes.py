@@ -0,0 +1,53 @@
+from django.core.management.base import BaseCommand
+
+from rag_app.indexes import analyze_templates, create_indexes, missing_indexes
+
+
+class Command(BaseCommand):
+    help = (
+        "Run EXPLAIN QUERY PLAN on every SQL template the views can emit, report full "
+        "table scans and create the recommended hotwash indexes that are missing."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--apply', action='store_true',
+            help='Create missing indexes instead of only listing them.',
+        )
+        parser.add_argument(
+            '--plans', action='store_true',
+            help='Print the full query plan for every template.',
+        )
+
+    def handle(self, *args, **options):
+        missing = missing_indexes()
+        if missing and options['apply']:
+            create_indexes(missing)
+            for name, table, _ddl in missing:
+                self.stdout.write(self.style.SUCCESS(f"Created {name} on {table}"))
+            missing = []
+        for name, table, ddl in missing:
+            self.stdout.write(self.style.WARNING(f"Missing {name} on {table}: {ddl}"))
+
+        scanning = 0
+        for kind, intent, plan, scans in analyze_templates():
+            label = kind
+            if intent is not None:
+                label += (
+                    f" source={intent.source} user_filter={intent.user_filter or '-'} "
+                    f"date_window={intent.date_window} match_mode={intent.match_mode} paginated={intent.paginated}"
+                )
+            if scans:
+                scanning += 1
+                self.stdout.write(self.style.WARNING(f"{label}: {len(scans)} full scan(s)"))
+                for detail in scans:
+                    self.stdout.write(f"    {detail}")
+            else:
+                self.stdout.write(f"{label}: ok")
+            if options['plans']:
+                for detail in plan:
+                    self.stdout.write(f"    | {detail}")
+
+        if missing:
+            self.stdout.write("Run with --apply to create the missing indexes.")
+        self.stdout.write(f"{scanning} template(s) with full table scans.")
@@ -0,0 +1,266 @@
+import io
+import json
+import platform
+import random
+import sqlite3
+import sys
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+import django
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.utils import timezone
+
+# Stage name -> (method, path, weight in the default mix)
+STAGES = {
+    'query_detail': ('POST', '/api/query/', 35),
+    'query_summary': ('POST', '/api/query/', 25),
+    'query_ranked': ('POST', '/api/query/', 10),
+    'query_paged': ('POST', '/api/query/', 10),
+    'schema': ('GET', '/api/schema/', 10),
+    'history': ('GET', '/api/history/', 10),
+}
+
+DETAIL_TEMPLATES = [
+    "what is the status of user {user_id} {window}",
+    "what did user {username} do {window}",
+    "status of userid {user_id} {window}",
+]
+SUMMARY_TEMPLATES = [
+    "summary {window}",
+    "tasks for user {user_id} {window}",
+    "overview of user {username} {window}",
+]
+WINDOWS = ['today', 'yesterday', 'last week', 'this week', 'past 7 days']
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, round(fraction * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+def summarize(latencies, elapsed, errors):
+    latencies = sorted(latencies)
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "throughput": len(latencies) / elapsed if elapsed else 0.0,
+        "mean_ms": sum(latencies) / len(latencies) * 1000 if latencies else None,
+        "p50_ms": percentile(latencies, 0.50) * 1000 if latencies else None,
+        "p95_ms": percentile(latencies, 0.95) * 1000 if latencies else None,
+        "p99_ms": percentile(latencies, 0.99) * 1000 if latencies else None,
+    }
+
+
+class Command(BaseCommand):
+    help = (
+        "Drive /query/, /schema/ and /history/ with a mixed query corpus at a fixed concurrency "
+        "and report throughput and p50/p95/p99 per stage, saved as JSON for comparison."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=2000, help='Measured requests.')
+        parser.add_argument('--warmup', type=int, default=200, help='Unmeasured requests sent first.')
+        parser.add_argument('--concurrency', type=int, default=16)
+        parser.add_argument(
+            '--mix', help='Stage weights, e.g. "query_detail=50,schema=50" (default: ' +
+            ', '.join(f"{name}={weight}" for name, (_m, _p, weight) in STAGES.items()) + ').',
+        )
+        parser.add_argument(
+            '--base-url',
+            help='Benchmark a running server (e.g. http://127.0.0.1:8000) instead of the in-process WSGI handler.',
+        )
+        parser.add_argument('--seed', type=int, default=7)
+        parser.add_argument('--output', help='Where to write the JSON report (default: bench-<timestamp>.json).')
+        parser.add_argument('--compare', help='Earlier JSON report to compare against.')
+        parser.add_argument(
+            '--threshold', type=float, default=10.0,
+            help='With --compare, fail when a stage p95 or throughput regresses by more than this percent.',
+        )
+
+    def handle(self, *args, **options):
+        weights = self.parse_mix(options['mix'])
+        rng = random.Random(options['seed'])
+        corpus = self.build_corpus(rng)
+        plan = rng.choices(list(weights), weights=list(weights.values()), k=options['warmup'] + options['requests'])
+        requests = [(stage, self.make_request(stage, rng, corpus)) for stage in plan]
+        send = self.http_sender(options['base_url']) if options['base_url'] else self.wsgi_sender()
+
+        warmup, measured = requests[:options['warmup']], requests[options['warmup']:]
+        if warmup:
+            self.run(send, warmup, options['concurrency'])
+        results, elapsed = self.run(send, measured, options['concurrency'])
+
+        report = {
+            "created_at": timezone.now().isoformat(),
+            "config": {
+                "requests": options['requests'],
+                "warmup": options['warmup'],
+                "concurrency": options['concurrency'],
+                "mix": weights,
+                "seed": options['seed'],
+                "target": options['base_url'] or 'in-process WSGI',
+            },
+            "environment": self.environment(),
+            "total": summarize([latency for _stage, latency, _ok in results], elapsed,
+                               sum(1 for _stage, _latency, ok in results if not ok)),
+            "stages": {},
+        }
+        for stage in weights:
+            stage_results = [(latency, ok) for name, latency, ok in results if name == stage]
+            report["stages"][stage] = summarize(
+                [latency for latency, _ok in stage_results], elapsed,
+                sum(1 for _latency, ok in stage_results if not ok),
+            )
+
+        self.print_report(report)
+        output = options['output'] or f"bench-{timezone.now():%Y%m%d-%H%M%S}.json"
+        with open(output, 'w') as f:
+            json.dump(report, f, indent=2)
+        self.stdout.write(f"Saved {output}")
+
+        if options['compare']:
+            self.compare(options['compare'], report, options['threshold'])
+
+    def parse_mix(self, mix):
+        if not mix:
+            return {name: weight for name, (_method, _path, weight) in STAGES.items()}
+        weights = {}
+        for part in mix.split(','):
+            name, _, weight = part.partition('=')
+            name = name.strip()
+            if name not in STAGES:
+                raise CommandError(f"Unknown stage {name!r}; choose from {', '.join(STAGES)}")
+            try:
+                weights[name] = float(weight or 1)
+            except ValueError:
+                raise CommandError(f"Invalid weight for {name}: {weight!r}")
+        return weights
+
+    def build_corpus(self, rng):
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT id, username FROM authentication_user ORDER BY id LIMIT 1000")
+            users = cursor.fetchall()
+        if not users:
+            raise CommandError("authentication_user is empty; run generate_hotwash_data first")
+        return users
+
+    def make_request(self, stage, rng, users):
+        method, path, _weight = STAGES[stage]
+        if method == 'GET':
+            return method, path, None
+        # Low ids are the busiest users with the default generator skew
+        user_id, username = users[min(int(rng.expovariate(1 / 10)), len(users) - 1)]
+        fields = {"user_id": user_id, "username": username, "window": rng.choice(WINDOWS)}
+        templates = DETAIL_TEMPLATES if stage in ('query_detail', 'query_ranked') else SUMMARY_TEMPLATES
+        body = {"query": rng.choice(templates).format(**fields)}
+        if stage == 'query_ranked':
+            body["ranked"] = True
+        elif stage == 'query_paged':
+            body["page_size"] = 200
+        return method, path, json.dumps(body).encode()
+
+    def wsgi_sender(self):
+        from django.core.handlers.wsgi import WSGIHandler
+
+        handler = WSGIHandler()
+
+        def send(method, path, body):
+            body = body or b''
+            environ = {
+                'REQUEST_METHOD': method, 'PATH_INFO': path, 'SCRIPT_NAME': '', 'QUERY_STRING': '',
+                'SERVER_NAME': 'bench', 'SERVER_PORT': '80', 'SERVER_PROTOCOL': 'HTTP/1.1',
+                'CONTENT_TYPE': 'application/json', 'CONTENT_LENGTH': str(len(body)),
+                'wsgi.input': io.BytesIO(body), 'wsgi.url_scheme': 'http', 'wsgi.errors': sys.stderr,
+                'wsgi.multithread': True, 'wsgi.multiprocess': False, 'wsgi.run_once': False,
+            }
+            status = []
+            response = handler(environ, lambda s, headers, exc_info=None: status.append(s))
+            for _chunk in response:
+                pass
+            response.close()
+            return int(status[0].split()[0])
+
+        return send
+
+    def http_sender(self, base_url):
+        base_url = base_url.rstrip('/')
+
+        def send(method, path, body):
+            request = urllib.request.Request(
+                base_url + path, data=body, method=method,
+                headers={'Content-Type': 'application/json'},
+            )
+            try:
+                with urllib.request.urlopen(request, timeout=60) as response:
+                    response.read()
+                    return response.status
+            except urllib.error.HTTPError as e:
+                return e.code
+            except OSError:
+                return 0
+
+        return send
+
+    def run(self, send, requests, concurrency):
+        def one(item):
+            stage, (method, path, body) = item
+            start = time.perf_counter()
+            status = send(method, path, body)
+            return stage, time.perf_counter() - start, 200 <= status < 400
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            results = list(pool.map(one, requests))
+        return results, time.perf_counter() - start
+
+    def environment(self):
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT COUNT(*) FROM hotwash_rowcell_data")
+            cells = cursor.fetchone()[0]
+            cursor.execute("SELECT COUNT(*) FROM authentication_user")
+            users = cursor.fetchone()[0]
+        return {
+            "python": platform.python_version(),
+            "django": django.get_version(),
+            "sqlite": sqlite3.sqlite_version,
+            "platform": platform.platform(),
+            "cells": cells,
+            "users": users,
+        }
+
+    def print_report(self, report):
+        self.stdout.write(
+            f"{report['config']['requests']} requests at concurrency {report['config']['concurrency']} "
+            f"({report['environment']['cells']} cells, {report['config']['target']})"
+        )
+        self.stdout.write(f"{'stage':<14} {'req':>6} {'err':>5} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+        for name, stats in list(report['stages'].items()) + [('total', report['total'])]:
+            if not stats['requests']:
+                continue
+            self.stdout.write(
+                f"{name:<14} {stats['requests']:>6} {stats['errors']:>5} {stats['throughput']:8.1f} "
+                f"{stats['p50_ms']:8.2f} {stats['p95_ms']:8.2f} {stats['p99_ms']:8.2f}"
+            )
+
+    def compare(self, path, report, threshold):
+        with open(path) as f:
+            baseline = json.load(f)
+        regressions = []
+        self.stdout.write(f"Compared with {path} ({baseline.get('created_at', '?')}):")
+        for name, stats in list(report['stages'].items()) + [('total', report['total'])]:
+            old = baseline['total'] if name == 'total' else baseline.get('stages', {}).get(name)
+            if not old or not old.get('requests') or not stats['requests']:
+                continue
+            p95_change = (stats['p95_ms'] - old['p95_ms']) / old['p95_ms'] * 100
+            throughput_change = (stats['throughput'] - old['throughput']) / old['throughput'] * 100
+            self.stdout.write(f"  {name:<14} p95 {p95_change:+6.1f}%  throughput {throughput_change:+6.1f}%")
+            if p95_change > threshold or -throughput_change > threshold:
+                regressions.append(name)
+        if regressions:
+            raise CommandError(f"Regressed by more than {threshold}%: {', '.join(regressions)}")
@@ -0,0 +1,112 @@
+import re
+import time
+
+from django.core.management.base import BaseCommand
+
+from rag_app.intent import parse_query
+from rag_app.models import QueryHistory
+
+# Used when query_history has too few distinct questions to be representative
+FALLBACK_CORPUS = [
+    "what is the status of user 12 today",
+    "What is the status of user 3 yesterday?",
+    "show tasks for user john_doe this week",
+    "summary of the past 7 days",
+    "what did user 7 do last week",
+    "status user42 today",
+    "tasks for username \"jane\" yesterday",
+    "what happened today",
+    "give me an overview of all users this week",
+    "what is user bob working on",
+    "list everything from last week",
+    "user id 19 status",
+]
+
+
+def legacy_parse(query):
+    """Intent extraction as generate_sql_query and generate_response did it before the parser"""
+    query_lower = query.lower()
+    user_id_match = re.search(r'user\s*(?:id\s*)?(\d+)', query_lower)
+    username_match = re.search(r'user\s*(?:name\s*)?"?([a-zA-Z0-9_]+)"?', query_lower)
+    if 'today' in query_lower:
+        date_window = 'today'
+    elif 'yesterday' in query_lower:
+        date_window = 'yesterday'
+    elif 'past 7 days' in query_lower or 'last week' in query_lower:
+        date_window = 'past_7_days'
+    elif 'this week' in query_lower:
+        date_window = 'this_week'
+    else:
+        date_window = 'past_7_days'
+    if user_id_match:
+        user = ('user_id', user_id_match.group(1))
+    elif username_match:
+        user = ('username', username_match.group(1))
+    else:
+        user = (None, None)
+    query_lower = query.lower()
+    style = 'detail' if 'status' in query_lower or 'what' in query_lower else 'summary'
+    return user, date_window, style
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark the intent parser against the previous regex/substring extraction over "
+        "the distinct questions in query_history."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--limit', type=int, default=5000, help='Distinct queries to load from history.')
+        parser.add_argument('--repeat', type=int, default=20, help='Passes over the corpus; the best is reported.')
+        parser.add_argument('--show-diff', action='store_true', help='Print queries the two parsers read differently.')
+
+    def handle(self, *args, **options):
+        corpus = list(
+            QueryHistory.objects.values_list('query', flat=True).distinct()[:options['limit']]
+        )
+        source = 'query_history'
+        if len(corpus) < len(FALLBACK_CORPUS):
+            corpus, source = FALLBACK_CORPUS, 'built-in corpus'
+        self.stdout.write(f"{len(corpus)} queries from {source}, best of {options['repeat']}")
+
+        def parse_cold():
+            parse_query.cache_clear()
+            for query in corpus:
+                parse_query(query)
+
+        def parse_warm():
+            for query in corpus:
+                parse_query(query)
+
+        legacy = self._best(options['repeat'], lambda: [legacy_parse(query) for query in corpus])
+        cold = self._best(options['repeat'], parse_cold)
+        parse_warm()
+        warm = self._best(options['repeat'], parse_warm)
+        self._report('legacy regex + substring scans', legacy, len(corpus))
+        self._report('parse_query, cold cache', cold, len(corpus), legacy)
+        self._report('parse_query, memoized', warm, len(corpus), legacy)
+
+        differing = []
+        for query in corpus:
+            user, date_window, style = legacy_parse(query)
+            parsed = parse_query(query)
+            if (user, date_window, style) != ((parsed.user_filter, parsed.user_value), parsed.date_window, parsed.style):
+                differing.append((query, (user, date_window, style), parsed))
+        self.stdout.write(f"{len(differing)} queries parsed differently from the legacy rules")
+        if options['show_diff']:
+            for query, old, new in differing:
+                self.stdout.write(f"  {query!r}\n    legacy: {old}\n    parser: {new}")
+
+    def _best(self, repeat, fn):
+        best = float('inf')
+        for _ in range(repeat):
+            start = time.perf_counter()
+            fn()
+            best = min(best, time.perf_counter() - start)
+        return best
+
+    def _report(self, label, seconds, count, baseline=None):
+        line = f"{label:<34} {seconds * 1e6 / count:8.3f} us/query"
+        if baseline:
+            line += f"  ({baseline / seconds:.1f}x)"
+        self.stdout.write(line)
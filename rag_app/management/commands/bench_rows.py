@@ -0,0 +1,97 @@
+import datetime
+import time
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from rest_framework.renderers import JSONRenderer
+
+from rag_app.renderers import FastJSONRenderer, orjson
+from rag_app.rows import plan_rows
+from rag_app.sql_templates import BASE_QUERY
+
+COLUMNS = [
+    'id', 'task', 'date', 'column_type', 'column_index', 'column_name', 'header_type',
+    'sheet_name', 'workspace_name', 'user_name', 'username', 'status', 'status_color',
+]
+
+
+def legacy_convert(columns, results):
+    """Row conversion as execute_query did it before converters were planned per shape"""
+    data = []
+    for row in results:
+        row_dict = {}
+        for i, value in enumerate(row):
+            if hasattr(value, 'strftime'):
+                row_dict[columns[i]] = value.strftime('%Y-%m-%d') if hasattr(value, 'date') else str(value)
+            elif isinstance(value, Decimal):
+                row_dict[columns[i]] = float(value)
+            else:
+                row_dict[columns[i]] = value
+        data.append(row_dict)
+    return data
+
+
+def synthetic_rows(count):
+    today = datetime.date.today()
+    return [
+        (
+            i, f'Task {i} for user {i % 40}', today - datetime.timedelta(days=i % 30), 'text',
+            i % 12, f'Column {i % 12}', 'text', f'Sheet {i % 25}', f'Workspace {i % 8}',
+            f'User {i % 40}', f'user{i % 40}', 'In progress', '#f5a623',
+        )
+        for i in range(count)
+    ]
+
+
+class Command(BaseCommand):
+    help = (
+        "Micro-benchmark /query/ row conversion and JSON rendering: per-cell checks versus "
+        "per-shape converter plans, and DRF's JSONRenderer versus FastJSONRenderer."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=5000, help='Rows per run.')
+        parser.add_argument('--repeat', type=int, default=20, help='Runs per variant; the best is reported.')
+        parser.add_argument(
+            '--live', action='store_true',
+            help='Benchmark rows fetched from hotwash_rowcell_data instead of synthetic rows.',
+        )
+
+    def handle(self, *args, **options):
+        rows, description = self._load_rows(options)
+        columns = [col[0] for col in description]
+        repeat = options['repeat']
+        self.stdout.write(f"{len(rows)} rows x {len(columns)} columns, best of {repeat}")
+
+        legacy = self._best(repeat, lambda: legacy_convert(columns, rows))
+        planned = self._best(repeat, lambda: plan_rows(description, rows[0]).convert(rows))
+        self._report('convert: per-cell checks', legacy, len(rows))
+        self._report('convert: planned columns', planned, len(rows), legacy)
+
+        payload = {"data_fetched": plan_rows(description, rows[0]).convert(rows)}
+        drf = self._best(repeat, lambda: JSONRenderer().render(payload))
+        fast = self._best(repeat, lambda: FastJSONRenderer().render(payload))
+        self._report('render: JSONRenderer', drf, len(rows))
+        self._report(f"render: FastJSONRenderer ({'orjson' if orjson else 'stdlib'})", fast, len(rows), drf)
+
+    def _load_rows(self, options):
+        if not options['live']:
+            return synthetic_rows(options['rows']), [(name,) for name in COLUMNS]
+        from rag_app.db import read_connection
+        with read_connection().cursor() as cursor:
+            cursor.execute(BASE_QUERY + " LIMIT %s", [options['rows']])
+            return cursor.fetchall(), cursor.description
+
+    def _best(self, repeat, fn):
+        best = float('inf')
+        for _ in range(repeat):
+            start = time.perf_counter()
+            fn()
+            best = min(best, time.perf_counter() - start)
+        return best
+
+    def _report(self, label, seconds, rows, baseline=None):
+        line = f"{label:<44} {seconds * 1e6 / rows:8.3f} us/row"
+        if baseline:
+            line += f"  ({baseline / seconds:.1f}x)"
+        self.stdout.write(line)
@@ -0,0 +1,168 @@
+import asyncio
+import io
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+# RAG_ASYNC_VIEWS for each mode; it is read at startup, so every mode runs in its own process
+MODES = {
+    'wsgi': '0',        # WSGIHandler on a thread per connection, like a threaded WSGI server
+    'asgi-sync': '0',   # ASGIHandler with the synchronous DRF views
+    'asgi': '1',        # ASGIHandler with rag_app.async_views, as rag_api/asgi.py serves it
+}
+
+QUERIES = [
+    "what is the status of user {n} today",
+    "tasks for user {n} yesterday",
+    "summary for user {n} this week",
+]
+
+
+def request_body(n):
+    # A distinct question per request keeps the result cache out of the measurement
+    return json.dumps({"query": QUERIES[n % len(QUERIES)].format(n=n)}).encode()
+
+
+class Command(BaseCommand):
+    help = (
+        "Load test /api/query/ in-process through the WSGI handler, the ASGI handler with the "
+        "sync views and the ASGI handler with the async views, and compare throughput."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=500, help='Requests per mode.')
+        parser.add_argument('--concurrency', type=int, default=32, help='Requests in flight.')
+        parser.add_argument('--modes', default=','.join(MODES), help='Comma separated subset of: ' + ', '.join(MODES))
+        parser.add_argument('--path', default='/api/query/')
+        parser.add_argument('--worker', choices=list(MODES), help='(internal) Run one mode and print its result as JSON.')
+
+    def handle(self, *args, **options):
+        if options['worker']:
+            result = self.run_worker(options['worker'], options['path'], options['requests'], options['concurrency'])
+            self.stdout.write(json.dumps(result))
+            return
+
+        modes = [mode.strip() for mode in options['modes'].split(',') if mode.strip()]
+        unknown = set(modes) - set(MODES)
+        if unknown:
+            raise CommandError(f"Unknown modes: {', '.join(sorted(unknown))}")
+
+        self.stdout.write(
+            f"{options['requests']} requests per mode at concurrency {options['concurrency']} against {options['path']}"
+        )
+        self.stdout.write(f"{'mode':<10} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}  status codes")
+        for mode in modes:
+            env = dict(os.environ, RAG_ASYNC_VIEWS=MODES[mode])
+            proc = subprocess.run(
+                [
+                    sys.executable, str(settings.BASE_DIR / 'manage.py'), 'bench_servers',
+                    '--worker', mode, '--path', options['path'],
+                    '--requests', str(options['requests']), '--concurrency', str(options['concurrency']),
+                ],
+                env=env, capture_output=True, text=True,
+            )
+            if proc.returncode != 0:
+                raise CommandError(f"{mode} worker failed:\n{proc.stderr}")
+            result = json.loads(proc.stdout.strip().splitlines()[-1])
+            codes = ', '.join(f"{code}: {count}" for code, count in sorted(result['status'].items()))
+            self.stdout.write(
+                f"{mode:<10} {result['throughput']:8.1f} {result['p50_ms']:8.2f} "
+                f"{result['p95_ms']:8.2f} {result['p99_ms']:8.2f}  {codes}"
+            )
+
+    def run_worker(self, mode, path, requests, concurrency):
+        if mode == 'wsgi':
+            latencies, statuses, elapsed = self.run_wsgi(path, requests, concurrency)
+        else:
+            latencies, statuses, elapsed = asyncio.run(self.run_asgi(path, requests, concurrency))
+        latencies.sort()
+        counts = {}
+        for code in statuses:
+            counts[str(code)] = counts.get(str(code), 0) + 1
+        return {
+            "mode": mode,
+            "throughput": requests / elapsed,
+            "p50_ms": statistics.median(latencies) * 1000,
+            "p95_ms": latencies[int(len(latencies) * 0.95) - 1] * 1000,
+            "p99_ms": latencies[int(len(latencies) * 0.99) - 1] * 1000,
+            "status": counts,
+        }
+
+    def run_wsgi(self, path, requests, concurrency):
+        from django.core.handlers.wsgi import WSGIHandler
+
+        handler = WSGIHandler()
+
+        def one(n):
+            body = request_body(n)
+            environ = {
+                'REQUEST_METHOD': 'POST', 'PATH_INFO': path, 'SCRIPT_NAME': '', 'QUERY_STRING': '',
+                'SERVER_NAME': 'bench', 'SERVER_PORT': '80', 'SERVER_PROTOCOL': 'HTTP/1.1',
+                'CONTENT_TYPE': 'application/json', 'CONTENT_LENGTH': str(len(body)),
+                'wsgi.input': io.BytesIO(body), 'wsgi.url_scheme': 'http', 'wsgi.errors': sys.stderr,
+                'wsgi.multithread': True, 'wsgi.multiprocess': False, 'wsgi.run_once': False,
+            }
+            status = []
+            start = time.perf_counter()
+            response = handler(environ, lambda s, headers, exc_info=None: status.append(s))
+            for _chunk in response:
+                pass
+            response.close()
+            return time.perf_counter() - start, int(status[0].split()[0])
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            results = list(pool.map(one, range(requests)))
+        elapsed = time.perf_counter() - start
+        return [latency for latency, _ in results], [code for _, code in results], elapsed
+
+    async def run_asgi(self, path, requests, concurrency):
+        from django.core.handlers.asgi import ASGIHandler
+
+        handler = ASGIHandler()
+        counter = iter(range(requests))
+        latencies, statuses = [], []
+
+        async def one(n):
+            body = request_body(n)
+            scope = {
+                'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'POST',
+                'scheme': 'http', 'path': path, 'raw_path': path.encode(), 'query_string': b'',
+                'root_path': '', 'server': ('bench', 80), 'client': ('127.0.0.1', 50000),
+                'headers': [(b'content-type', b'application/json'), (b'content-length', str(len(body)).encode())],
+            }
+            sent = False
+            done = asyncio.Event()
+
+            async def receive():
+                nonlocal sent
+                if not sent:
+                    sent = True
+                    return {'type': 'http.request', 'body': body, 'more_body': False}
+                await done.wait()
+                return {'type': 'http.disconnect'}
+
+            async def send(message):
+                if message['type'] == 'http.response.start':
+                    statuses.append(message['status'])
+                elif message['type'] == 'http.response.body' and not message.get('more_body'):
+                    done.set()
+
+            start = time.perf_counter()
+            await handler(scope, receive, send)
+            latencies.append(time.perf_counter() - start)
+
+        async def client():
+            for n in counter:
+                await one(n)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(client() for _ in range(concurrency)))
+        return latencies, statuses, time.perf_counter() - start
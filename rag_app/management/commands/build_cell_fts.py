@@ -0,0 +1,48 @@
+from django.core.management.base import BaseCommand
+
+from rag_app import fts
+
+
+class Command(BaseCommand):
+    help = (
+        "Create the rag_cell_fts FTS5 index over hotwash_rowcell_data.cell_data, install "
+        "the triggers that keep it in sync and (re)build its contents."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--no-triggers', action='store_true',
+            help='Do not install sync triggers; re-run with --rebuild to refresh instead.',
+        )
+        parser.add_argument(
+            '--skip-rebuild', action='store_true',
+            help='Create the table and triggers without re-tokenizing existing rows.',
+        )
+        parser.add_argument(
+            '--optimize', action='store_true',
+            help='Merge index segments after building.',
+        )
+        parser.add_argument(
+            '--drop', action='store_true',
+            help='Remove the index and its triggers; /query/ falls back to LIKE.',
+        )
+
+    def handle(self, *args, **options):
+        if options['drop']:
+            fts.drop_index()
+            self.stdout.write(self.style.SUCCESS(f"Dropped {fts.FTS_TABLE} and its triggers"))
+            return
+
+        fts.create_index()
+        if not options['no_triggers']:
+            fts.install_triggers()
+            self.stdout.write(f"Installed triggers: {', '.join(fts.TRIGGERS)}")
+        if not options['skip_rebuild']:
+            fts.rebuild_index()
+            self.stdout.write(f"Rebuilt {fts.FTS_TABLE} from hotwash_rowcell_data")
+        if options['optimize']:
+            fts.optimize_index()
+            self.stdout.write(f"Optimized {fts.FTS_TABLE}")
+        self.stdout.write(self.style.SUCCESS(
+            "Done. Restart the server processes so /query/ picks up the index."
+        ))
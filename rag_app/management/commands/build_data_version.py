@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+
+from rag_app import result_cache
+
+
+class Command(BaseCommand):
+    help = (
+        "Install the change counter the /query/ result cache is validated against: a version row "
+        "bumped by triggers on every insert, update and delete in the tables /query/ reads."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--drop', action='store_true',
+            help='Remove the counter and its triggers; the result cache stops storing entries.',
+        )
+
+    def handle(self, *args, **options):
+        if options['drop']:
+            result_cache.drop_table()
+            self.stdout.write(self.style.SUCCESS(f"Dropped {result_cache.VERSION_TABLE} and its triggers"))
+            return
+        result_cache.install_triggers()
+        result_cache.bump_version()
+        self.stdout.write(self.style.SUCCESS(
+            f"Installed {len(result_cache.TRIGGERS)} triggers on {len(result_cache.SOURCE_TABLES)} tables"
+        ))
@@ -0,0 +1,41 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from rag_app.retrieval import RetrievalUnavailable, get_index, index_dir, update_index
+
+
+class Command(BaseCommand):
+    help = (
+        "Bring the offline retrieval index over hotwash_rowcell_data up to date, indexing "
+        "rows whose updated_at is newer than the last run."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rebuild', action='store_true', help='Discard the index and rebuild it from scratch.')
+        parser.add_argument('--features', type=int, help='Number of hashed features (default: RAG_RETRIEVAL_FEATURES).')
+        parser.add_argument('--segment-docs', type=int, default=500000, help='Documents per segment.')
+        parser.add_argument(
+            '--max-segments', type=int, default=16,
+            help='Rebuild instead of appending once the index has this many segments.',
+        )
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        try:
+            written = update_index(
+                rebuild=options['rebuild'],
+                n_features=options['features'],
+                segment_docs=options['segment_docs'],
+                max_segments=options['max_segments'],
+            )
+            stats = get_index().stats()
+        except RetrievalUnavailable as e:
+            raise CommandError(str(e))
+        self.stdout.write(
+            f"Indexed {written} document(s) in {time.perf_counter() - start:.2f}s into {index_dir()}"
+        )
+        self.stdout.write(
+            f"{stats['documents']} document(s) in {stats['segments']} segment(s), "
+            f"{stats['deleted']} superseded, watermark {stats['watermark'] or '-'}"
+        )
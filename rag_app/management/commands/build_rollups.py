@@ -0,0 +1,69 @@
+import datetime
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from rag_app import rollups
+
+
+class Command(BaseCommand):
+    help = (
+        "Maintain the daily per-user, per-workspace and per-status roll-ups that summaries read "
+        "for closed days: roll up new days and re-roll days whose source rows changed."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--rebuild', action='store_true',
+            help='Discard the roll-ups and rebuild every day.',
+        )
+        parser.add_argument(
+            '--day', action='append', default=[], metavar='YYYY-MM-DD',
+            help='Re-roll this day (repeatable).',
+        )
+        parser.add_argument(
+            '--check', action='store_true',
+            help='Compare the cell count of every rolled-up day with the live join.',
+        )
+        parser.add_argument('--sample', type=int, default=10, help='Days to show with --check.')
+        parser.add_argument('--drop', action='store_true', help='Remove the roll-up tables.')
+
+    def handle(self, *args, **options):
+        if options['drop']:
+            rollups.drop_tables()
+            self.stdout.write(self.style.SUCCESS("Dropped the roll-up tables"))
+            return
+        if options['check']:
+            self.check_consistency(options['sample'])
+            return
+
+        start = time.perf_counter()
+        if options['day']:
+            try:
+                days = [datetime.date.fromisoformat(day) for day in options['day']]
+            except ValueError as e:
+                raise CommandError(f"Invalid --day: {e}")
+            rollups.create_tables()
+            watermark = rollups.current_watermark()
+            for day in days:
+                cells = rollups.build_day(day, watermark)
+                self.stdout.write(f"Rolled up {day}: {cells} cell(s)")
+            return
+
+        built, patched = rollups.refresh(rebuild=options['rebuild'])
+        self.stdout.write(
+            f"Rolled up {built} new day(s), re-rolled {patched} edited day(s) in {time.perf_counter() - start:.2f}s"
+        )
+
+    def check_consistency(self, sample):
+        start = time.perf_counter()
+        report = rollups.check_consistency(sample=sample)
+        self.stdout.write(f"{report['days']} day(s) checked in {time.perf_counter() - start:.2f}s")
+        if not report['differences']:
+            self.stdout.write(self.style.SUCCESS("Roll-ups match the live join"))
+            return
+        for difference in report['differences']:
+            self.stdout.write(f"  {difference['day']}: {difference['rollup']} rolled up, {difference['live']} live")
+        raise CommandError(
+            f"{report['different']} day(s) are out of date; re-roll them with --day or run --rebuild"
+        )
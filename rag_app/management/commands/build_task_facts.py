@@ -0,0 +1,73 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from rag_app import facts
+
+
+class Command(BaseCommand):
+    help = (
+        "Create the denormalized task_facts table that /query/ reads instead of the five-way "
+        "join, install the triggers that keep it in sync and (re)build its contents."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--no-triggers', action='store_true',
+            help='Do not install sync triggers; keep the table current with --refresh instead.',
+        )
+        parser.add_argument(
+            '--refresh', action='store_true',
+            help='Only re-derive cells whose updated_at is newer than the table and drop deleted cells.',
+        )
+        parser.add_argument(
+            '--check', action='store_true',
+            help='Compare task_facts with the live join and exit non-zero on any difference.',
+        )
+        parser.add_argument('--sample', type=int, default=10, help='Cell ids to show per difference with --check.')
+        parser.add_argument(
+            '--drop', action='store_true',
+            help='Remove the table and its triggers; /query/ falls back to the join.',
+        )
+
+    def handle(self, *args, **options):
+        if options['drop']:
+            facts.drop_table()
+            self.stdout.write(self.style.SUCCESS(f"Dropped {facts.FACTS_TABLE} and its triggers"))
+            return
+        if options['check']:
+            self.check_consistency(options['sample'])
+            return
+
+        start = time.perf_counter()
+        if options['refresh']:
+            refreshed, removed = facts.refresh()
+            self.stdout.write(
+                f"Refreshed {refreshed} fact(s), removed {removed} in {time.perf_counter() - start:.2f}s"
+            )
+            return
+
+        facts.create_table()
+        if options['no_triggers']:
+            facts.drop_triggers()
+        else:
+            facts.install_triggers()
+            self.stdout.write(f"Installed {len(facts.TRIGGERS)} triggers on the hotwash and user tables")
+        rows = facts.rebuild()
+        self.stdout.write(f"Built {rows} fact(s) in {time.perf_counter() - start:.2f}s")
+        self.stdout.write(self.style.SUCCESS(
+            "Done. Restart the server processes so /query/ picks up the table."
+        ))
+
+    def check_consistency(self, sample):
+        start = time.perf_counter()
+        report = facts.check_consistency(sample)
+        self.stdout.write(
+            f"{report['facts']} fact(s), {report['live']} live row(s), checked in {time.perf_counter() - start:.2f}s"
+        )
+        if report['consistent']:
+            self.stdout.write(self.style.SUCCESS("task_facts matches the live join"))
+            return
+        self.stdout.write(f"Missing from task_facts: {report['missing']} (cells {report['missing_ids']})")
+        self.stdout.write(f"Stale or extra in task_facts: {report['stale']} (cells {report['stale_ids']})")
+        raise CommandError("task_facts is out of sync; run build_task_facts to rebuild it")
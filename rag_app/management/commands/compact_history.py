@@ -0,0 +1,76 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.utils import timezone
+
+from rag_app.models import QueryHistory
+
+# Selecting orphans and deleting them in one statement on the writer means a payload the
+# history writer has just referenced again can't be deleted in between
+DELETE_ORPHANED_PAYLOADS_SQL = """
+    DELETE FROM query_payload WHERE digest IN (
+        SELECT digest FROM query_payload p
+        WHERE NOT EXISTS (SELECT 1 FROM query_history h WHERE h.payload_digest = p.digest)
+        LIMIT %s
+    )
+"""
+
+
+class Command(BaseCommand):
+    help = (
+        "Delete query history older than the retention window and garbage-collect "
+        "result payloads that no history row references any more."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--days', type=int, default=getattr(settings, 'RAG_HISTORY_RETENTION_DAYS', 30),
+            help='Keep history from the last N days (default: RAG_HISTORY_RETENTION_DAYS).',
+        )
+        parser.add_argument(
+            '--chunk-size', type=int, default=5000,
+            help='Rows deleted per statement, to keep write locks short.',
+        )
+        parser.add_argument(
+            '--vacuum', action='store_true',
+            help='VACUUM the database afterwards to return freed pages to the filesystem.',
+        )
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(days=options['days'])
+        chunk_size = options['chunk_size']
+
+        pruned = self._delete_in_chunks(
+            QueryHistory.objects.filter(created_at__lt=cutoff), 'pk', chunk_size,
+        )
+        self.stdout.write(f"Deleted {pruned} history row(s) created before {cutoff.isoformat()}")
+
+        collected = self._delete_orphaned_payloads(chunk_size)
+        self.stdout.write(f"Deleted {collected} unreferenced payload(s)")
+
+        if options['vacuum']:
+            with connection.cursor() as cursor:
+                cursor.execute('VACUUM')
+            self.stdout.write("Vacuumed database")
+
+    def _delete_in_chunks(self, queryset, key, chunk_size):
+        total = 0
+        queryset = queryset.using('default')
+        while True:
+            keys = list(queryset.values_list(key, flat=True)[:chunk_size])
+            if not keys:
+                return total
+            deleted, _ = queryset.model.objects.filter(**{f'{key}__in': keys}).delete()
+            total += deleted
+
+    def _delete_orphaned_payloads(self, chunk_size):
+        total = 0
+        while True:
+            with transaction.atomic(), connection.cursor() as cursor:
+                cursor.execute(DELETE_ORPHANED_PAYLOADS_SQL, [chunk_size])
+                deleted = cursor.rowcount
+            total += deleted
+            if deleted < chunk_size:
+                return total
@@ -0,0 +1,237 @@
+import datetime
+import itertools
+import random
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+
+from rag_app import facts, fts, result_cache, rollups, shards
+from rag_app.indexes import create_indexes, missing_indexes
+
+# The hotwash tables belong to another app; these are the columns the RAG views read
+TABLES = {
+    'authentication_user': """
+        CREATE TABLE IF NOT EXISTS authentication_user (
+            id integer PRIMARY KEY, name varchar(150), username varchar(150),
+            email varchar(254), studid varchar(50))""",
+    'hotwash_workspace': """
+        CREATE TABLE IF NOT EXISTS hotwash_workspace (
+            id integer PRIMARY KEY, workspace_name varchar(255), description text, user_id integer)""",
+    'hotwash_sheet': """
+        CREATE TABLE IF NOT EXISTS hotwash_sheet (
+            id integer PRIMARY KEY, name varchar(255), privacy_type varchar(20),
+            user_id integer, workspace_id integer)""",
+    'hotwash_groups_header': """
+        CREATE TABLE IF NOT EXISTS hotwash_groups_header (
+            id integer PRIMARY KEY, name varchar(255), column_type varchar(50),
+            column_index integer, sheet_id integer, group_id integer)""",
+    'hotwash_status_dropdown': """
+        CREATE TABLE IF NOT EXISTS hotwash_status_dropdown (
+            id integer PRIMARY KEY, sheet_id integer, column_id integer, status_text varchar(100),
+            status_color varchar(20), status_type varchar(50))""",
+    'hotwash_rowcell_data': """
+        CREATE TABLE IF NOT EXISTS hotwash_rowcell_data (
+            id integer PRIMARY KEY, sheet_id integer, column_id integer, row_id integer,
+            column_index integer, column_type varchar(50), cell_data text, cell_date date,
+            created_at datetime, updated_at datetime)""",
+}
+
+FIRST_NAMES = [
+    'Aarav', 'Aisha', 'Ben', 'Chen', 'Diya', 'Elena', 'Farah', 'Gabriel', 'Hana', 'Ivan',
+    'Jia', 'Kofi', 'Lena', 'Mateo', 'Nisha', 'Omar', 'Priya', 'Quinn', 'Rohan', 'Sofia',
+    'Tariq', 'Uma', 'Victor', 'Wei', 'Ximena', 'Yusuf', 'Zara',
+]
+LAST_NAMES = [
+    'Ahmed', 'Brown', 'Chowdhury', 'Das', 'Evans', 'Fernandez', 'Garcia', 'Hughes', 'Iyer',
+    'Jones', 'Kim', 'Lopez', 'Mehta', 'Nguyen', 'Okafor', 'Patel', 'Rossi', 'Singh', 'Tanaka',
+]
+VERBS = [
+    'Review', 'Draft', 'Fix', 'Update', 'Prepare', 'Test', 'Deploy', 'Document', 'Refactor',
+    'Plan', 'Investigate', 'Schedule', 'Design', 'Migrate', 'Audit',
+]
+OBJECTS = [
+    'login page', 'quarterly report', 'payment flow', 'onboarding email', 'API docs',
+    'lab assignment', 'sprint backlog', 'database backup', 'search results', 'grading rubric',
+    'release notes', 'dashboard layout', 'invoice export', 'project proposal', 'unit tests',
+]
+COLUMN_TYPES = ['text', 'text', 'text', 'date', 'status', 'person']
+STATUSES = [
+    ('Not started', '#9e9e9e'), ('In progress', '#2196f3'), ('Blocked', '#f44336'),
+    ('In review', '#ff9800'), ('Done', '#4caf50'),
+]
+
+
+def zipf_cum_weights(n, skew):
+    """Cumulative weights giving item i a share proportional to 1 / (i + 1) ** skew"""
+    return list(itertools.accumulate(1.0 / (i + 1) ** skew for i in range(n)))
+
+
+class Command(BaseCommand):
+    help = (
+        "Generate synthetic authentication_user and hotwash_* data at a configurable scale, "
+        "with a skewed spread of users and dates, for benchmarking."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--cells', type=int, default=100000, help='hotwash_rowcell_data rows (10k to 10M is typical).')
+        parser.add_argument('--users', type=int, help='Users (default: cells / 500, at least 20).')
+        parser.add_argument('--sheets-per-user', type=int, default=3)
+        parser.add_argument('--columns-per-sheet', type=int, default=6)
+        parser.add_argument('--days', type=int, default=365, help='Span of cell_date, ending today.')
+        parser.add_argument(
+            '--user-skew', type=float, default=1.1,
+            help='Zipf exponent for how cells are spread over users; 0 is uniform.',
+        )
+        parser.add_argument(
+            '--recent-days', type=float, default=14.0,
+            help='Mean age in days of a cell; dates decay exponentially from today.',
+        )
+        parser.add_argument('--mention-rate', type=float, default=0.4, help='Share of cells that mention a user.')
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--batch-size', type=int, default=50000, help='Rows inserted per transaction.')
+        parser.add_argument('--replace', action='store_true', help='Drop existing hotwash data first.')
+
+    def handle(self, *args, **options):
+        cells = options['cells']
+        if cells < 1:
+            raise CommandError("--cells must be positive")
+        users = options['users'] or max(20, cells // 500)
+        rng = random.Random(options['seed'])
+        start = time.perf_counter()
+
+        existing = set(connection.introspection.table_names())
+        if not options['replace']:
+            with connection.cursor() as cursor:
+                for table in TABLES:
+                    if table in existing:
+                        cursor.execute(f"SELECT 1 FROM {table} LIMIT 1")
+                        if cursor.fetchone():
+                            raise CommandError(f"{table} already has rows; pass --replace to regenerate")
+
+        has_fts = fts.FTS_TABLE in existing
+        has_facts = facts.FACTS_TABLE in existing
+        has_rollups = rollups.ROLLUP_DAYS_TABLE in existing
+        has_shards = shards.SHARD_TABLE in existing
+        has_version = result_cache.VERSION_TABLE in existing
+        with connection.cursor() as cursor:
+            # Sync triggers would re-tokenize or re-derive every insert; all are rebuilt once at the end
+            for name in [*fts.TRIGGERS, *facts.TRIGGERS, *result_cache.TRIGGERS, *rollups.TRIGGERS]:
+                cursor.execute(f"DROP TRIGGER IF EXISTS {name}")
+            for table, ddl in TABLES.items():
+                if options['replace']:
+                    cursor.execute(f"DROP TABLE IF EXISTS {table}")
+                cursor.execute(ddl)
+
+        user_rows, sheets_by_user, columns_by_sheet = self.generate_dimensions(rng, users, options)
+        self.stdout.write(
+            f"{len(user_rows)} users, {sum(len(s) for s in sheets_by_user)} sheets, "
+            f"{sum(len(c) for c in columns_by_sheet.values())} columns"
+        )
+
+        written = self.generate_cells(rng, cells, sheets_by_user, columns_by_sheet, options)
+        self.stdout.write(f"{written} cells in {time.perf_counter() - start:.1f}s")
+
+        missing = missing_indexes()
+        if missing:
+            create_indexes(missing)
+            self.stdout.write(f"Created indexes: {', '.join(name for name, _table, _ddl in missing)}")
+        with connection.cursor() as cursor:
+            cursor.execute("ANALYZE")
+        if has_fts:
+            fts.install_triggers()
+            fts.rebuild_index()
+            self.stdout.write(f"Rebuilt {fts.FTS_TABLE}")
+        if has_version:
+            result_cache.install_triggers()
+            result_cache.bump_version()
+        if has_facts:
+            facts.install_triggers()
+            self.stdout.write(f"Rebuilt {facts.FACTS_TABLE} with {facts.rebuild()} fact(s)")
+        if has_rollups:
+            built, _patched = rollups.refresh(rebuild=True)
+            self.stdout.write(f"Rebuilt the daily roll-ups for {built} day(s)")
+        if has_shards:
+            with connection.cursor() as cursor:
+                cursor.execute(f"SELECT count(*) FROM {shards.SHARD_TABLE}")
+                count = cursor.fetchone()[0]
+            if count:
+                shards.split(count)
+                self.stdout.write(f"Split the data into {count} shard(s) again")
+        self.stdout.write(self.style.SUCCESS(
+            f"Done in {time.perf_counter() - start:.1f}s. Run build_retrieval_index --rebuild to refresh /retrieve/."
+        ))
+
+    def generate_dimensions(self, rng, users, options):
+        user_rows, workspace_rows, sheet_rows, header_rows, status_rows = [], [], [], [], []
+        sheets_by_user = []
+        columns_by_sheet = {}
+        for user_id in range(1, users + 1):
+            first, last = rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES)
+            username = f"{first.lower()}_{last.lower()}{user_id}"
+            user_rows.append((user_id, f"{first} {last}", username, f"{username}@example.com", f"S{100000 + user_id}"))
+            workspace_rows.append((user_id, f"{first}'s workspace", f"Projects owned by {first} {last}", user_id))
+
+            sheets = []
+            for _ in range(options['sheets_per_user']):
+                sheet_id = len(sheet_rows) + 1
+                sheet_rows.append((sheet_id, f"{rng.choice(OBJECTS).title()} tracker", rng.choice(['private', 'public']), user_id, user_id))
+                columns = []
+                for column_index in range(options['columns_per_sheet']):
+                    column_id = len(header_rows) + 1
+                    column_type = COLUMN_TYPES[column_index % len(COLUMN_TYPES)]
+                    header_rows.append((column_id, f"{column_type.title()} {column_index + 1}", column_type, column_index, sheet_id, 1))
+                    status_text, status_color = rng.choice(STATUSES)
+                    status_rows.append((column_id, sheet_id, column_id, status_text, status_color, column_type))
+                    columns.append((column_id, column_index, column_type))
+                columns_by_sheet[sheet_id] = columns
+                sheets.append(sheet_id)
+            sheets_by_user.append(sheets)
+
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.executemany("INSERT INTO authentication_user VALUES (%s, %s, %s, %s, %s)", user_rows)
+            cursor.executemany("INSERT INTO hotwash_workspace VALUES (%s, %s, %s, %s)", workspace_rows)
+            cursor.executemany("INSERT INTO hotwash_sheet VALUES (%s, %s, %s, %s, %s)", sheet_rows)
+            cursor.executemany("INSERT INTO hotwash_groups_header VALUES (%s, %s, %s, %s, %s, %s)", header_rows)
+            cursor.executemany("INSERT INTO hotwash_status_dropdown VALUES (%s, %s, %s, %s, %s, %s)", status_rows)
+        return user_rows, sheets_by_user, columns_by_sheet
+
+    def generate_cells(self, rng, cells, sheets_by_user, columns_by_sheet, options):
+        users = len(sheets_by_user)
+        cum_weights = zipf_cum_weights(users, options['user_skew'])
+        owners = range(users)
+        today = datetime.date.today()
+        days, mean_age, mention_rate = options['days'], options['recent_days'], options['mention_rate']
+        next_row = {}
+
+        written = 0
+        sql = "INSERT INTO hotwash_rowcell_data VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)"
+        while written < cells:
+            batch = []
+            count = min(options['batch_size'], cells - written)
+            for owner in rng.choices(owners, cum_weights=cum_weights, k=count):
+                cell_id = written + len(batch) + 1
+                sheet_id = rng.choice(sheets_by_user[owner])
+                column_id, column_index, column_type = rng.choice(columns_by_sheet[sheet_id])
+                row_id = next_row[sheet_id] = next_row.get(sheet_id, 0) + (rng.random() < 0.3)
+
+                age = min(int(rng.expovariate(1 / mean_age)), days - 1)
+                cell_date = today - datetime.timedelta(days=age)
+                created = datetime.datetime.combine(cell_date, datetime.time(rng.randrange(24), rng.randrange(60), rng.randrange(60)))
+                updated = created + datetime.timedelta(minutes=rng.randrange(0, 4320)) if rng.random() < 0.3 else created
+
+                text = f"{rng.choice(VERBS)} {rng.choice(OBJECTS)}"
+                if rng.random() < mention_rate:
+                    # Mentions follow the same skew as ownership
+                    mentioned = rng.choices(owners, cum_weights=cum_weights)[0] + 1
+                    text += f" for user {mentioned}"
+                batch.append((
+                    cell_id, sheet_id, column_id, row_id, column_index, column_type, text,
+                    cell_date.isoformat(), created.isoformat(sep=' '), updated.isoformat(sep=' '),
+                ))
+            with transaction.atomic(), connection.cursor() as cursor:
+                cursor.executemany(sql, batch)
+            written += len(batch)
+            if options['verbosity'] > 1:
+                self.stdout.write(f"  {written}/{cells}")
+        return written
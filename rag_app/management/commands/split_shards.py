@@ -0,0 +1,59 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from rag_app import shards
+
+
+class Command(BaseCommand):
+    help = (
+        "Split the hotwash tables into one SQLite file per group of workspaces for the sharded "
+        "layout (RAG_SHARDS). The source database is left as it is."
+    )
+
+    def add_arguments(self, parser):
+        config = getattr(settings, 'RAG_SHARDS', {})
+        parser.add_argument(
+            '--shards', type=int, default=config.get('COUNT', 4),
+            help='Number of shard files to write (default: RAG_SHARDS["COUNT"]).',
+        )
+        parser.add_argument(
+            '--dir', default=None,
+            help='Directory for the shard files (default: RAG_SHARDS["DIR"]).',
+        )
+        parser.add_argument(
+            '--check', action='store_true',
+            help='Compare the cell and fact counts of the shards with the source and exit non-zero on a difference.',
+        )
+        parser.add_argument('--drop', action='store_true', help='Remove the shard files and the shard map.')
+
+    def handle(self, *args, **options):
+        if options['drop']:
+            shards.drop_tables()
+            self.stdout.write(self.style.SUCCESS("Dropped the shard files and the shard map"))
+            return
+        if options['check']:
+            self.check_consistency()
+            return
+        if options['shards'] < 1:
+            raise CommandError("--shards must be at least 1")
+
+        start = time.perf_counter()
+        for shard in shards.split(options['shards'], options['dir']):
+            self.stdout.write(
+                f"Shard {shard['shard']}: {shard['workspaces']} workspace(s), {shard['cells']} cell(s) -> {shard['path']}"
+            )
+        self.stdout.write(f"Split in {time.perf_counter() - start:.2f}s")
+        self.stdout.write(self.style.SUCCESS(
+            "Done. Set RAG_SHARDS['ENABLED'] and restart the server processes so /query/ reads the shards."
+        ))
+
+    def check_consistency(self):
+        report = shards.check_consistency()
+        for table, count in report['counts'].items():
+            self.stdout.write(f"{table}: {count['source']} in the source, {count['shards']} across {report['shards']} shard(s)")
+        if report['consistent']:
+            self.stdout.write(self.style.SUCCESS("The shards hold every row of the source"))
+            return
+        raise CommandError("The shards are out of date; run split_shards again")
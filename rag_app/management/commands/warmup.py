@@ -0,0 +1,56 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from rag_app import warmup
+
+
+class Command(BaseCommand):
+    help = (
+        "Preflight and warm up the database after a deploy: check the tables, columns and "
+        "recommended indexes /query/ needs, ANALYZE tables with stale statistics, read the hot "
+        "table and index pages and prime the caches from the most frequent questions in the history."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--steps', default=','.join(warmup.STEPS),
+            help=f"Comma separated steps to run, from {', '.join(warmup.STEPS)} (default: all).",
+        )
+        parser.add_argument(
+            '--queries', type=int, default=None,
+            help="Most frequent history questions to prime (default: RAG_WARMUP['QUERIES']).",
+        )
+
+    def handle(self, *args, **options):
+        steps = [step.strip() for step in options['steps'].split(',') if step.strip()]
+        unknown = [step for step in steps if step not in warmup.STEPS]
+        if unknown:
+            raise CommandError(f"Unknown step(s) {', '.join(unknown)}; choose from {', '.join(warmup.STEPS)}")
+
+        results = warmup.run(steps, queries=options['queries'], report=self.report)
+        total = sum(seconds for _step, seconds, _result in results)
+        failed = [problem for step, _seconds, result in results if step == 'schema' for problem in result['problems']]
+        if failed:
+            raise CommandError(f"Preflight failed in {total:.2f}s: {len(failed)} schema problem(s)")
+        self.stdout.write(self.style.SUCCESS(f"Ready in {total:.2f}s"))
+
+    def report(self, step, seconds, result):
+        if step == 'schema':
+            self.stdout.write(f"schema: {result['tables']} table(s) checked in {seconds:.2f}s")
+            for problem in result['problems']:
+                self.stdout.write(self.style.ERROR(f"    {problem}"))
+        elif step == 'indexes':
+            self.stdout.write(f"indexes: {len(result['missing'])} missing in {seconds:.2f}s")
+            for index in result['missing']:
+                self.stdout.write(self.style.WARNING(f"    {index}"))
+            if result['missing']:
+                self.stdout.write("    Run advise_indexes --apply (and build_task_facts for task_facts) to create them.")
+        elif step == 'analyze':
+            self.stdout.write(f"analyze: {len(result['analyzed'])} table(s) with stale statistics in {seconds:.2f}s")
+            for table in result['analyzed']:
+                self.stdout.write(f"    {table}")
+        elif step == 'pages':
+            self.stdout.write(f"pages: read {result['btrees']} table and index b-tree(s) in {seconds:.2f}s")
+        else:
+            self.stdout.write(f"caches: primed {result['primed']} question(s) in {seconds:.2f}s")
+            for failure in result['failed']:
+                self.stdout.write(self.style.WARNING(f"    {failure}"))
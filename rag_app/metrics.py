@@ -0,0 +1,240 @@
+import bisect
+import contextlib
+import logging
+import threading
+import time
+from collections import deque
+
+from django.conf import settings
+
+slow_query_logger = logging.getLogger('rag_app.slow_query')
+
+# Upper bounds, in seconds, of the Prometheus histogram buckets
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUANTILES = (0.5, 0.95, 0.99)
+
+
+class Histogram:
+    """Cumulative bucket counts for Prometheus plus the most recent samples for quantiles"""
+
+    def __init__(self, buckets, window):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self.recent = deque(maxlen=window)
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+        self.recent.append(value)
+
+    def quantiles(self, quantiles=QUANTILES):
+        ordered = sorted(self.recent)
+        if not ordered:
+            return {}
+        return {q: ordered[min(len(ordered) - 1, int(q * len(ordered)))] for q in quantiles}
+
+
+def _labels(**labels):
+    return '{' + ','.join(f'{key}="{value}"' for key, value in labels.items()) + '}'
+
+
+class MetricsRegistry:
+    """Process-local request metrics rendered in the Prometheus text format"""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS, window=1024):
+        self.buckets = buckets
+        self.window = window
+        self._lock = threading.Lock()
+        self._histograms = {}
+        self._requests = {}
+        self._slow_queries = 0
+
+    def observe(self, view, stage, seconds):
+        with self._lock:
+            histogram = self._histograms.get((view, stage))
+            if histogram is None:
+                histogram = self._histograms[(view, stage)] = Histogram(self.buckets, self.window)
+            histogram.observe(seconds)
+
+    def count_request(self, view, status_code):
+        key = (view, str(status_code))
+        with self._lock:
+            self._requests[key] = self._requests.get(key, 0) + 1
+
+    def count_slow_query(self):
+        with self._lock:
+            self._slow_queries += 1
+
+    def render(self):
+        lines = []
+        with self._lock:
+            lines += [
+                '# HELP rag_requests_total Requests handled, by view and status code.',
+                '# TYPE rag_requests_total counter',
+            ]
+            for (view, code), count in sorted(self._requests.items()):
+                lines.append(f'rag_requests_total{_labels(view=view, code=code)} {count}')
+
+            lines += [
+                '# HELP rag_stage_duration_seconds Time spent in each stage of a request.',
+                '# TYPE rag_stage_duration_seconds histogram',
+            ]
+            recent = []
+            for (view, stage), histogram in sorted(self._histograms.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets + ('+Inf',), histogram.counts):
+                    cumulative += count
+                    lines.append(
+                        f'rag_stage_duration_seconds_bucket{_labels(view=view, stage=stage, le=bound)} {cumulative}'
+                    )
+                lines.append(f'rag_stage_duration_seconds_sum{_labels(view=view, stage=stage)} {histogram.sum}')
+                lines.append(f'rag_stage_duration_seconds_count{_labels(view=view, stage=stage)} {histogram.count}')
+                for q, value in histogram.quantiles().items():
+                    recent.append(f'rag_stage_recent_seconds{_labels(view=view, stage=stage, quantile=q)} {value}')
+
+            lines += [
+                f'# HELP rag_stage_recent_seconds Stage duration quantiles over the last {self.window} requests.',
+                '# TYPE rag_stage_recent_seconds gauge',
+            ] + recent + [
+                '# HELP rag_slow_queries_total Statements slower than RAG_SLOW_QUERY_MS.',
+                '# TYPE rag_slow_queries_total counter',
+                f'rag_slow_queries_total {self._slow_queries}',
+            ]
+
+        for name, kind, help_text, samples in collect_component_stats():
+            lines += [f'# HELP {name} {help_text}', f'# TYPE {name} {kind}']
+            lines += [f'{name}{_labels(**labels) if labels else ""} {value}' for labels, value in samples]
+        return '\n'.join(lines) + '\n'
+
+
+def collect_component_stats():
+    """(name, type, help, [(labels, value)]) for the caches, coalescer, admission control, history writer and DB executor"""
+    from . import admission, coalesce, executor, history
+    from .result_cache import get_result_cache
+    from .sql_templates import template_cache
+
+    template_stats = template_cache.stats()
+    metrics = [
+        ('rag_sql_template_cache_hits_total', 'counter', 'SQL template cache hits.', [({}, template_stats['hits'])]),
+        ('rag_sql_template_cache_misses_total', 'counter', 'SQL template cache misses.', [({}, template_stats['misses'])]),
+    ]
+    result_cache = get_result_cache()
+    if result_cache is not None:
+        result_stats = result_cache.stats()
+        metrics += [
+            ('rag_result_cache_hits_total', 'counter', 'Result cache hits.', [({}, result_stats.get('hits', 0))]),
+            ('rag_result_cache_misses_total', 'counter', 'Result cache misses.', [({}, result_stats.get('misses', 0))]),
+        ]
+    single_flight = coalesce.get_single_flight()
+    if single_flight is not None:
+        flight_stats = single_flight.stats()
+        metrics += [
+            ('rag_coalesce_in_flight', 'gauge', 'Distinct /query/ computations running.', [({}, flight_stats['in_flight'])]),
+            ('rag_coalesce_requests_total', 'counter', '/query/ computations by how they were answered.', [
+                ({'outcome': outcome}, flight_stats[outcome])
+                for outcome in ('leaders', 'coalesced', 'timeouts', 'failures')
+            ]),
+        ]
+    controller = admission.get_admission_controller()
+    if controller is not None:
+        admission_stats = controller.stats()
+        metrics += [
+            ('rag_admission_queries_total', 'counter', '/query/ requests by estimated cost class.', [
+                ({'class': verdict}, count) for verdict, count in admission_stats['classified'].items()
+            ]),
+            ('rag_admission_degraded_total', 'counter', 'Requests answered with a count only, by reason.', [
+                ({'reason': reason}, count) for reason, count in admission_stats['degraded'].items()
+            ]),
+            ('rag_admission_lane_active', 'gauge', 'Expensive queries running.', [({}, admission_stats['lane_active'])]),
+            ('rag_admission_lane_timeouts_total', 'counter', 'Expensive queries refused with 503.', [
+                ({}, admission_stats['lane_timeouts'])
+            ]),
+        ]
+    writer = history.get_history_writer()
+    if writer is not None:
+        writer_stats = writer.stats()
+        metrics += [
+            ('rag_history_queued', 'gauge', 'History rows waiting for the writer.', [({}, writer_stats['queued'])]),
+            ('rag_history_rows_total', 'counter', 'History rows by outcome.', [
+                ({'outcome': outcome}, writer_stats[outcome]) for outcome in ('written', 'dropped', 'failed')
+            ]),
+        ]
+    # Only reported once the async views have started the executor
+    db_executor = executor.get_db_executor(create=False)
+    if db_executor is not None:
+        executor_stats = db_executor.stats()
+        metrics += [
+            ('rag_db_executor_active', 'gauge', 'Database executor jobs running.', [({}, executor_stats['active'])]),
+            ('rag_db_executor_queued', 'gauge', 'Database executor jobs waiting.', [({}, executor_stats['queued'])]),
+            ('rag_db_executor_rejected_total', 'counter', 'Requests refused with 503.', [({}, executor_stats['rejected'])]),
+        ]
+    return metrics
+
+
+registry = MetricsRegistry(window=getattr(settings, 'RAG_METRICS_WINDOW', 1024))
+
+
+class StageTimer:
+    """Accumulates per-stage durations for one request"""
+
+    def __init__(self, view):
+        self.view = view
+        self.started = time.perf_counter()
+        self.stages = {}
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - start)
+
+    def add(self, name, seconds):
+        self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+    def server_timing(self):
+        """Server-Timing header value, durations in milliseconds"""
+        parts = [f'{name};dur={seconds * 1000:.3f}' for name, seconds in self.stages.items()]
+        parts.append(f'total;dur={(time.perf_counter() - self.started) * 1000:.3f}')
+        return ', '.join(parts)
+
+    def finish(self, status_code):
+        """Record the stages and the total in the registry"""
+        for name, seconds in self.stages.items():
+            registry.observe(self.view, name, seconds)
+        registry.observe(self.view, 'total', time.perf_counter() - self.started)
+        registry.count_request(self.view, status_code)
+
+
+class NullTimer(StageTimer):
+    def __init__(self):
+        super().__init__(None)
+
+    def stage(self, name):
+        return contextlib.nullcontext()
+
+    def add(self, name, seconds):
+        pass
+
+
+NULL_TIMER = NullTimer()
+
+
+def log_slow_query(sql, params, seconds):
+    """Log a statement and its plan when it ran longer than RAG_SLOW_QUERY_MS (None disables)"""
+    threshold = getattr(settings, 'RAG_SLOW_QUERY_MS', None)
+    if threshold is None or seconds * 1000 < threshold:
+        return
+    registry.count_slow_query()
+    from .indexes import explain
+    try:
+        plan = '\n'.join(f'  {detail}' for detail in explain(sql, params))
+    except Exception as e:
+        plan = f'  (EXPLAIN failed: {e})'
+    slow_query_logger.warning(
+        "Slow query (%.1f ms)\n%s\nparams: %r\nplan:\n%s", seconds * 1000, sql.strip(), params, plan,
+    )
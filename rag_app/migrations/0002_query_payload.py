@@ -0,0 +1,76 @@
+# Generated by Django 5.2.18 on 2026-10-16 20:30
+
+import hashlib
+import json
+import zlib
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def encode(data):
+    raw = json.dumps(data, sort_keys=True, separators=(',', ':')).encode('utf-8')
+    return hashlib.sha256(raw).hexdigest(), len(raw), zlib.compress(raw, 6)
+
+
+def move_data_to_payloads(apps, schema_editor):
+    QueryHistory = apps.get_model('rag_app', 'QueryHistory')
+    QueryPayload = apps.get_model('rag_app', 'QueryPayload')
+    db_alias = schema_editor.connection.alias
+    seen = set()
+    for item in QueryHistory.objects.using(db_alias).only('id', 'data_fetched').iterator(chunk_size=500):
+        digest, raw_size, data = encode(item.data_fetched)
+        if digest not in seen:
+            QueryPayload.objects.using(db_alias).get_or_create(
+                digest=digest,
+                defaults={'codec': 'zlib', 'raw_size': raw_size, 'data': data},
+            )
+            seen.add(digest)
+        QueryHistory.objects.using(db_alias).filter(pk=item.pk).update(payload_id=digest)
+
+
+def restore_data_from_payloads(apps, schema_editor):
+    QueryHistory = apps.get_model('rag_app', 'QueryHistory')
+    QueryPayload = apps.get_model('rag_app', 'QueryPayload')
+    db_alias = schema_editor.connection.alias
+    for payload in QueryPayload.objects.using(db_alias).filter(codec='zlib').iterator(chunk_size=500):
+        data = json.loads(zlib.decompress(bytes(payload.data)))
+        QueryHistory.objects.using(db_alias).filter(payload_id=payload.digest).update(data_fetched=data)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rag_app', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='QueryPayload',
+            fields=[
+                ('digest', models.CharField(max_length=64, primary_key=True, serialize=False)),
+                ('codec', models.CharField(max_length=16)),
+                ('raw_size', models.PositiveIntegerField()),
+                ('data', models.BinaryField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'db_table': 'query_payload',
+            },
+        ),
+        migrations.AddField(
+            model_name='queryhistory',
+            name='payload',
+            field=models.ForeignKey(db_column='payload_digest', null=True, on_delete=django.db.models.deletion.PROTECT, related_name='history', to='rag_app.querypayload'),
+        ),
+        migrations.AlterField(
+            model_name='queryhistory',
+            name='data_fetched',
+            field=models.JSONField(default=list),
+        ),
+        migrations.RunPython(move_data_to_payloads, restore_data_from_payloads),
+        migrations.RemoveField(
+            model_name='queryhistory',
+            name='data_fetched',
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.2.18 on 2026-10-16 20:59
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rag_app', '0002_query_payload'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='queryhistory',
+            index=models.Index(fields=['created_at', 'id'], name='query_history_created'),
+        ),
+    ]
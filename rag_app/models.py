@@ -1,17 +1,76 @@
+import hashlib
+import json
+import zlib
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
 from django.db import models
 from django.contrib.auth.models import User
 
+try:  # Python 3.14+
+    from compression import zstd
+except ImportError:
+    zstd = None
+
+CODECS = {
+    'zlib': (lambda raw: zlib.compress(raw, 6), zlib.decompress),
+}
+if zstd is not None:
+    CODECS['zstd'] = (zstd.compress, zstd.decompress)
+
+
+class QueryPayload(models.Model):
+    """Compressed result rows, stored once and shared by every history entry that fetched them"""
+    digest = models.CharField(max_length=64, primary_key=True)
+    codec = models.CharField(max_length=16)
+    raw_size = models.PositiveIntegerField()
+    data = models.BinaryField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        db_table = 'query_payload'
+
+    @classmethod
+    def from_data(cls, data):
+        """Build an unsaved payload whose primary key is the SHA-256 of the canonical JSON"""
+        raw = json.dumps(data, sort_keys=True, separators=(',', ':'), cls=DjangoJSONEncoder).encode('utf-8')
+        codec = getattr(settings, 'RAG_PAYLOAD_CODEC', 'zlib')
+        compress, _ = CODECS[codec]
+        return cls(
+            digest=hashlib.sha256(raw).hexdigest(),
+            codec=codec,
+            raw_size=len(raw),
+            data=compress(raw),
+        )
+
+    def load(self):
+        _, decompress = CODECS[self.codec]
+        return json.loads(decompress(bytes(self.data)))
+
+    def __str__(self):
+        return f"Payload {self.digest[:12]} ({self.raw_size} bytes)"
+
+
 class QueryHistory(models.Model):
     query = models.TextField()
     sql_query = models.TextField()
     response = models.TextField()
-    data_fetched = models.JSONField()
+    payload = models.ForeignKey(
+        QueryPayload, null=True, on_delete=models.PROTECT,
+        related_name='history', db_column='payload_digest',
+    )
     created_at = models.DateTimeField(auto_now_add=True)
     
     class Meta:
         db_table = 'query_history'
+        # Newest-first listing and keyset pagination on (created_at, id)
+        indexes = [models.Index(fields=['created_at', 'id'], name='query_history_created')]
         
     def __str__(self):
         return f"Query: {self.query[:50]}..."
 
+    @property
+    def data_fetched(self):
+        return self.payload.load() if self.payload_id else []
+
 # Create your models here.
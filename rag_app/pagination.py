@@ -0,0 +1,79 @@
+from django.conf import settings
+from django.core import signing
+
+from .db import read_connection
+from .shards import get_shard_executor, get_shard_map
+
+CURSOR_SALT = 'rag_app.query.cursor'
+HISTORY_CURSOR_SALT = 'rag_app.history.cursor'
+
+# CAST keeps the values exactly as stored; selecting the columns directly would
+# run them through the sqlite date/datetime converters.
+CURSOR_KEY_SQL = """
+    SELECT CAST(cell_date AS TEXT) AS cell_date, CAST(created_at AS TEXT) AS created_at, id
+    FROM hotwash_rowcell_data WHERE id = %s
+"""
+
+
+def default_page_size():
+    return getattr(settings, 'RAG_DEFAULT_PAGE_SIZE', 50)
+
+
+def summary_sample_size():
+    return getattr(settings, 'RAG_SUMMARY_SAMPLE_SIZE', 10)
+
+
+def max_page_size():
+    return getattr(settings, 'RAG_MAX_PAGE_SIZE', 500)
+
+
+def max_stream_rows():
+    return getattr(settings, 'RAG_MAX_STREAM_ROWS', 100000)
+
+
+def max_batch_size():
+    return getattr(settings, 'RAG_MAX_BATCH_SIZE', 50)
+
+
+def history_page_size():
+    return getattr(settings, 'RAG_HISTORY_PAGE_SIZE', 20)
+
+
+def max_history_page_size():
+    return getattr(settings, 'RAG_MAX_HISTORY_PAGE_SIZE', 200)
+
+
+def encode_cursor(key, salt=CURSOR_SALT):
+    """Sign a (cell_date, created_at, id, status_id) position into an opaque token"""
+    return signing.dumps(list(key), salt=salt, compress=True)
+
+
+def decode_cursor(token, salt=CURSOR_SALT, size=4):
+    """Return the position a token encodes; raises ValueError for tampered or malformed tokens"""
+    # Tokens come straight from request bodies, where JSON can put any type
+    if not isinstance(token, str):
+        raise ValueError("Invalid cursor")
+    try:
+        key = signing.loads(token, salt=salt)
+    except signing.BadSignature as e:
+        raise ValueError("Invalid cursor") from e
+    if not isinstance(key, list) or len(key) != size:
+        raise ValueError("Invalid cursor")
+    return tuple(key)
+
+
+def cursor_after(row, sharded=False):
+    """Token for the page that starts after the given result row.
+
+    The position is read from where the row came from: with sharded, the shard holding
+    the cell, since the main database may have moved on since the split.
+    """
+    if sharded:
+        pages = get_shard_executor().scatter(CURSOR_KEY_SQL, [row['id']], sorted(get_shard_map().paths))
+        found = next((page[0] for page in pages if page), None)
+        key = (found['cell_date'], found['created_at'], found['id']) if found else None
+    else:
+        with read_connection().cursor() as cursor:
+            cursor.execute(CURSOR_KEY_SQL, [row['id']])
+            key = cursor.fetchone()
+    return encode_cursor([*key, row['status_id']]) if key else None
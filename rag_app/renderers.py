@@ -0,0 +1,32 @@
+from django.core.serializers.json import DjangoJSONEncoder
+from rest_framework.renderers import BaseRenderer
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+_encoder = DjangoJSONEncoder(ensure_ascii=False, separators=(',', ':'), check_circular=False)
+
+
+def dumps(obj):
+    """Serialize already JSON-ready data straight to UTF-8 bytes"""
+    if orjson is not None:
+        return orjson.dumps(obj, default=_encoder.default)
+    return _encoder.encode(obj).encode('utf-8')
+
+
+class FastJSONRenderer(BaseRenderer):
+    """Drop-in for JSONRenderer that skips DRF's per-request encoder setup.
+
+    Uses orjson when it is installed and the C-accelerated stdlib encoder
+    otherwise. Enable it through REST_FRAMEWORK['DEFAULT_RENDERER_CLASSES'].
+    """
+    media_type = 'application/json'
+    format = 'json'
+    charset = None
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        return dumps(data)
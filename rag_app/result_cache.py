@@ -0,0 +1,194 @@
+import abc
+import hashlib
+import re
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import DatabaseError, connection
+from django.utils.module_loading import import_string
+
+from .cache import LRUCache
+from .db import read_connection
+from .shards import data_version, shards_available
+
+# The data watermark is a change counter: triggers on every table the /query/ join
+# reads bump it on each insert, update and delete, so deleted cells and edits to
+# statuses, sheets, headers, workspaces and users all invalidate cached results.
+VERSION_TABLE = 'rag_data_version'
+SOURCE_TABLES = [
+    'hotwash_rowcell_data', 'hotwash_status_dropdown', 'hotwash_sheet',
+    'hotwash_groups_header', 'hotwash_workspace', 'authentication_user',
+]
+CREATE_TABLE_SQL = (
+    f"CREATE TABLE IF NOT EXISTS {VERSION_TABLE} (id integer PRIMARY KEY CHECK (id = 1), version integer NOT NULL)"
+)
+TRIGGERS = {
+    f'{VERSION_TABLE}_{table}_{event[0].lower()}': f"""
+        CREATE TRIGGER IF NOT EXISTS {VERSION_TABLE}_{table}_{event[0].lower()} AFTER {event} ON {table} BEGIN
+            UPDATE {VERSION_TABLE} SET version = version + 1 WHERE id = 1;
+        END
+    """
+    for table in SOURCE_TABLES for event in ('INSERT', 'UPDATE', 'DELETE')
+}
+WATERMARK_SQL = f"SELECT version FROM {VERSION_TABLE} WHERE id = 1"
+
+
+def install_triggers():
+    """Create the version row and the triggers that bump it"""
+    with connection.cursor() as cursor:
+        cursor.execute(CREATE_TABLE_SQL)
+        # Start from the clock so a re-created table never repeats a version that
+        # entries in a shared cache were tagged with
+        cursor.execute(
+            f"INSERT OR IGNORE INTO {VERSION_TABLE} (id, version) VALUES (1, %s)", [time.time_ns() // 1000]
+        )
+        for ddl in TRIGGERS.values():
+            cursor.execute(ddl)
+
+
+def drop_triggers():
+    with connection.cursor() as cursor:
+        for name in TRIGGERS:
+            cursor.execute(f"DROP TRIGGER IF EXISTS {name}")
+
+
+def drop_table():
+    drop_triggers()
+    with connection.cursor() as cursor:
+        cursor.execute(f"DROP TABLE IF EXISTS {VERSION_TABLE}")
+
+
+def bump_version():
+    """Invalidate every cached result, for writes made while the triggers were off"""
+    with connection.cursor() as cursor:
+        cursor.execute(f"UPDATE {VERSION_TABLE} SET version = version + 1 WHERE id = 1")
+
+
+class BaseResultCache(abc.ABC):
+    """Stores /query/ payloads tagged with the watermark they were computed at"""
+
+    def __init__(self, **options):
+        self.options = options
+        self.hits = 0
+        self.misses = 0
+        # Requests on different threads count into the same backend
+        self._lock = threading.Lock()
+
+    @abc.abstractmethod
+    def _get(self, key):
+        """The (watermark, payload) entry stored under key, or None"""
+
+    @abc.abstractmethod
+    def _set(self, key, entry):
+        """Store a (watermark, payload) entry under key"""
+
+    def get(self, key, watermark):
+        entry = self._get(key)
+        hit = entry is not None and entry[0] == watermark
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+        return entry[1] if hit else None
+
+    def set(self, key, watermark, payload):
+        self._set(key, (watermark, payload))
+
+    def stats(self):
+        with self._lock:
+            return {"backend": type(self).__name__, "hits": self.hits, "misses": self.misses}
+
+
+class LocMemResultCache(BaseResultCache):
+    """Per-process LRU; fastest, but each worker keeps its own copy"""
+
+    def __init__(self, maxsize=512, **options):
+        super().__init__(**options)
+        self._lru = LRUCache(maxsize)
+
+    def _get(self, key):
+        return self._lru.get(key)
+
+    def _set(self, key, entry):
+        self._lru.set(key, entry)
+
+    def stats(self):
+        return dict(super().stats(), size=len(self._lru), maxsize=self._lru.maxsize)
+
+
+class DjangoResultCache(BaseResultCache):
+    """Delegates to one of settings.CACHES so workers can share entries"""
+
+    def __init__(self, alias='default', timeout=300, **options):
+        super().__init__(**options)
+        self.alias = alias
+        self.timeout = timeout
+
+    def _get(self, key):
+        return caches[self.alias].get(f"rag_result:{key}")
+
+    def _set(self, key, entry):
+        caches[self.alias].set(f"rag_result:{key}", entry, self.timeout)
+
+
+_result_cache = None
+_result_cache_lock = threading.Lock()
+_watermark = (None, 0.0)
+
+
+def get_result_cache():
+    """Build the backend named by settings.RAG_RESULT_CACHE, or None when disabled"""
+    global _result_cache
+    if _result_cache is None:
+        with _result_cache_lock:
+            if _result_cache is None:
+                config = getattr(settings, 'RAG_RESULT_CACHE', {})
+                backend = config.get('BACKEND', 'rag_app.result_cache.LocMemResultCache')
+                if not backend:
+                    return None
+                _result_cache = import_string(backend)(**config.get('OPTIONS', {}))
+    return _result_cache
+
+
+def normalize_query(query):
+    return re.sub(r'\s+', ' ', query.strip().lower())
+
+
+def make_cache_key(query, intent, date_bounds, *extra):
+    """Key on the normalized text, its intent, the concrete dates its window resolved to
+    and any extra request options (page cursor, page size) that change the result"""
+    start, end = date_bounds
+    parts = [normalize_query(query), *intent, start, end or '', *extra]
+    raw = '|'.join(str(part) for part in parts)
+    return hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+
+def current_watermark():
+    """Return the data watermark, re-reading it at most once per WATERMARK_TTL seconds.
+
+    Returns None when the watermark cannot be read, in which case nothing should be cached;
+    that includes databases where build_data_version has not installed the counter.
+    Sharded answers are read from a snapshot, so their watermark is the shard data version.
+    """
+    global _watermark
+    ttl = getattr(settings, 'RAG_RESULT_CACHE', {}).get('WATERMARK_TTL', 1.0)
+    value, read_at = _watermark
+    now = time.monotonic()
+    if value is None or now - read_at >= ttl:
+        try:
+            if shards_available():
+                value = ('shards', *data_version())
+            else:
+                with read_connection().cursor() as cursor:
+                    cursor.execute(WATERMARK_SQL)
+                    row = cursor.fetchone()
+                if row is None:
+                    return None
+                value = row[0]
+        except DatabaseError:
+            return None
+        _watermark = (value, now)
+    return value
@@ -0,0 +1,290 @@
+import datetime
+import json
+import os
+import re
+import shutil
+import threading
+import uuid
+import zlib
+from collections import Counter
+from pathlib import Path
+
+from django.conf import settings
+
+from .db import read_connection
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Offline BM25 retrieval over hotwash cell data. A document is a hotwash_rowcell_data
+# row: its cell_data plus the names of its column and sheet. Terms are hashed into a
+# fixed number of features, so no vocabulary is kept. The index is a directory of
+# immutable segments of memory-mapped .npy arrays (postings in CSC layout, one run
+# per feature) plus manifest.json, which lists the live segments and the updated_at
+# watermark the index has caught up to. Each update appends a segment for rows
+# changed since the watermark and marks their older copies deleted. Rows are read from
+# the watermark itself on, since a row can be written with the same updated_at after a
+# run; the ids already indexed at that updated_at are kept so they are skipped.
+TOKEN_RE = re.compile(r'[a-z0-9]+')
+
+K1 = 1.2
+B = 0.75
+
+DOCUMENTS_SQL = """
+    SELECT
+        gcd.id,
+        gcd.cell_data,
+        gh.name,
+        hs.name,
+        CAST(gcd.cell_date AS TEXT),
+        CAST(gcd.updated_at AS TEXT)
+    FROM hotwash_rowcell_data gcd
+    LEFT JOIN hotwash_groups_header gh ON gcd.column_id = gh.id
+    LEFT JOIN hotwash_sheet hs ON gcd.sheet_id = hs.id
+    WHERE gcd.updated_at >= %s
+    ORDER BY gcd.updated_at
+"""
+
+
+class RetrievalUnavailable(Exception):
+    """NumPy is missing or the index has not been built"""
+
+
+def index_dir():
+    return Path(getattr(settings, 'RAG_RETRIEVAL_INDEX_DIR', settings.BASE_DIR.parent / 'rag_index'))
+
+
+def tokenize(text):
+    return TOKEN_RE.findall(text.lower()) if text else []
+
+
+def hash_features(tokens, n_features):
+    return [zlib.crc32(token.encode('utf-8')) % n_features for token in tokens]
+
+
+def date_ordinal(value):
+    try:
+        return datetime.date.fromisoformat(value[:10]).toordinal()
+    except (TypeError, ValueError):
+        return 0
+
+
+class Segment:
+    def __init__(self, path):
+        self.name = path.name
+        self.ids = np.load(path / 'ids.npy', mmap_mode='r')
+        self.dates = np.load(path / 'dates.npy', mmap_mode='r')
+        self.lengths = np.load(path / 'lengths.npy', mmap_mode='r')
+        self.post_ptr = np.load(path / 'post_ptr.npy', mmap_mode='r')
+        self.post_docs = np.load(path / 'post_docs.npy', mmap_mode='r')
+        self.post_tf = np.load(path / 'post_tf.npy', mmap_mode='r')
+        self.deleted = np.load(path / 'deleted.npy')
+
+    def document_frequency(self, features):
+        return self.post_ptr[features + 1] - self.post_ptr[features]
+
+    def scores(self, features, idf, avgdl):
+        """BM25 score of every document in the segment, one vectorized pass per query feature"""
+        scores = np.zeros(len(self.ids), dtype=np.float32)
+        for feature, weight in zip(features, idf):
+            lo, hi = self.post_ptr[feature], self.post_ptr[feature + 1]
+            if lo == hi:
+                continue
+            docs = self.post_docs[lo:hi]
+            tf = self.post_tf[lo:hi]
+            norm = K1 * (1 - B + B * self.lengths[docs] / avgdl)
+            # A feature lists each document once, so fancy-index accumulation is safe
+            scores[docs] += weight * tf * (K1 + 1) / (tf + norm)
+        return scores
+
+
+class RetrievalIndex:
+    def __init__(self, path, manifest):
+        self.path = path
+        self.n_features = manifest['n_features']
+        self.watermark = manifest['watermark']
+        self.segments = [Segment(path / entry['name']) for entry in manifest['segments']]
+        self.total_docs = sum(entry['docs'] for entry in manifest['segments'])
+        self.total_len = sum(entry['total_len'] for entry in manifest['segments'])
+
+    def search(self, text, k=10, start=None, end=None):
+        """Return up to k (row_id, score) pairs, best first, optionally limited to a cell_date range"""
+        features = np.unique(np.array(hash_features(tokenize(text), self.n_features), dtype=np.int64))
+        if not len(features) or not self.total_docs:
+            return []
+
+        df = sum(segment.document_frequency(features) for segment in self.segments)
+        idf = np.log1p((self.total_docs - df + 0.5) / (df + 0.5)).astype(np.float32)
+        avgdl = max(self.total_len / self.total_docs, 1.0)
+
+        hits = []
+        for segment in self.segments:
+            scores = segment.scores(features, idf, avgdl)
+            mask = (scores > 0) & ~segment.deleted
+            if start is not None:
+                mask &= segment.dates >= start.toordinal()
+            if end is not None:
+                mask &= segment.dates <= end.toordinal()
+            candidates = np.flatnonzero(mask)
+            if len(candidates) > k:
+                candidates = candidates[np.argpartition(-scores[candidates], k)[:k]]
+            hits.extend(zip(segment.ids[candidates].tolist(), scores[candidates].tolist()))
+
+        hits.sort(key=lambda hit: -hit[1])
+        return hits[:k]
+
+    def stats(self):
+        return {
+            "segments": len(self.segments),
+            "documents": self.total_docs,
+            "deleted": int(sum(segment.deleted.sum() for segment in self.segments)),
+            "n_features": self.n_features,
+            "watermark": self.watermark,
+        }
+
+
+_index = None
+_index_mtime = None
+_index_lock = threading.Lock()
+
+
+def get_index():
+    """The on-disk index, reloaded whenever its manifest changes"""
+    global _index, _index_mtime
+    if np is None:
+        raise RetrievalUnavailable("Retrieval requires numpy, which is not installed")
+    manifest_path = index_dir() / 'manifest.json'
+    try:
+        mtime = manifest_path.stat().st_mtime_ns
+    except FileNotFoundError:
+        raise RetrievalUnavailable(
+            "The retrieval index has not been built; run manage.py build_retrieval_index"
+        )
+    if mtime != _index_mtime:
+        with _index_lock:
+            if mtime != _index_mtime:
+                manifest = json.loads(manifest_path.read_text())
+                _index = RetrievalIndex(manifest_path.parent, manifest)
+                _index_mtime = mtime
+    return _index
+
+
+def _read_manifest(path):
+    try:
+        return json.loads((path / 'manifest.json').read_text())
+    except FileNotFoundError:
+        return None
+
+
+def _write_manifest(path, manifest):
+    tmp = path / f'manifest.json.{uuid.uuid4().hex}'
+    tmp.write_text(json.dumps(manifest, indent=2))
+    os.replace(tmp, path / 'manifest.json')
+
+
+def _save_array(path, name, array):
+    tmp = path / f'{name}.{uuid.uuid4().hex}.npy'
+    np.save(tmp, array)
+    os.replace(tmp, path / f'{name}.npy')
+
+
+def _write_segment(path, documents, n_features):
+    """Write documents [(id, text, date_ordinal)] as a new segment and return its manifest entry"""
+    ids, dates, lengths = [], [], []
+    feature_col, doc_col, tf_col = [], [], []
+    for position, (row_id, text, ordinal) in enumerate(documents):
+        counts = Counter(hash_features(tokenize(text), n_features))
+        ids.append(row_id)
+        dates.append(ordinal)
+        lengths.append(sum(counts.values()))
+        feature_col.extend(counts.keys())
+        doc_col.extend([position] * len(counts))
+        tf_col.extend(counts.values())
+
+    features = np.array(feature_col, dtype=np.int64)
+    order = np.argsort(features, kind='stable')
+    post_ptr = np.zeros(n_features + 1, dtype=np.int64)
+    np.cumsum(np.bincount(features, minlength=n_features), out=post_ptr[1:])
+
+    name = f'seg-{uuid.uuid4().hex[:12]}'
+    segment_path = path / name
+    segment_path.mkdir(parents=True)
+    np.save(segment_path / 'ids.npy', np.array(ids, dtype=np.int64))
+    np.save(segment_path / 'dates.npy', np.array(dates, dtype=np.int32))
+    np.save(segment_path / 'lengths.npy', np.array(lengths, dtype=np.float32))
+    np.save(segment_path / 'post_ptr.npy', post_ptr)
+    np.save(segment_path / 'post_docs.npy', np.array(doc_col, dtype=np.int32)[order])
+    np.save(segment_path / 'post_tf.npy', np.array(tf_col, dtype=np.float32)[order])
+    np.save(segment_path / 'deleted.npy', np.zeros(len(ids), dtype=bool))
+    return {"name": name, "docs": len(ids), "total_len": int(sum(lengths))}
+
+
+def update_index(rebuild=False, n_features=None, segment_docs=500000, max_segments=16):
+    """Index rows changed since the manifest watermark; returns the number of documents written.
+
+    A full rebuild happens when asked for, when there is no index yet, when the
+    feature count changes or when the index has grown past max_segments.
+    """
+    if np is None:
+        raise RetrievalUnavailable("Retrieval requires numpy, which is not installed")
+    path = index_dir()
+    path.mkdir(parents=True, exist_ok=True)
+    manifest = _read_manifest(path)
+    n_features = n_features or getattr(settings, 'RAG_RETRIEVAL_FEATURES', 2 ** 18)
+    if (
+        rebuild or manifest is None or manifest['n_features'] != n_features
+        or len(manifest['segments']) >= max_segments
+    ):
+        old_segments = [entry['name'] for entry in manifest['segments']] if manifest else []
+        manifest = {"n_features": n_features, "watermark": "", "watermark_ids": [], "segments": []}
+    else:
+        old_segments = []
+
+    written = 0
+    start = watermark = manifest['watermark']
+    indexed_at_start = set(manifest.get('watermark_ids', []))
+    watermark_ids = set(indexed_at_start)
+    new_entries = []
+    with read_connection().cursor() as cursor:
+        cursor.execute(DOCUMENTS_SQL, [watermark])
+        while True:
+            rows = cursor.fetchmany(segment_docs)
+            if not rows:
+                break
+            rows = [row for row in rows if not (row[5] == start and row[0] in indexed_at_start)]
+            if not rows:
+                continue
+            for row_id, *_columns, updated_at in rows:
+                if (updated_at or '') > watermark:
+                    watermark, watermark_ids = updated_at, set()
+                watermark_ids.add(row_id)
+            documents = [
+                (row_id, ' '.join(part for part in (cell_data, column, sheet) if part), date_ordinal(cell_date))
+                for row_id, cell_data, column, sheet, cell_date, _updated_at in rows
+            ]
+            new_entries.append(_write_segment(path, documents, n_features))
+            written += len(rows)
+
+    if not new_entries and not old_segments:
+        return 0
+
+    # Earlier copies of re-indexed rows stop matching
+    if manifest['segments'] and new_entries:
+        new_ids = np.concatenate([np.load(path / entry['name'] / 'ids.npy') for entry in new_entries])
+        for entry in manifest['segments']:
+            segment_path = path / entry['name']
+            deleted = np.load(segment_path / 'deleted.npy')
+            superseded = np.isin(np.load(segment_path / 'ids.npy', mmap_mode='r'), new_ids)
+            if superseded.any():
+                _save_array(segment_path, 'deleted', deleted | superseded)
+
+    manifest['segments'].extend(new_entries)
+    manifest['watermark'] = watermark
+    manifest['watermark_ids'] = sorted(watermark_ids)
+    _write_manifest(path, manifest)
+
+    for name in old_segments:
+        shutil.rmtree(path / name, ignore_errors=True)
+    return written
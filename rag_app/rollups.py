@@ -0,0 +1,386 @@
+import datetime
+import functools
+import re
+from collections import Counter
+
+from django.conf import settings
+from django.db import DatabaseError, connection, transaction
+from django.utils import timezone
+
+from .db import read_connection
+from .facts import LIVE_JOIN
+from .sql_templates import (
+    OPEN_RANGE, SOURCES, SUMMARY_SELECT, build_conditions, build_summary_groups, resolve_date_window,
+    summary_intent, user_id_param, user_params,
+)
+
+# Closed days rarely change once the day is over, so summaries over them are read from
+# per-day roll-ups instead of re-scanning every cell. task_rollup has one row per
+# (day, subject, owner, workspace, status): the subject is the owner plus every user the
+# cell mentions, so "user 7" windows (owned by or mentioning user 7) are a lookup on
+# subject_id, and owner rows (subject_id IS owner_id) give the unfiltered totals.
+ROLLUP_TABLE = 'task_rollup'
+# The task texts counted most often per (day, subject), with ALL_SUBJECTS standing for
+# every cell of the day. Summing them over a window gives its most frequent tasks, exact
+# unless a task was outside some day's top list.
+ROLLUP_TASKS_TABLE = 'task_rollup_tasks'
+ALL_SUBJECTS = 0
+# Days that have been rolled up, with the hotwash_rowcell_data.updated_at watermark they saw
+ROLLUP_DAYS_TABLE = 'task_rollup_days'
+# The day each rolled-up cell was counted on, so an edit that moves a cell to another
+# day re-rolls the day it left as well as the day it joined
+ROLLUP_CELLS_TABLE = 'task_rollup_cells'
+# Days whose source rows changed after they were rolled up. Triggers on the tables the
+# roll-up reads add the days a write touches, deletes and dimension edits included, and
+# summaries fall back to the live rows for a window holding one until it is re-rolled.
+ROLLUP_STALE_TABLE = 'task_rollup_stale'
+
+CREATE_TABLES_SQL = [
+    f"""CREATE TABLE IF NOT EXISTS {ROLLUP_TABLE} (
+        day date NOT NULL, subject_id integer, owner_id integer, workspace_id integer,
+        status varchar(100), tasks integer NOT NULL)""",
+    # Both cover the window roll-up: per subject for user windows, per day for the rest
+    f"""CREATE INDEX IF NOT EXISTS {ROLLUP_TABLE}_subject_day
+        ON {ROLLUP_TABLE} (subject_id, day, owner_id, workspace_id, status, tasks)""",
+    f"""CREATE INDEX IF NOT EXISTS {ROLLUP_TABLE}_day
+        ON {ROLLUP_TABLE} (day, subject_id, owner_id, workspace_id, status, tasks)""",
+    f"""CREATE TABLE IF NOT EXISTS {ROLLUP_TASKS_TABLE} (
+        day date NOT NULL, subject_id integer NOT NULL, task text, tasks integer NOT NULL)""",
+    f"CREATE INDEX IF NOT EXISTS {ROLLUP_TASKS_TABLE}_subject_day ON {ROLLUP_TASKS_TABLE} (subject_id, day)",
+    f"""CREATE TABLE IF NOT EXISTS {ROLLUP_DAYS_TABLE} (
+        day date PRIMARY KEY, cells integer NOT NULL, watermark datetime, built_at datetime NOT NULL)""",
+    f"""CREATE TABLE IF NOT EXISTS {ROLLUP_CELLS_TABLE} (
+        cell_id integer PRIMARY KEY, day date NOT NULL) WITHOUT ROWID""",
+    f"CREATE INDEX IF NOT EXISTS {ROLLUP_CELLS_TABLE}_day ON {ROLLUP_CELLS_TABLE} (day)",
+    f"CREATE TABLE IF NOT EXISTS {ROLLUP_STALE_TABLE} (day date PRIMARY KEY) WITHOUT ROWID",
+]
+
+# For each dimension table, the cells a change to one of its rows can move between
+# owners, workspaces or statuses; headers are left out as the roll-up reads nothing of them
+_STALE_CELLS = {
+    'hotwash_sheet': lambda row: f"sheet_id = {row}.id",
+    'hotwash_workspace': lambda row: f"sheet_id IN (SELECT id FROM hotwash_sheet WHERE workspace_id = {row}.id)",
+    'authentication_user': lambda row: (
+        "sheet_id IN (SELECT hs.id FROM hotwash_sheet hs "
+        f"JOIN hotwash_workspace hw ON hs.workspace_id = hw.id WHERE hw.user_id = {row}.id)"
+    ),
+    'hotwash_status_dropdown': lambda row: f"(sheet_id = {row}.sheet_id AND column_id = {row}.column_id)",
+}
+
+
+def _build_triggers():
+    triggers = {}
+    for event, rows in (('insert', ('new',)), ('delete', ('old',)), ('update', ('old', 'new'))):
+        name = f'{ROLLUP_STALE_TABLE}_hotwash_rowcell_data_{event}'
+        days = ', '.join(f"(date({row}.cell_date))" for row in rows)
+        triggers[name] = (
+            f"CREATE TRIGGER IF NOT EXISTS {name} AFTER {event.upper()} ON hotwash_rowcell_data BEGIN\n"
+            f"            INSERT OR IGNORE INTO {ROLLUP_STALE_TABLE} (day) VALUES {days};\n"
+            f"        END"
+        )
+        for table, cells in _STALE_CELLS.items():
+            name = f'{ROLLUP_STALE_TABLE}_{table}_{event}'
+            triggers[name] = (
+                f"CREATE TRIGGER IF NOT EXISTS {name} AFTER {event.upper()} ON {table} BEGIN\n"
+                f"            INSERT OR IGNORE INTO {ROLLUP_STALE_TABLE} (day) "
+                f"SELECT DISTINCT date(cell_date) FROM hotwash_rowcell_data "
+                f"WHERE {' OR '.join(cells(row) for row in rows)};\n"
+                f"        END"
+            )
+    return triggers
+
+
+TRIGGERS = _build_triggers()
+
+# The rows of one day, with the owner the /query/ user_id condition compares against
+DAY_ROWS_SQL = (
+    "SELECT gcd.cell_data, au.id, hw.id, sd.status_text" + LIVE_JOIN
+    + "WHERE gcd.cell_date >= %s AND gcd.cell_date < %s"
+)
+DAY_CELLS_SQL = (
+    f"INSERT OR REPLACE INTO {ROLLUP_CELLS_TABLE} (cell_id, day) "
+    "SELECT id, %s FROM hotwash_rowcell_data WHERE cell_date >= %s AND cell_date < %s"
+)
+LIVE_DAY_COUNTS_SQL = (
+    "SELECT CAST(gcd.cell_date AS TEXT), COUNT(*)" + LIVE_JOIN
+    + "WHERE gcd.cell_date >= %s AND gcd.cell_date < %s GROUP BY 1"
+)
+
+# Mentions follow the FTS5 unicode61 tokenizer, so a subject matches exactly the cells
+# the phrase query "user 7" finds: the tokens user and 7, adjacent, in any case.
+TOKEN_RE = re.compile(r'[^\W_]+')
+
+TOP_TASKS = 10
+
+ROLLUP_GROUPS = f"""
+            SELECT owner_id AS user_id, workspace_id, status, SUM(tasks) AS tasks,
+                MIN(day) AS first_date, MAX(day) AS last_date
+            FROM {ROLLUP_TABLE}
+            WHERE {{subject}} AND day >= %s AND day < %s
+            GROUP BY 1, 2, 3"""
+
+ROLLUP_TASKS = f"""
+            SELECT task, SUM(tasks) AS tasks
+            FROM {ROLLUP_TASKS_TABLE}
+            WHERE subject_id = %s AND day >= %s AND day < %s
+            GROUP BY 1"""
+
+# The open end of a window, from today on, still comes from the live rows
+LIVE_TASKS = """
+            SELECT {cell_data} AS task, COUNT(*) AS tasks
+            {from_clause}
+            WHERE {conditions}
+            GROUP BY 1"""
+
+SUBJECT_CONDITIONS = {
+    None: "subject_id IS owner_id",
+    'user_id': "subject_id = %s",
+}
+
+TASKS_SELECT = """
+        UNION ALL
+        SELECT * FROM (
+            SELECT 'task', task, SUM(tasks), NULL, NULL, NULL, NULL, task
+            FROM window_tasks GROUP BY task ORDER BY 3 DESC, 2 LIMIT %s
+        )
+        """
+
+
+def mentioned_users(text):
+    """User ids a cell mentions, as in 'for user 7'"""
+    tokens = TOKEN_RE.findall((text or '').lower())
+    return {
+        int(number) for word, number in zip(tokens, tokens[1:])
+        if word == 'user' and number.isdecimal() and str(int(number)) == number
+        and user_id_param(number) is not None
+    }
+
+
+@functools.lru_cache(maxsize=None)
+def rollups_available():
+    """Whether summaries may read the roll-ups; checked once per process.
+
+    Roll-ups built before the stale-day triggers existed are not used until
+    build_rollups has run again and installed them.
+    """
+    if not getattr(settings, 'RAG_USE_ROLLUPS', True):
+        return False
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = %s", [ROLLUP_STALE_TABLE])
+            return cursor.fetchone() is not None
+    except DatabaseError:
+        return False
+
+
+def create_tables():
+    with connection.cursor() as cursor:
+        for ddl in CREATE_TABLES_SQL:
+            cursor.execute(ddl)
+        for ddl in TRIGGERS.values():
+            cursor.execute(ddl)
+    rollups_available.cache_clear()
+
+
+def drop_triggers():
+    with connection.cursor() as cursor:
+        for name in TRIGGERS:
+            cursor.execute(f"DROP TRIGGER IF EXISTS {name}")
+
+
+def drop_tables():
+    drop_triggers()
+    with connection.cursor() as cursor:
+        for table in (ROLLUP_TABLE, ROLLUP_TASKS_TABLE, ROLLUP_DAYS_TABLE, ROLLUP_CELLS_TABLE, ROLLUP_STALE_TABLE):
+            cursor.execute(f"DROP TABLE IF EXISTS {table}")
+    rollups_available.cache_clear()
+
+
+def _day_range(start, end):
+    day = start
+    while day < end:
+        yield day
+        day += datetime.timedelta(days=1)
+
+
+def build_day(day, watermark):
+    """Replace the roll-up of one day; returns the number of cell rows it covers"""
+    next_day = day + datetime.timedelta(days=1)
+    groups = Counter()
+    texts = {}
+    cells = 0
+    with transaction.atomic(), connection.cursor() as cursor:
+        # Clearing the mark first takes the write lock, so no write can land between
+        # reading the rows and storing their roll-up without marking the day again
+        cursor.execute(f"DELETE FROM {ROLLUP_STALE_TABLE} WHERE day = %s", [day.isoformat()])
+        cursor.execute(DAY_ROWS_SQL, [day.isoformat(), next_day.isoformat()])
+        for text, owner_id, workspace_id, status in cursor.fetchall():
+            cells += 1
+            subjects = {owner_id} | mentioned_users(text)
+            for subject_id in subjects:
+                groups[(subject_id, owner_id, workspace_id, status)] += 1
+            for subject_id in subjects - {None} | {ALL_SUBJECTS}:
+                texts.setdefault(subject_id, Counter())[text] += 1
+        for table in (ROLLUP_TABLE, ROLLUP_TASKS_TABLE, ROLLUP_CELLS_TABLE):
+            cursor.execute(f"DELETE FROM {table} WHERE day = %s", [day.isoformat()])
+        cursor.execute(DAY_CELLS_SQL, [day.isoformat(), day.isoformat(), next_day.isoformat()])
+        cursor.executemany(
+            f"INSERT INTO {ROLLUP_TABLE} VALUES (%s, %s, %s, %s, %s, %s)",
+            [(day.isoformat(), *key, count) for key, count in groups.items()],
+        )
+        cursor.executemany(
+            f"INSERT INTO {ROLLUP_TASKS_TABLE} VALUES (%s, %s, %s, %s)",
+            [
+                (day.isoformat(), subject_id, text, count)
+                for subject_id, counts in texts.items() for text, count in counts.most_common(TOP_TASKS)
+            ],
+        )
+        cursor.execute(
+            f"INSERT OR REPLACE INTO {ROLLUP_DAYS_TABLE} VALUES (%s, %s, %s, %s)",
+            [day.isoformat(), cells, watermark, timezone.now().isoformat(sep=' ')],
+        )
+    return cells
+
+
+def current_watermark():
+    """The newest updated_at in hotwash_rowcell_data, as stored"""
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT CAST(MAX(updated_at) AS TEXT) FROM hotwash_rowcell_data")
+        return cursor.fetchone()[0]
+
+
+def refresh(today=None, rebuild=False):
+    """Roll up every closed day that has not been, and re-roll the days of changed cells.
+
+    Days run from the oldest cell to yesterday. A day is re-rolled when the triggers
+    marked it stale, and, to catch up on writes made while they were off, when one of
+    its cells has an updated_at newer than the watermark of the last run or such a cell
+    was counted on it before its date changed. Returns (built, patched).
+    """
+    today = today or timezone.now().date()
+    create_tables()
+    with connection.cursor() as cursor:
+        # Read before the rows so edits made during the run are patched next time
+        watermark = current_watermark()
+        cursor.execute("SELECT CAST(MIN(cell_date) AS TEXT) FROM hotwash_rowcell_data")
+        first_day = cursor.fetchone()[0]
+        if rebuild:
+            for table in (
+                ROLLUP_DAYS_TABLE, ROLLUP_TABLE, ROLLUP_TASKS_TABLE, ROLLUP_CELLS_TABLE, ROLLUP_STALE_TABLE,
+            ):
+                cursor.execute(f"DELETE FROM {table}")
+        cursor.execute(f"SELECT CAST(day AS TEXT) FROM {ROLLUP_DAYS_TABLE}")
+        built = {row[0] for row in cursor.fetchall()}
+        cursor.execute(f"SELECT MAX(watermark) FROM {ROLLUP_DAYS_TABLE}")
+        last_watermark = cursor.fetchone()[0]
+        cursor.execute(f"SELECT CAST(day AS TEXT) FROM {ROLLUP_STALE_TABLE}")
+        edited = {row[0] for row in cursor.fetchall()} & built
+        if last_watermark is not None:
+            cursor.execute(
+                "SELECT DISTINCT CAST(cell_date AS TEXT) FROM hotwash_rowcell_data "
+                "WHERE updated_at > %s AND cell_date < %s",
+                [last_watermark, today.isoformat()],
+            )
+            edited |= {row[0][:10] for row in cursor.fetchall()} & built
+            # The days edited cells were counted on, which differ when their date changed
+            cursor.execute(
+                f"SELECT DISTINCT CAST(r.day AS TEXT) FROM hotwash_rowcell_data gcd "
+                f"JOIN {ROLLUP_CELLS_TABLE} r ON r.cell_id = gcd.id WHERE gcd.updated_at > %s",
+                [last_watermark],
+            )
+            edited |= {row[0][:10] for row in cursor.fetchall()} & built
+
+    if first_day is None:
+        return 0, 0
+    missing = [
+        day for day in _day_range(datetime.date.fromisoformat(first_day[:10]), today)
+        if day.isoformat() not in built
+    ]
+    for day in missing:
+        build_day(day, watermark)
+    for day in sorted(edited):
+        build_day(datetime.date.fromisoformat(day), watermark)
+    if missing or edited:
+        with connection.cursor() as cursor:
+            cursor.execute(f"ANALYZE {ROLLUP_TABLE}")
+            cursor.execute(f"ANALYZE {ROLLUP_TASKS_TABLE}")
+    return len(missing), len(edited)
+
+
+def check_consistency(today=None, sample=10):
+    """Compare the cell count of every rolled-up day with the live join.
+
+    Returns the number of days checked and up to sample days whose counts differ.
+    """
+    today = today or timezone.now().date()
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"SELECT CAST(d.day AS TEXT), COALESCE(SUM(r.tasks), 0) FROM {ROLLUP_DAYS_TABLE} d "
+            f"LEFT JOIN {ROLLUP_TABLE} r ON r.day = d.day AND r.subject_id IS r.owner_id GROUP BY 1"
+        )
+        rolled = dict(cursor.fetchall())
+        if not rolled:
+            return {"days": 0, "differences": []}
+        cursor.execute(LIVE_DAY_COUNTS_SQL, [min(rolled), today.isoformat()])
+        live = {day[:10]: count for day, count in cursor.fetchall()}
+    differences = [
+        {"day": day, "rollup": count, "live": live.get(day, 0)}
+        for day, count in sorted(rolled.items()) if live.get(day, 0) != count
+    ]
+    return {"days": len(rolled), "differences": differences[:sample], "different": len(differences)}
+
+
+def covered(start, end):
+    """Whether every day in [start, end) has been rolled up and none has changed since"""
+    days = (end - start).days
+    with read_connection().cursor() as cursor:
+        cursor.execute(
+            f"SELECT COUNT(*) FROM {ROLLUP_DAYS_TABLE} d WHERE d.day >= %s AND d.day < %s "
+            f"AND NOT EXISTS (SELECT 1 FROM {ROLLUP_STALE_TABLE} s WHERE s.day = d.day)",
+            [start.isoformat(), end.isoformat()],
+        )
+        return cursor.fetchone()[0] == days
+
+
+def summary_query(intent, user_value, group_limit, today=None):
+    """Return (sql, params) summarizing an intent's window from the roll-ups, or None.
+
+    Closed days come from task_rollup and the rest of an open-ended window from the live
+    rows. None means the live summary must be used: today-only windows, username
+    filters and LIKE matching (whose substring semantics the roll-ups don't share), or
+    days that have not been rolled up yet or have changed since.
+    """
+    intent = summary_intent(intent)
+    if intent.user_filter not in SUBJECT_CONDITIONS or (intent.user_filter and intent.match_mode != 'fts'):
+        return None
+    today = today or timezone.now().date()
+    start, end = resolve_date_window(intent.date_window, today)
+    closed_end = today if end is None else min(end + datetime.timedelta(days=1), today)
+    if start >= closed_end or not rollups_available() or not covered(start, closed_end):
+        return None
+
+    subject = SUBJECT_CONDITIONS[intent.user_filter]
+    subject_params = [user_id_param(user_value)] if intent.user_filter else []
+    groups = ROLLUP_GROUPS.format(subject=subject)
+    tasks = ROLLUP_TASKS
+    groups_params = subject_params + [start.isoformat(), closed_end.isoformat()]
+    tasks_params = [user_id_param(user_value) if intent.user_filter else ALL_SUBJECTS, start.isoformat(), closed_end.isoformat()]
+
+    if end is None:
+        # Everything from today on, under the intent's own user condition
+        conditions = build_conditions(intent)[:-1] + [OPEN_RANGE]
+        live_params = user_params(intent.user_filter, user_value, intent.match_mode) + [today.isoformat()]
+        source = SOURCES[intent.source]
+        groups += "\n            UNION ALL" + build_summary_groups(intent, conditions)
+        tasks += "\n            UNION ALL" + LIVE_TASKS.format(
+            conditions=" AND ".join(conditions).format_map(source), from_clause=source['from'].strip(), **source,
+        )
+        groups_params += live_params
+        tasks_params += live_params
+
+    sql = (
+        f"\n        WITH window_groups AS MATERIALIZED ({groups}\n        ),"
+        f"\n        window_tasks AS ({tasks}\n        )"
+        + SUMMARY_SELECT + TASKS_SELECT
+    )
+    return sql, groups_params + tasks_params + [group_limit] * 4
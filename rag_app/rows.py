@@ -0,0 +1,65 @@
+import datetime
+from decimal import Decimal
+
+from django.conf import settings
+
+from .cache import LRUCache
+
+
+def _datetime_to_date(value):
+    return value.date().isoformat()
+
+
+def _generic(value):
+    """Per-value conversion, used for columns whose type the first row doesn't reveal"""
+    if hasattr(value, 'strftime'):  # date/datetime objects
+        return value.strftime('%Y-%m-%d') if hasattr(value, 'date') else str(value)
+    if isinstance(value, Decimal):
+        return float(value)
+    return value
+
+
+# Converters by Python type of the fetched value; types not listed pass through unchanged.
+# datetime is rendered as its date, as the /query/ payload always has.
+CONVERTERS = {
+    datetime.datetime: _datetime_to_date,
+    datetime.date: datetime.date.isoformat,
+    datetime.time: datetime.time.isoformat,
+    Decimal: float,
+}
+
+_plans = LRUCache(getattr(settings, 'RAG_ROW_PLAN_CACHE_SIZE', 64))
+
+
+class RowPlan:
+    """Column names plus the converters a result shape needs, applied column-wise"""
+
+    def __init__(self, columns, first_row):
+        self.columns = columns
+        self.conversions = []
+        for index, (name, value) in enumerate(zip(columns, first_row)):
+            if value is None:
+                converter = _generic
+            else:
+                converter = CONVERTERS.get(type(value))
+            if converter is not None:
+                self.conversions.append((index, name, converter))
+
+    def convert(self, rows):
+        """Return rows as dicts; only columns that need a converter are touched"""
+        columns = self.columns
+        data = [dict(zip(columns, row)) for row in rows]
+        for index, name, converter in self.conversions:
+            for row, row_dict in zip(rows, data):
+                value = row[index]
+                if value is not None:
+                    row_dict[name] = converter(value)
+        return data
+
+
+def plan_rows(description, first_row):
+    """Look up (or build) the RowPlan for a cursor description and its first row"""
+    columns = tuple(col[0] for col in description)
+    shape = (columns, tuple(type(value) for value in first_row))
+    plan, _ = _plans.get_or_create(shape, lambda: RowPlan(columns, first_row))
+    return plan
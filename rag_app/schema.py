@@ -0,0 +1,129 @@
+import hashlib
+import json
+import threading
+import time
+
+from django.conf import settings
+from django.db import DatabaseError
+from django.utils import timezone
+
+from .db import read_connection
+
+# Tables the RAG views read, with the columns the SQL templates rely on
+SCHEMA_TABLES = {
+    'hotwash_rowcell_data': {
+        'columns': ['id', 'sheet_id', 'column_id', 'row_id', 'column_index', 'column_type', 'cell_data', 'cell_date', 'created_at', 'updated_at'],
+        'description': 'Main cell data with tasks and dates'
+    },
+    'hotwash_groups_header': {
+        'columns': ['id', 'name', 'column_type', 'column_index', 'sheet_id', 'group_id'],
+        'description': 'Column headers and types for sheets'
+    },
+    'hotwash_sheet': {
+        'columns': ['id', 'name', 'privacy_type', 'user_id', 'workspace_id'],
+        'description': 'Sheet information'
+    },
+    'hotwash_workspace': {
+        'columns': ['id', 'workspace_name', 'description', 'user_id'],
+        'description': 'Workspace information'
+    },
+    'authentication_user': {
+        'columns': ['id', 'name', 'username', 'email', 'studid'],
+        'description': 'User information'
+    },
+    'hotwash_status_dropdown': {
+        'columns': ['id', 'sheet_id', 'column_id', 'status_text', 'status_color', 'status_type'],
+        'description': 'Status options for cells'
+    }
+}
+
+
+class SchemaSnapshot:
+    """Introspected schema at one PRAGMA schema_version, with validators for conditional GET"""
+
+    def __init__(self, version, schema):
+        self.version = version
+        self.schema = schema
+        self.loaded_at = timezone.now()
+        body = json.dumps(schema, sort_keys=True).encode('utf-8')
+        self.etag = f'"{hashlib.sha1(body).hexdigest()}"'
+
+
+def _quote(name):
+    return '"' + name.replace('"', '""') + '"'
+
+
+def introspect(cursor, table, expected):
+    """Describe one table from PRAGMA table_info / index_list / index_info"""
+    cursor.execute(f'PRAGMA table_info({_quote(table)})')
+    columns = [row[1] for row in cursor.fetchall()]
+    if not columns:
+        return {
+            'columns': [],
+            'description': expected['description'],
+            'exists': False,
+            'missing_columns': list(expected['columns']),
+            'indexes': [],
+        }
+
+    cursor.execute(f'PRAGMA index_list({_quote(table)})')
+    indexes = []
+    for _seq, name, unique, origin, _partial in cursor.fetchall():
+        cursor.execute(f'PRAGMA index_info({_quote(name)})')
+        indexes.append({
+            'name': name,
+            # Expression index columns have no name
+            'columns': [row[2] if row[2] is not None else '<expr>' for row in cursor.fetchall()],
+            'unique': bool(unique),
+            'origin': origin,
+        })
+    return {
+        'columns': columns,
+        'description': expected['description'],
+        'exists': True,
+        'missing_columns': [column for column in expected['columns'] if column not in columns],
+        'indexes': sorted(indexes, key=lambda index: index['name']),
+    }
+
+
+class SchemaRegistry:
+    """Process-wide schema shared by the views.
+
+    Loaded on first use and reloaded only when SQLite's schema_version changes;
+    the version is re-read at most every RAG_SCHEMA_CHECK_INTERVAL seconds.
+    """
+
+    def __init__(self, tables):
+        self.tables = tables
+        self._snapshot = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+
+    def get(self):
+        interval = getattr(settings, 'RAG_SCHEMA_CHECK_INTERVAL', 5.0)
+        snapshot = self._snapshot
+        if snapshot is not None and time.monotonic() - self._checked_at < interval:
+            return snapshot
+        with self._lock:
+            try:
+                with read_connection().cursor() as cursor:
+                    cursor.execute('PRAGMA schema_version')
+                    version = cursor.fetchone()[0]
+                    if self._snapshot is None or self._snapshot.version != version:
+                        schema = {
+                            table: introspect(cursor, table, expected)
+                            for table, expected in self.tables.items()
+                        }
+                        self._snapshot = SchemaSnapshot(version, schema)
+            except DatabaseError:
+                if self._snapshot is None:
+                    raise
+            self._checked_at = time.monotonic()
+            return self._snapshot
+
+    def invalidate(self):
+        with self._lock:
+            self._snapshot = None
+
+
+schema_registry = SchemaRegistry(SCHEMA_TABLES)
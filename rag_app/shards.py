@@ -0,0 +1,500 @@
+import functools
+import heapq
+import os
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from itertools import chain, islice
+from pathlib import Path
+
+from django.conf import settings
+from django.db import DatabaseError, connection
+from django.utils import timezone
+
+from .admission import PROGRESS_INTERVAL
+from .db import read_alias, read_connection
+from .facts import FACTS_TABLE
+from .fts import FTS_TABLE
+from .rollups import mentioned_users
+from .rows import plan_rows
+from .schema import SCHEMA_TABLES
+from .sql_templates import user_id_param
+
+# The optional sharded layout splits the hotwash tables into one SQLite file per group
+# of workspaces. All workspaces of one owner share a shard, so the owner condition of a
+# user_id question and the per-user and per-workspace summary groups each live on one
+# shard. Shards are a snapshot of the source database, which split_shards leaves intact.
+SHARD_TABLE = 'rag_shard'
+SHARD_MAP_TABLE = 'rag_shard_map'
+SHARD_MENTIONS_TABLE = 'rag_shard_mentions'
+
+CREATE_TABLES_SQL = [
+    f"""CREATE TABLE IF NOT EXISTS {SHARD_TABLE} (
+        shard integer PRIMARY KEY, path text NOT NULL,
+        workspaces integer NOT NULL, cells integer NOT NULL, built_at datetime NOT NULL
+    )""",
+    f"""CREATE TABLE IF NOT EXISTS {SHARD_MAP_TABLE} (
+        workspace_id integer PRIMARY KEY, owner_id integer, shard integer NOT NULL
+    )""",
+    # Shards holding cells that mention a user, so mention matches can be routed too
+    f"""CREATE TABLE IF NOT EXISTS {SHARD_MENTIONS_TABLE} (
+        user_id integer NOT NULL, shard integer NOT NULL, PRIMARY KEY (user_id, shard)
+    ) WITHOUT ROWID""",
+]
+
+WORKSPACE_LOAD_SQL = """
+    SELECT hw.id, hw.user_id, COUNT(gcd.id)
+    FROM hotwash_workspace hw
+    LEFT JOIN hotwash_sheet hs ON hs.workspace_id = hw.id
+    LEFT JOIN hotwash_rowcell_data gcd ON gcd.sheet_id = hs.id
+    GROUP BY hw.id
+"""
+
+# Run on the new shard file with the source attached as src. Sheets of unmapped
+# workspaces and cells of unknown sheets go to shard 0, so every cell lands somewhere.
+SHARD_SHEETS_SQL = f"""
+    CREATE TEMP TABLE shard_sheets AS
+    SELECT id FROM src.hotwash_sheet hs
+    WHERE COALESCE((SELECT shard FROM src.{SHARD_MAP_TABLE} m WHERE m.workspace_id = hs.workspace_id), 0) = :shard
+"""
+ORPHAN_CONDITION = "(:shard = 0 AND (sheet_id IS NULL OR sheet_id NOT IN (SELECT id FROM src.hotwash_sheet)))"
+COPY_CONDITIONS = {
+    'authentication_user': "1",
+    'hotwash_workspace': f"id IN (SELECT workspace_id FROM src.{SHARD_MAP_TABLE} WHERE shard = :shard)",
+    'hotwash_sheet': "id IN (SELECT id FROM shard_sheets)",
+    'hotwash_rowcell_data': f"sheet_id IN (SELECT id FROM shard_sheets) OR {ORPHAN_CONDITION}",
+    # Headers are joined by column id, so every header a shard's cells point at is copied
+    'hotwash_groups_header': (
+        "sheet_id IN (SELECT id FROM shard_sheets) OR id IN (SELECT column_id FROM main.hotwash_rowcell_data)"
+    ),
+    'hotwash_status_dropdown': f"sheet_id IN (SELECT id FROM shard_sheets) OR {ORPHAN_CONDITION}",
+    FACTS_TABLE: "cell_id IN (SELECT id FROM main.hotwash_rowcell_data)",
+}
+
+SORT_COLUMNS = ('sort_date', 'sort_created_at', 'sort_rank')
+
+MAP_VERSION_SQL = f"SELECT COUNT(*), MAX(built_at) FROM {SHARD_TABLE}"
+
+
+@functools.lru_cache(maxsize=None)
+def shards_available():
+    """Whether /query/ should read the shard files; checked once per process"""
+    if not getattr(settings, 'RAG_SHARDS', {}).get('ENABLED', False):
+        return False
+    try:
+        with read_connection().cursor() as cursor:
+            cursor.execute(f"SELECT count(*) FROM {SHARD_TABLE}")
+            return cursor.fetchone()[0] > 0
+    except DatabaseError:
+        return False
+
+
+def shard_path(shard, directory=None):
+    directory = Path(directory or getattr(settings, 'RAG_SHARDS', {}).get('DIR', 'shards'))
+    return directory / f'shard_{shard:02d}.sqlite3'
+
+
+def plan_shards(workspaces, count):
+    """{workspace_id: shard} balancing cells over count shards, one owner's workspaces together.
+
+    workspaces is [(workspace_id, owner_id, cells)]; owners are placed largest first on
+    the least loaded shard.
+    """
+    groups = {}
+    for workspace_id, owner_id, cells in workspaces:
+        key = ('owner', owner_id) if owner_id is not None else ('workspace', workspace_id)
+        members, load = groups.get(key, ([], 0))
+        groups[key] = (members + [workspace_id], load + cells)
+    loads = [(0, shard) for shard in range(count)]
+    assignment = {}
+    for members, load in sorted(groups.values(), key=lambda group: (-group[1], group[0])):
+        shard_load, shard = heapq.heappop(loads)
+        assignment.update(dict.fromkeys(members, shard))
+        heapq.heappush(loads, (shard_load + load, shard))
+    return assignment
+
+
+def write_map(assignment, owners):
+    with connection.cursor() as cursor:
+        for ddl in CREATE_TABLES_SQL:
+            cursor.execute(ddl)
+        for table in (SHARD_TABLE, SHARD_MAP_TABLE, SHARD_MENTIONS_TABLE):
+            cursor.execute(f"DELETE FROM {table}")
+        cursor.executemany(
+            f"INSERT INTO {SHARD_MAP_TABLE} (workspace_id, owner_id, shard) VALUES (%s, %s, %s)",
+            [(workspace_id, owners[workspace_id], shard) for workspace_id, shard in assignment.items()],
+        )
+
+
+def drop_tables():
+    """Remove the shard files listed in the map, then the map itself"""
+    with connection.cursor() as cursor:
+        try:
+            cursor.execute(f"SELECT path FROM {SHARD_TABLE}")
+            paths = [row[0] for row in cursor.fetchall()]
+        except DatabaseError:
+            paths = []
+        for path in paths:
+            Path(path).unlink(missing_ok=True)
+        for table in (SHARD_TABLE, SHARD_MAP_TABLE, SHARD_MENTIONS_TABLE):
+            cursor.execute(f"DROP TABLE IF EXISTS {table}")
+    shards_available.cache_clear()
+
+
+def source_objects(cursor, tables):
+    """(type, name, tbl_name, sql) of the tables, indexes and triggers to recreate in a shard"""
+    placeholders = ', '.join('?' * len(tables))
+    cursor.execute(
+        f"SELECT type, name, tbl_name, sql FROM src.sqlite_master "
+        f"WHERE sql IS NOT NULL AND tbl_name IN ({placeholders})",
+        tables,
+    )
+    return cursor.fetchall()
+
+
+def build_shard(shard, path, source):
+    """Write one shard file from the source database; returns (cells, mentioned user ids).
+
+    The file is built next to path and moved into place when complete, so readers never
+    open a half-written shard.
+    """
+    building = Path(f"{path}.building")
+    if building.exists():
+        building.unlink()
+    shard_db = sqlite3.connect(f"file:{building}", uri=True, isolation_level=None)
+    try:
+        cursor = shard_db.cursor()
+        cursor.execute("PRAGMA journal_mode = off")
+        cursor.execute("PRAGMA synchronous = off")
+        cursor.execute("ATTACH DATABASE ? AS src", [f"file:{source}?mode=ro"])
+        cursor.execute("SELECT name FROM src.sqlite_master WHERE type = 'table'")
+        existing = {row[0] for row in cursor.fetchall()}
+        tables = [table for table in [*SCHEMA_TABLES, FACTS_TABLE] if table in existing]
+        objects = source_objects(cursor, tables + ([FTS_TABLE] if FTS_TABLE in existing else []))
+
+        cursor.execute("BEGIN")
+        for kind, name, _table, sql in objects:
+            if kind == 'table' and name != FTS_TABLE:
+                cursor.execute(sql)
+        cursor.execute(SHARD_SHEETS_SQL, {'shard': shard})
+        for table in tables:
+            cursor.execute(
+                f"INSERT INTO main.{table} SELECT * FROM src.{table} WHERE {COPY_CONDITIONS[table]}",
+                {'shard': shard},
+            )
+        # Indexes and triggers go in after the rows, so the load neither maintains nor fires them
+        for kind, name, _table, sql in objects:
+            if kind == 'table' and name == FTS_TABLE:
+                cursor.execute(sql)
+                cursor.execute(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')")
+        for kind, _name, _table, sql in objects:
+            if kind == 'index':
+                cursor.execute(sql)
+        for kind, _name, _table, sql in objects:
+            if kind == 'trigger':
+                cursor.execute(sql)
+        cursor.execute("COMMIT")
+        cursor.execute("DETACH DATABASE src")
+        cursor.execute("ANALYZE")
+
+        cursor.execute("SELECT count(*) FROM hotwash_rowcell_data")
+        cells = cursor.fetchone()[0]
+        mentioned = set()
+        cursor.execute("SELECT DISTINCT cell_data FROM hotwash_rowcell_data")
+        for (text,) in cursor:
+            mentioned |= mentioned_users(text)
+    finally:
+        shard_db.close()
+    os.replace(building, path)
+    return cells, mentioned
+
+
+def split(count, directory=None, source=None):
+    """Plan the shard map from the source database and write every shard file; returns per shard stats.
+
+    source is the database file the shards are copied from, by default the one the map is
+    written to.
+    """
+    source = source or settings.DATABASES['default']['NAME']
+    directory = Path(directory or getattr(settings, 'RAG_SHARDS', {}).get('DIR', 'shards'))
+    directory.mkdir(parents=True, exist_ok=True)
+    with connection.cursor() as cursor:
+        cursor.execute(WORKSPACE_LOAD_SQL)
+        workspaces = cursor.fetchall()
+    assignment = plan_shards(workspaces, count)
+    write_map(assignment, {workspace_id: owner_id for workspace_id, owner_id, _cells in workspaces})
+
+    report = []
+    for shard in range(count):
+        path = shard_path(shard, directory)
+        cells, mentioned = build_shard(shard, path, source)
+        members = sum(1 for assigned in assignment.values() if assigned == shard)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"INSERT INTO {SHARD_TABLE} (shard, path, workspaces, cells, built_at) VALUES (%s, %s, %s, %s, %s)",
+                [shard, str(path), members, cells, timezone.now()],
+            )
+            cursor.executemany(
+                f"INSERT INTO {SHARD_MENTIONS_TABLE} (user_id, shard) VALUES (%s, %s)",
+                [(user_id, shard) for user_id in sorted(mentioned)],
+            )
+        report.append({"shard": shard, "path": str(path), "workspaces": members, "cells": cells})
+    # Stale files from an earlier split into more shards
+    for stale in sorted(directory.glob('shard_*.sqlite3')):
+        if stale not in {shard_path(shard, directory) for shard in range(count)}:
+            stale.unlink()
+    shards_available.cache_clear()
+    return report
+
+
+def check_consistency():
+    """Compare cell and fact counts of the shards with the source database"""
+    counts = {}
+    with connection.cursor() as cursor:
+        cursor.execute(f"SELECT shard, path FROM {SHARD_TABLE} ORDER BY shard")
+        shards = cursor.fetchall()
+        for table in ('hotwash_rowcell_data', FACTS_TABLE):
+            try:
+                cursor.execute(f"SELECT count(*) FROM {table}")
+            except DatabaseError:
+                continue
+            counts[table] = {'source': cursor.fetchone()[0], 'shards': 0}
+    for _shard, path in shards:
+        shard_db = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+        try:
+            for table, count in counts.items():
+                count['shards'] += shard_db.execute(f"SELECT count(*) FROM {table}").fetchone()[0]
+        finally:
+            shard_db.close()
+    return {
+        "shards": len(shards),
+        "counts": counts,
+        "consistent": bool(shards) and all(count['source'] == count['shards'] for count in counts.values()),
+    }
+
+
+class ShardMap:
+    """Which shards a question can touch, from the map split_shards wrote"""
+
+    def __init__(self, paths, owners, mentions, version=None):
+        self.paths = paths  # {shard: path}
+        self.owners = owners  # {owner_id: shard}
+        self.mentions = mentions  # {user_id: {shard, ...}}
+        self.version = version  # map_version() when loaded
+
+    @classmethod
+    def load(cls):
+        with read_connection().cursor() as cursor:
+            cursor.execute(MAP_VERSION_SQL)
+            version = tuple(cursor.fetchone())
+            cursor.execute(f"SELECT shard, path FROM {SHARD_TABLE}")
+            paths = dict(cursor.fetchall())
+            cursor.execute(f"SELECT DISTINCT owner_id, shard FROM {SHARD_MAP_TABLE} WHERE owner_id IS NOT NULL")
+            owners = dict(cursor.fetchall())
+            cursor.execute(f"SELECT user_id, shard FROM {SHARD_MENTIONS_TABLE}")
+            mentions = {}
+            for user_id, shard in cursor.fetchall():
+                mentions.setdefault(user_id, set()).add(shard)
+        return cls(paths, owners, mentions, version)
+
+    def targets(self, intent, user_value):
+        """Shards holding every row an intent can match, in shard order.
+
+        A user_id question matched through FTS needs the owner's shard plus the shards
+        whose cells mention the user; substring (LIKE) mentions and username questions
+        can match anywhere, as can questions without a user.
+        """
+        user_id = user_id_param(user_value) if intent.user_filter == 'user_id' else None
+        # Ids past SQLite's range are in no map; their text mentions can be anywhere
+        if user_id is not None and intent.match_mode != 'like':
+            shards = set(self.mentions.get(user_id, ()))
+            if user_id in self.owners:
+                shards.add(self.owners[user_id])
+            return sorted(shards)
+        return sorted(self.paths)
+
+
+class ShardExecutor:
+    """Runs one statement on several shards in parallel, each on its own read-only connection.
+
+    Connections are per thread and per shard, and are reopened once the shard's path or
+    file changes, so a re-split is read as soon as its files are in place. A statement
+    for a single shard runs on the calling thread; a budget (admission.TimeBudget)
+    interrupts every shard's statement.
+    """
+
+    def __init__(self, paths, max_workers=4):
+        self.paths = paths
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='rag-shard')
+        self._local = threading.local()
+
+    def connection(self, shard):
+        connections = self._local.__dict__.setdefault('connections', {})
+        path = self.paths[shard]
+        opened = (path, file_signature(path))
+        entry = connections.get(shard)
+        if entry is not None:
+            if entry[0] == opened:
+                return entry[1]
+            # build_shard moved a new file into place; the old one is unlinked
+            entry[1].close()
+        # Same type detection as Django's backend, so rows convert as they do from the reader
+        shard_db = sqlite3.connect(
+            f"file:{path}?mode=ro", uri=True,
+            detect_types=sqlite3.PARSE_DECLTYPES | sqlite3.PARSE_COLNAMES,
+        )
+        pragmas = getattr(settings, 'RAG_SQLITE_PRAGMAS', {}).get(read_alias(), {})
+        for name, value in pragmas.items():
+            shard_db.execute(f'PRAGMA {name} = {value}')
+        connections[shard] = (opened, shard_db)
+        return shard_db
+
+    def fetch(self, shard, sql, params, budget=None):
+        """Rows of one statement on one shard as JSON serializable dicts"""
+        shard_db = self.connection(shard)
+        if budget is not None:
+            shard_db.set_progress_handler(budget.check, PROGRESS_INTERVAL)
+        try:
+            # The templates hold no % other than Django's placeholders
+            cursor = shard_db.execute(sql.replace('%s', '?'), params)
+            rows = cursor.fetchall()
+        finally:
+            if budget is not None:
+                shard_db.set_progress_handler(None, 0)
+        if not rows:
+            return []
+        return plan_rows(cursor.description, rows[0]).convert(rows)
+
+    def scatter(self, sql, params, shards, budget=None):
+        """Run sql on every shard in shards; returns each shard's rows in the same order"""
+        if len(shards) <= 1:
+            return [self.fetch(shard, sql, params, budget) for shard in shards]
+        futures = [self._pool.submit(self.fetch, shard, sql, params, budget) for shard in shards]
+        return [future.result() for future in futures]
+
+
+def _sort_key(row):
+    return (
+        row['sort_date'] is not None, row['sort_date'],
+        row['sort_created_at'] is not None, row['sort_created_at'], row['id'], row['status_id'],
+    )
+
+
+def merge_rows(pages, limit, ranked=False):
+    """The first limit rows, in the template's order, of pages each already in that order"""
+    if ranked:
+        # bm25 ranks come from each shard's own statistics, so ranked order is approximate
+        rows = sorted(chain(*pages), key=_sort_key, reverse=True)
+        rows.sort(key=lambda row: (row['sort_rank'] is None, row['sort_rank'] or 0))
+    else:
+        rows = heapq.merge(*pages, key=_sort_key, reverse=True)
+    data = list(islice(rows, limit))
+    for row in data:
+        for column in SORT_COLUMNS:
+            row.pop(column, None)
+    return data
+
+
+def _earliest(a, b):
+    return b if a is None or (b is not None and b < a) else a
+
+
+def _latest(a, b):
+    return b if a is None or (b is not None and b > a) else a
+
+
+def merge_summary(parts, group_limit):
+    """Combine each shard's SUMMARY_SELECT rows into one set.
+
+    Owners and workspaces each live on one shard, so totals, distinct counts and the per
+    user and per workspace groups add up exactly; a status outside some shard's top
+    group_limit is undercounted.
+    """
+    total = {
+        "dimension": "total", "label": None, "tasks": 0, "first_date": None, "last_date": None,
+        "users": 0, "workspaces": 0, "group_key": None,
+    }
+    groups = {}
+    for row in chain(*parts):
+        target = total
+        if row['dimension'] != 'total':
+            target = groups.setdefault(
+                (row['dimension'], row['group_key']), dict(row, tasks=0, first_date=None, last_date=None),
+            )
+        else:
+            total['users'] += row['users'] or 0
+            total['workspaces'] += row['workspaces'] or 0
+        target['tasks'] += row['tasks'] or 0
+        target['first_date'] = _earliest(target['first_date'], row['first_date'])
+        target['last_date'] = _latest(target['last_date'], row['last_date'])
+    merged = [total]
+    for dimension in dict.fromkeys(dimension for dimension, _key in groups):
+        ordered = sorted(
+            (group for (name, _key), group in groups.items() if name == dimension),
+            key=lambda group: (-group['tasks'], group['label'] is not None, group['label'] or ''),
+        )
+        merged += ordered[:group_limit]
+    return merged
+
+
+def merge_counts(parts):
+    """Combine each shard's COUNT_QUERY row"""
+    count = {"tasks": 0, "first_date": None, "last_date": None}
+    for row in chain(*parts):
+        count['tasks'] += row['tasks'] or 0
+        count['first_date'] = _earliest(count['first_date'], row['first_date'])
+        count['last_date'] = _latest(count['last_date'], row['last_date'])
+    return [count]
+
+
+_shard_map = None
+_executor = None
+_lock = threading.Lock()
+
+
+def map_version():
+    """Changes whenever split_shards writes a shard, so workers know to reload the map"""
+    with read_connection().cursor() as cursor:
+        cursor.execute(MAP_VERSION_SQL)
+        return tuple(cursor.fetchone())
+
+
+def file_signature(path):
+    """(inode, mtime) of a shard file, which changes when build_shard replaces it"""
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return stat.st_ino, stat.st_mtime_ns
+
+
+def get_shard_map():
+    """The map split_shards wrote, reloaded whenever its version changes"""
+    global _shard_map
+    version = map_version()
+    if _shard_map is None or _shard_map.version != version:
+        with _lock:
+            if _shard_map is None or _shard_map.version != version:
+                _shard_map = ShardMap.load()
+                if _executor is not None:
+                    _executor.paths = _shard_map.paths
+    return _shard_map
+
+
+def get_shard_executor():
+    """The process-wide scatter-gather executor over the shards in the map"""
+    global _executor
+    shard_map = get_shard_map()
+    if _executor is None:
+        with _lock:
+            if _executor is None:
+                _executor = ShardExecutor(
+                    shard_map.paths, max_workers=getattr(settings, 'RAG_SHARDS', {}).get('MAX_WORKERS', 4),
+                )
+    return _executor
+
+
+def data_version():
+    """Version of the data sharded answers come from: the map and every shard file in it"""
+    shard_map = get_shard_map()
+    return shard_map.version, tuple(file_signature(path) for _shard, path in sorted(shard_map.paths.items()))
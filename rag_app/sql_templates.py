@@ -0,0 +1,346 @@
+from datetime import timedelta
+from typing import NamedTuple, Optional
+
+from django.conf import settings
+from django.utils import timezone
+
+from .cache import LRUCache
+from .facts import FACTS_TABLE, LIVE_JOIN
+from .fts import FTS_TABLE, phrase
+
+
+class QueryIntent(NamedTuple):
+    """Shape of a request: which user filter applies, which date window and how text is matched"""
+    user_filter: Optional[str]  # None, 'user_id' or 'username'
+    date_window: str  # one of DATE_CONDITIONS
+    match_mode: str = 'like'  # 'like', 'fts' or 'fts_ranked'
+    paginated: bool = False  # continues after a keyset cursor
+    source: str = 'join'  # 'join' (live tables) or 'facts' (task_facts)
+
+
+class PreparedQuery(NamedTuple):
+    intent: QueryIntent
+    sql: str
+    params: list
+    cache_hit: bool
+
+
+# Django's sqlite backend rewrites %s placeholders to ?, so templates must not
+# contain any other literal % characters.
+BASE_QUERY = """
+        SELECT
+            gcd.id,
+            gcd.cell_data as task,
+            gcd.cell_date as date,
+            gcd.column_type,
+            gcd.column_index,
+            gh.name as column_name,
+            gh.column_type as header_type,
+            hs.name as sheet_name,
+            hw.workspace_name,
+            au.name as user_name,
+            au.username,
+            sd.status_text as status,
+            sd.status_color,
+            COALESCE(sd.id, 0) as status_id""" + LIVE_JOIN
+
+# The same row shape read from the denormalized task_facts table
+FACTS_QUERY = f"""
+        SELECT
+            tf.cell_id as id,
+            tf.cell_data as task,
+            tf.cell_date as date,
+            tf.column_type,
+            tf.column_index,
+            tf.column_name,
+            tf.header_type,
+            tf.sheet_name,
+            tf.workspace_name,
+            tf.user_name,
+            tf.username,
+            tf.status,
+            tf.status_color,
+            tf.status_id
+        FROM {FACTS_TABLE} tf
+        """
+
+# Column references the conditions below are written against, per source
+SOURCES = {
+    'join': {
+        'query': BASE_QUERY, 'from': LIVE_JOIN,
+        'id': 'gcd.id', 'cell_data': 'gcd.cell_data', 'cell_date': 'gcd.cell_date',
+        'created_at': 'gcd.created_at', 'user_id': 'au.id', 'username': 'au.username',
+        'workspace_id': 'hw.id', 'status': 'sd.status_text', 'status_id': 'COALESCE(sd.id, 0)',
+    },
+    'facts': {
+        'query': FACTS_QUERY, 'from': f"\n        FROM {FACTS_TABLE} tf\n",
+        'id': 'tf.cell_id', 'cell_data': 'tf.cell_data', 'cell_date': 'tf.cell_date',
+        'created_at': 'tf.created_at', 'user_id': 'tf.user_id', 'username': 'tf.username',
+        'workspace_id': 'tf.workspace_id', 'status': 'tf.status', 'status_id': 'tf.status_id',
+    },
+}
+
+# Rows picked by the retrieval index; json_each keeps the SQL text fixed for any number of ids
+RETRIEVAL_CONDITION = "        WHERE {id} IN (SELECT value FROM json_each(%s))"
+RETRIEVAL_QUERY = BASE_QUERY + RETRIEVAL_CONDITION.format_map(SOURCES['join'])
+
+USER_CONDITIONS = {
+    'user_id': "({user_id} = %s OR {cell_data} LIKE %s)",
+    'username': "({username} LIKE %s OR {cell_data} LIKE %s)",
+}
+
+# With the FTS index, cell_data mentions are looked up by MATCH and joined back by
+# rowid instead of a leading-wildcard LIKE that scans every cell.
+FTS_MATCH = f"SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s"
+
+FTS_USER_CONDITIONS = {
+    'user_id': f"({{user_id}} = %s OR {{id}} IN ({FTS_MATCH}))",
+    'username': f"({{username}} LIKE %s OR {{id}} IN ({FTS_MATCH}))",
+}
+
+# Ranked matching joins the bm25 rank so the best matches sort first
+RANKED_JOIN = (
+    f"        LEFT JOIN (SELECT rowid AS fts_rowid, rank AS fts_rank FROM {FTS_TABLE} "
+    f"WHERE {FTS_TABLE} MATCH %s) fts ON fts.fts_rowid = {{id}}\n"
+)
+
+RANKED_USER_CONDITIONS = {
+    'user_id': "({user_id} = %s OR fts.fts_rowid IS NOT NULL)",
+    'username': "({username} LIKE %s OR fts.fts_rowid IS NOT NULL)",
+}
+
+# Date windows are half-open ranges on the raw column rather than DATE(gcd.cell_date),
+# so an index on cell_date can serve both the filter and the ORDER BY. ISO date and
+# datetime strings sort the same way as the dates they encode.
+CLOSED_RANGE = "{cell_date} >= %s AND {cell_date} < %s"
+OPEN_RANGE = "{cell_date} >= %s"
+
+DATE_CONDITIONS = {
+    'today': CLOSED_RANGE,
+    'yesterday': CLOSED_RANGE,
+    'past_7_days': OPEN_RANGE,
+    'this_week': OPEN_RANGE,
+}
+
+# Rows after a cursor in ORDER_AND_LIMIT order. A cell joins one row per status option of
+# its column, so the cell id and the status row id together make the ordering total
+KEYSET_CONDITION = "({cell_date}, {created_at}, {id}, {status_id}) < (%s, %s, %s, %s)"
+
+ORDER_AND_LIMIT = " ORDER BY {cell_date} DESC, {created_at} DESC, {id} DESC, {status_id} DESC LIMIT %s"
+RANKED_ORDER_AND_LIMIT = (
+    " ORDER BY fts.fts_rank IS NULL, fts.fts_rank, {cell_date} DESC, {created_at} DESC LIMIT %s"
+)
+
+# Summaries aggregate the whole window in SQL: the matching rows are rolled up once per
+# (user, workspace, status), then totalled and broken down per dimension from that much
+# smaller set. Each breakdown is cut to its largest groups and labelled by primary key
+# lookups, so the transfer is O(groups), not O(rows).
+SUMMARY_GROUPS = """
+            SELECT {user_id} AS user_id, {workspace_id} AS workspace_id, {status} AS status,
+                COUNT(*) AS tasks, MIN({cell_date}) AS first_date, MAX({cell_date}) AS last_date
+            {from_clause}
+            WHERE {conditions}
+            GROUP BY 1, 2, 3"""
+
+# Totals and breakdowns over window_groups; binds one group limit per dimension. group_key
+# is the id a group was formed on, since names need not be unique
+SUMMARY_SELECT = """
+        SELECT 'total' AS dimension, NULL AS label, COALESCE(SUM(tasks), 0) AS tasks,
+            MIN(first_date) AS first_date, MAX(last_date) AS last_date,
+            COUNT(DISTINCT user_id) AS users, COUNT(DISTINCT workspace_id) AS workspaces,
+            NULL AS group_key
+        FROM window_groups
+        UNION ALL
+        SELECT * FROM (
+            SELECT 'user', (SELECT COALESCE(name, username) FROM authentication_user WHERE id = user_id),
+                SUM(tasks), MIN(first_date), MAX(last_date), NULL, NULL, user_id
+            FROM window_groups GROUP BY user_id ORDER BY 3 DESC, 2 LIMIT %s
+        )
+        UNION ALL
+        SELECT * FROM (
+            SELECT 'workspace', (SELECT workspace_name FROM hotwash_workspace WHERE id = workspace_id),
+                SUM(tasks), MIN(first_date), MAX(last_date), NULL, NULL, workspace_id
+            FROM window_groups GROUP BY workspace_id ORDER BY 3 DESC, 2 LIMIT %s
+        )
+        UNION ALL
+        SELECT * FROM (
+            SELECT 'status', status, SUM(tasks), MIN(first_date), MAX(last_date), NULL, NULL, status
+            FROM window_groups GROUP BY status ORDER BY 3 DESC, 2 LIMIT %s
+        )
+        """
+
+SUMMARY_QUERY = "\n        WITH window_groups AS MATERIALIZED ({groups}\n        )" + SUMMARY_SELECT
+
+# Count-only answer for questions too expensive to list: the size and span of the window
+COUNT_QUERY = """
+        SELECT COUNT(*) AS tasks, MIN({cell_date}) AS first_date, MAX({cell_date}) AS last_date
+        {from_clause}
+        WHERE {conditions}"""
+
+# Shard copies of a template also return the ORDER BY key as text, so scatter-gather
+# can merge the pages of several shards in exactly the order one database would give
+SHARD_SORT_COLUMNS = (
+    ",\n            CAST({cell_date} AS TEXT) AS sort_date, CAST({created_at} AS TEXT) AS sort_created_at"
+)
+SHARD_RANK_COLUMN = ", fts.fts_rank AS sort_rank"
+
+# SQLite integers are signed 64-bit; larger Python ints can't be bound
+MAX_SQLITE_INTEGER = 2 ** 63 - 1
+
+template_cache = LRUCache(getattr(settings, 'RAG_SQL_TEMPLATE_CACHE_SIZE', 64))
+
+
+def build_conditions(intent):
+    """The WHERE conditions for an intent, in bind parameter order"""
+    conditions = []
+    if intent.user_filter:
+        user_conditions = {
+            'like': USER_CONDITIONS,
+            'fts': FTS_USER_CONDITIONS,
+            'fts_ranked': RANKED_USER_CONDITIONS,
+        }[intent.match_mode]
+        conditions.append(user_conditions[intent.user_filter])
+    conditions.append(DATE_CONDITIONS[intent.date_window])
+    if intent.paginated:
+        conditions.append(KEYSET_CONDITION)
+    return conditions
+
+
+def build_sql_template(intent):
+    """Render the parameterized SQL text for an intent"""
+    ranked = intent.user_filter is not None and intent.match_mode == 'fts_ranked'
+    conditions = build_conditions(intent)
+
+    source = SOURCES[intent.source]
+    sql = RANKED_JOIN if ranked else ""
+    sql += "        WHERE " + " AND ".join(conditions)
+    sql += RANKED_ORDER_AND_LIMIT if ranked else ORDER_AND_LIMIT
+    return source['query'] + sql.format_map(source)
+
+
+def get_sql_template(intent):
+    """Return (sql, hit) for an intent, building the template on first use"""
+    return template_cache.get_or_create(intent, lambda: build_sql_template(intent))
+
+
+def build_shard_template(intent):
+    """The template for an intent with its sort key appended to the selected columns"""
+    source = SOURCES[intent.source]
+    ranked = intent.user_filter is not None and intent.match_mode == 'fts_ranked'
+    sql = build_sql_template(intent)
+    columns = SHARD_SORT_COLUMNS + (SHARD_RANK_COLUMN if ranked else "")
+    select_end = sql.index(source['from'].strip())
+    return sql[:select_end].rstrip() + columns.format_map(source) + "\n        " + sql[select_end:]
+
+
+def get_shard_template(intent):
+    """Return (sql, hit) for the shard copy of an intent's template"""
+    return template_cache.get_or_create(('shard', intent), lambda: build_shard_template(intent))
+
+
+def summary_intent(intent):
+    """The intent a summary aggregates: the whole window, with ranking dropped"""
+    match_mode = 'fts' if intent.match_mode == 'fts_ranked' else intent.match_mode
+    return intent._replace(match_mode=match_mode, paginated=False)
+
+
+def build_summary_groups(intent, conditions=None):
+    """The window_groups roll-up for an intent, over its own conditions unless others are given"""
+    source = SOURCES[intent.source]
+    conditions = " AND ".join(build_conditions(intent) if conditions is None else conditions)
+    return SUMMARY_GROUPS.format(
+        conditions=conditions.format_map(source), from_clause=source['from'].strip(), **source,
+    )
+
+
+def build_summary_template(intent):
+    """Render the aggregate SQL for an intent; binds its conditions, then one group limit per dimension"""
+    return SUMMARY_QUERY.format(groups=build_summary_groups(intent))
+
+
+def get_summary_template(intent):
+    """Return (sql, hit) for the summary of an intent"""
+    intent = summary_intent(intent)
+    return template_cache.get_or_create(('summary', intent), lambda: build_summary_template(intent))
+
+
+def build_count_template(intent):
+    """Render the count-only SQL for an intent; binds its conditions"""
+    source = SOURCES[intent.source]
+    conditions = " AND ".join(build_conditions(intent)).format_map(source)
+    return COUNT_QUERY.format(conditions=conditions, from_clause=source['from'].strip(), **source)
+
+
+def get_count_template(intent):
+    """Return (sql, hit) counting the whole window of an intent"""
+    intent = summary_intent(intent)
+    return template_cache.get_or_create(('count', intent), lambda: build_count_template(intent))
+
+
+def user_id_param(value):
+    """A parsed user id as an int to bind, or None outside SQLite's 64-bit integer range.
+
+    No owner has such an id and None compares equal to nothing, so the owner condition
+    simply doesn't match instead of failing to bind.
+    """
+    user_id = int(value)
+    return user_id if user_id <= MAX_SQLITE_INTEGER else None
+
+
+def user_params(user_filter, value, match_mode='like'):
+    """Bind parameters matching the user condition (and ranked join) for user_filter"""
+    if user_filter == 'user_id':
+        owner, pattern, match = user_id_param(value), f"%user {value}%", phrase(f"user {value}")
+    elif user_filter == 'username':
+        owner, pattern, match = f"%{value}%", f"%{value}%", phrase(value) + '*'
+    else:
+        return []
+    if match_mode == 'fts':
+        return [owner, match]
+    if match_mode == 'fts_ranked':
+        # The MATCH in the FROM clause binds before the WHERE conditions
+        return [match, owner]
+    return [owner, pattern]
+
+
+def resolve_date_window(date_window, today=None):
+    """Return the concrete (start, end) dates a window covers; end is None when open-ended"""
+    today = today or timezone.now().date()
+    if date_window == 'today':
+        return today, today
+    if date_window == 'yesterday':
+        yesterday = today - timedelta(days=1)
+        return yesterday, yesterday
+    if date_window == 'this_week':
+        # Mirrors DATE('now', 'weekday 0', '-7 days'): the coming Sunday minus a week
+        next_sunday = today + timedelta(days=(6 - today.weekday()) % 7)
+        return next_sunday - timedelta(days=7), None
+    return today - timedelta(days=7), None
+
+
+def date_params(date_window, today=None):
+    """Bind parameters matching DATE_CONDITIONS[date_window]"""
+    start, end = resolve_date_window(date_window, today)
+    if end is None:
+        return [start.isoformat()]
+    return [start.isoformat(), (end + timedelta(days=1)).isoformat()]
+
+
+def retrieval_template(source='join'):
+    """SQL fetching the rows a retrieval search picked, by id"""
+    return SOURCES[source]['query'] + RETRIEVAL_CONDITION.format_map(SOURCES[source])
+
+
+def build_union_template(sql, count):
+    """Run count bindings of one template as a single statement.
+
+    Each copy keeps its own ORDER BY/LIMIT inside a subquery and is tagged with
+    batch_slot, its position in the batch, so rows can be split back out.
+    """
+    parts = [f"SELECT {slot} AS batch_slot, * FROM ({sql})" for slot in range(count)]
+    return "\nUNION ALL\n".join(parts)
+
+
+def get_union_template(sql, count):
+    """Return (sql, hit) for count merged copies of a template"""
+    return template_cache.get_or_create(('union', sql, count), lambda: build_union_template(sql, count))
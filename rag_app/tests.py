@@ -1,3 +1,1390 @@
-from django.test import TestCase
+import asyncio
+import datetime
+import decimal
+import json
+import re
+import sqlite3
+import tempfile
+import threading
+from io import StringIO
+from pathlib import Path
 
-# Create your tests here.
+from django.core import signing
+from django.core.management import CommandError, call_command
+from django.db import OperationalError, connection
+from django.http import StreamingHttpResponse
+from django.test import AsyncRequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+
+from . import admission, executor, facts, fts, history, result_cache, retrieval, rollups, shards, warmup
+from .admission import AdmissionController, TimeBudget, window_days
+from .async_views import AsyncOfflineRAGView
+from .coalesce import SingleFlight
+from .db import ReadWriteRouter, configure_connection, read_alias, read_connection
+from .executor import DatabaseExecutor, ExecutorSaturated
+from .history import HistoryWriter, record_query, write_history
+from .intent import parse_query, tokenize
+from .metrics import NULL_TIMER, MetricsRegistry
+from .models import QueryHistory, QueryPayload
+from .renderers import FastJSONRenderer
+from .rows import RowPlan, plan_rows
+from .schema import SCHEMA_TABLES, schema_registry
+from .pagination import (
+    CURSOR_SALT, HISTORY_CURSOR_SALT, cursor_after, decode_cursor, encode_cursor, summary_sample_size,
+)
+from .sql_templates import date_params, get_summary_template, summary_intent, template_cache, user_params
+from .views import OfflineRAGView
+
+# "status" makes a question a detail (row listing) question over the default 7-day window
+DETAIL_QUERY = "status of tasks in the past 7 days"
+SUMMARY_QUERY = "tasks in the past 7 days"
+
+
+def clear_process_state():
+    """Forget the once-per-process checks and shared helpers the tests change underneath"""
+    for check in (facts.facts_available, fts.fts_available, rollups.rollups_available, shards.shards_available):
+        check.cache_clear()
+    admission._controller = None
+    result_cache._result_cache = None
+    result_cache._watermark = (None, 0.0)
+    retrieval._index_mtime = None
+    shards._shard_map = shards._executor = None
+
+
+# Reads go to 'default' so they see rows created inside the test transaction; the
+# reader mirror is a second connection, locked out until the transaction ends
+@override_settings(
+    RAG_READ_DATABASE='default',
+    RAG_RESULT_CACHE={'BACKEND': None},
+    RAG_COALESCE={'ENABLED': False},
+    RAG_HISTORY_WRITER={'ENABLED': False},
+    RAG_SHARDS={'ENABLED': False},
+)
+class HotwashTestCase(TestCase):
+    """Generated hotwash data, with a second status option on every column.
+
+    A cell joins one row per status option of its column, so every cell appears twice
+    in the listings and the pages must order by status as well as by cell.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        call_command('generate_hotwash_data', cells=600, users=20, days=10, seed=7, stdout=StringIO())
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "INSERT INTO hotwash_status_dropdown (sheet_id, column_id, status_text, status_color, status_type) "
+                "SELECT sheet_id, column_id, 'Blocked', 'red', status_type FROM hotwash_status_dropdown"
+            )
+            cursor.execute("ANALYZE")
+
+    def setUp(self):
+        clear_process_state()
+        self.addCleanup(clear_process_state)
+        self.view = OfflineRAGView()
+        self.view.timer = NULL_TIMER
+
+    def build_retrieval_index(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        overridden = self.settings(RAG_RETRIEVAL_INDEX_DIR=directory.name)
+        overridden.enable()
+        self.addCleanup(overridden.disable)
+        retrieval.update_index()
+
+    def stream(self, query, **options):
+        response = self.client.post(
+            '/api/query/', dict(options, query=query, stream=True), content_type='application/json',
+        )
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        return [json.loads(line) for line in b''.join(response.streaming_content).splitlines()]
+
+    def build_facts(self):
+        facts.create_table()
+        facts.rebuild()
+        facts.facts_available.cache_clear()
+
+    def all_rows(self, query):
+        prepared = self.view.generate_sql_query(query, page_size=100000)
+        return self.view.execute_query(prepared.sql, prepared.params)
+
+
+class ReadWriteRouterTests(TestCase):
+
+    def test_app_reads_go_to_the_reader_and_writes_to_default(self):
+        router = ReadWriteRouter()
+        self.assertEqual(router.db_for_read(QueryHistory), 'reader')
+        self.assertEqual(router.db_for_write(QueryHistory), 'default')
+        self.assertTrue(router.allow_migrate('default', 'rag_app'))
+        self.assertFalse(router.allow_migrate('reader', 'rag_app'))
+
+    def test_unknown_read_alias_falls_back_to_default(self):
+        with self.settings(RAG_READ_DATABASE='replica'):
+            self.assertEqual(read_alias(), 'default')
+            self.assertEqual(ReadWriteRouter().db_for_read(QueryHistory), 'default')
+
+    def test_pragmas_are_applied_per_alias(self):
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA cache_size')
+            original = cursor.fetchone()[0]
+        self.addCleanup(lambda: connection.cursor().execute(f'PRAGMA cache_size = {original}'))
+        with self.settings(RAG_SQLITE_PRAGMAS={'default': {'cache_size': -1234}, 'reader': {'cache_size': -99}}):
+            configure_connection(sender=None, connection=connection)
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA cache_size')
+            self.assertEqual(cursor.fetchone()[0], -1234)
+
+    def test_unexpected_journal_mode_is_logged(self):
+        # The in-memory test database cannot switch to WAL
+        with self.settings(RAG_SQLITE_PRAGMAS={'default': {'journal_mode': 'wal'}}):
+            with self.assertLogs('rag_app.db', 'WARNING') as logs:
+                configure_connection(sender=None, connection=connection)
+        self.assertIn("not wal", logs.output[0])
+
+
+class GenerateHotwashDataTests(HotwashTestCase):
+
+    def count(self, table):
+        with connection.cursor() as cursor:
+            cursor.execute(f"SELECT COUNT(*) FROM {table}")
+            return cursor.fetchone()[0]
+
+    def test_generated_rows(self):
+        self.assertEqual(self.count('hotwash_rowcell_data'), 600)
+        self.assertEqual(self.count('authentication_user'), 20)
+        today = datetime.date.today()
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT CAST(MIN(cell_date) AS TEXT), CAST(MAX(cell_date) AS TEXT), "
+                "SUM(sheet_id NOT IN (SELECT id FROM hotwash_sheet)) FROM hotwash_rowcell_data"
+            )
+            first, last, orphans = cursor.fetchone()
+        self.assertGreaterEqual(first, (today - datetime.timedelta(days=9)).isoformat())
+        self.assertLessEqual(last, today.isoformat())
+        self.assertEqual(orphans, 0)
+
+    def test_existing_rows_need_replace(self):
+        with self.assertRaisesMessage(CommandError, "pass --replace"):
+            call_command('generate_hotwash_data', cells=10, stdout=StringIO())
+        call_command('generate_hotwash_data', cells=50, users=20, replace=True, stdout=StringIO())
+        self.assertEqual(self.count('hotwash_rowcell_data'), 50)
+
+    def test_same_seed_same_data(self):
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT cell_data FROM hotwash_rowcell_data ORDER BY id LIMIT 50")
+            before = cursor.fetchall()
+        call_command('generate_hotwash_data', cells=600, users=20, days=10, seed=7, replace=True, stdout=StringIO())
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT cell_data FROM hotwash_rowcell_data ORDER BY id LIMIT 50")
+            self.assertEqual(cursor.fetchall(), before)
+
+
+@override_settings(RAG_RESULT_CACHE={'BACKEND': 'rag_app.result_cache.LocMemResultCache', 'WATERMARK_TTL': 0})
+class ResultCacheTests(HotwashTestCase):
+
+    def setUp(self):
+        super().setUp()
+        result_cache.install_triggers()
+
+    def ask(self):
+        response = self.client.post('/api/query/', {'query': DETAIL_QUERY}, content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        body = response.json()
+        return body['data_fetched'], body['result_cache']['hit']
+
+    def assertInvalidatedBy(self, sql, params=()):
+        data, hit = self.ask()
+        self.assertEqual(self.ask(), (data, True))
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+        fresh, hit = self.ask()
+        self.assertFalse(hit)
+        return data, fresh
+
+    def test_deleted_cell_is_not_served(self):
+        first = self.ask()[0][0]['id']
+        _data, fresh = self.assertInvalidatedBy("DELETE FROM hotwash_rowcell_data WHERE id = %s", [first])
+        self.assertNotIn(first, [row['id'] for row in fresh])
+
+    def test_dimension_edits_invalidate(self):
+        for table, column in (
+            ('hotwash_status_dropdown', 'status_text'), ('hotwash_sheet', 'name'),
+            ('hotwash_groups_header', 'name'), ('hotwash_workspace', 'workspace_name'),
+            ('authentication_user', 'name'),
+        ):
+            with self.subTest(table=table):
+                self.assertInvalidatedBy(f"UPDATE {table} SET {column} = {column} || ' (renamed)' WHERE id = 1")
+
+    def test_renamed_status_is_served_fresh(self):
+        data, _hit = self.ask()
+        status_id = data[0]['status_id']
+        _data, fresh = self.assertInvalidatedBy(
+            "UPDATE hotwash_status_dropdown SET status_text = 'Renamed' WHERE id = %s", [status_id]
+        )
+        self.assertEqual({row['status'] for row in fresh if row['status_id'] == status_id}, {'Renamed'})
+
+    def test_nothing_is_cached_without_the_counter(self):
+        result_cache.drop_table()
+        self.assertFalse(self.ask()[1])
+        self.assertFalse(self.ask()[1])
+
+    def test_backends_must_implement_storage(self):
+        with self.assertRaises(TypeError):
+            result_cache.BaseResultCache()
+
+
+class SchemaTests(HotwashTestCase):
+
+    def setUp(self):
+        super().setUp()
+        schema_registry.invalidate()
+        self.addCleanup(schema_registry.invalidate)
+
+    def test_schema_is_introspected_once_and_shared(self):
+        snapshot = schema_registry.get()
+        self.assertIs(schema_registry.get(), snapshot)
+        self.assertIs(self.view.schema_info, snapshot.schema)
+        cells = snapshot.schema['hotwash_rowcell_data']
+        self.assertTrue(cells['exists'])
+        self.assertEqual(cells['missing_columns'], [])
+        self.assertEqual(cells['columns'], SCHEMA_TABLES['hotwash_rowcell_data']['columns'])
+
+    def test_unchanged_schema_answers_304(self):
+        response = self.client.get('/api/schema/')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('Last-Modified', response)
+        again = self.client.get('/api/schema/', HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(again.status_code, 304)
+        self.assertEqual(again.content, b'')
+
+    @override_settings(RAG_SCHEMA_CHECK_INTERVAL=0)
+    def test_schema_change_is_served_fresh(self):
+        etag = self.client.get('/api/schema/')['ETag']
+        with connection.cursor() as cursor:
+            cursor.execute("CREATE INDEX hotwash_sheet_name ON hotwash_sheet (name)")
+        response = self.client.get('/api/schema/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        indexes = [index['name'] for index in response.json()['schema']['hotwash_sheet']['indexes']]
+        self.assertIn('hotwash_sheet_name', indexes)
+
+
+class KeysetPaginationTests(HotwashTestCase):
+
+    def paged_rows(self, query, page_size):
+        rows, cursor = [], None
+        while True:
+            prepared = self.view.generate_sql_query(query, cursor=cursor, page_size=page_size)
+            page = self.view.execute_query(prepared.sql, prepared.params)
+            rows += page
+            if len(page) < page_size:
+                return rows
+            cursor = decode_cursor(cursor_after(page[-1]))
+
+    def assertPagesComplete(self, source):
+        expected = [(row['id'], row['status_id']) for row in self.all_rows(DETAIL_QUERY)]
+        self.assertEqual(self.view.generate_sql_query(DETAIL_QUERY).intent.source, source)
+        self.assertGreater(len(expected), len({cell for cell, _status in expected}))
+        # Page sizes that split a cell's status rows across pages, and one that doesn't
+        for page_size in (7, 10, 50):
+            with self.subTest(page_size=page_size):
+                rows = self.paged_rows(DETAIL_QUERY, page_size)
+                self.assertEqual([(row['id'], row['status_id']) for row in rows], expected)
+
+    def test_join_pages_cover_every_row_once(self):
+        self.assertPagesComplete('join')
+
+    def test_facts_pages_cover_every_row_once(self):
+        self.build_facts()
+        self.assertPagesComplete('facts')
+
+    def test_next_cursor_walks_the_whole_window(self):
+        expected = len(self.all_rows(DETAIL_QUERY))
+        seen, cursor = [], None
+        while True:
+            response = self.client.post(
+                '/api/query/', {'query': DETAIL_QUERY, 'page_size': 25, 'cursor': cursor},
+                content_type='application/json',
+            )
+            self.assertEqual(response.status_code, 200)
+            body = response.json()
+            seen += [(row['id'], row['status_id']) for row in body['data_fetched']]
+            cursor = body['next_cursor']
+            if cursor is None:
+                break
+        self.assertEqual(len(seen), expected)
+        self.assertEqual(len(set(seen)), expected)
+
+    def test_cursor_must_be_a_string(self):
+        for cursor in (5, ["a"], {"cursor": 5}):
+            with self.subTest(cursor=cursor):
+                response = self.client.post(
+                    '/api/query/', {'query': DETAIL_QUERY, 'cursor': cursor}, content_type='application/json',
+                )
+                self.assertEqual(response.status_code, 400)
+                self.assertEqual(response.json(), {"error": "Invalid cursor"})
+        response = self.client.get('/api/history/', {'cursor': '5'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_tampered_cursor_is_rejected(self):
+        token = cursor_after(self.all_rows(DETAIL_QUERY)[0])
+        response = self.client.post(
+            '/api/query/', {'query': DETAIL_QUERY, 'cursor': token[:-2] + 'xx'}, content_type='application/json',
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json(), {"error": "Invalid cursor"})
+
+
+class CursorSigningTests(SimpleTestCase):
+    KEY = ['2024-05-01', '2024-05-01 09:30:00', 42, 3]
+
+    def test_roundtrip(self):
+        self.assertEqual(decode_cursor(encode_cursor(self.KEY)), tuple(self.KEY))
+
+    def test_tampered_token(self):
+        token = encode_cursor(self.KEY)
+        forged = signing.dumps(['2024-05-01', '2024-05-01 09:30:00', 41, 3], salt=CURSOR_SALT + 'x')
+        for bad in (token[:-1] + ('A' if token[-1] != 'A' else 'B'), 'x' + token, forged, '', 'garbage'):
+            with self.subTest(token=bad), self.assertRaises(ValueError):
+                decode_cursor(bad)
+
+    def test_token_of_another_type(self):
+        for token in (5, ["a"], {"cursor": "x"}, None):
+            with self.subTest(token=token), self.assertRaises(ValueError):
+                decode_cursor(token)
+
+    def test_history_cursor_is_not_a_query_cursor(self):
+        token = encode_cursor(self.KEY[:2], salt=HISTORY_CURSOR_SALT)
+        with self.assertRaises(ValueError):
+            decode_cursor(token)
+        self.assertEqual(decode_cursor(token, salt=HISTORY_CURSOR_SALT, size=2), tuple(self.KEY[:2]))
+
+    def test_wrong_shape(self):
+        # A genuine three-part token from before status ids were part of the position
+        for key in (self.KEY[:3], self.KEY + [1]):
+            with self.subTest(key=key), self.assertRaises(ValueError):
+                decode_cursor(encode_cursor(key))
+        with self.assertRaises(ValueError):
+            decode_cursor(signing.dumps({'id': 42}, salt=CURSOR_SALT))
+
+
+class IntentParsingTests(SimpleTestCase):
+
+    def test_bare_at_is_not_a_username(self):
+        parsed = parse_query("status @ today")
+        self.assertIsNone(parsed.user_filter)
+        self.assertEqual(parsed.date_window, 'today')
+
+    def test_handles_without_a_name(self):
+        for text in ("@!", "@", "status @- yesterday", "what did @@ do"):
+            with self.subTest(text=text):
+                self.assertFalse([token for token in tokenize(text) if token[1] == 'handle'])
+                self.assertIsNone(parse_query(text).user_filter)
+
+    def test_handle(self):
+        parsed = parse_query("what did @Bob_2 do yesterday")
+        self.assertEqual((parsed.user_filter, parsed.user_value), ('username', 'bob_2'))
+        self.assertEqual(parsed.date_window, 'yesterday')
+        self.assertEqual(parse_query("tasks for user @alice").username, 'alice')
+
+    def test_user_after_keyword(self):
+        self.assertEqual(parse_query("tasks for user 12 this week").user_id, '12')
+        self.assertEqual(parse_query("tasks for user12").user_id, '12')
+        self.assertIsNone(parse_query("tasks for user @").user_filter)
+        self.assertIsNone(parse_query("what did the user do today").user_filter)
+
+
+class QueryValidationTests(HotwashTestCase):
+
+    def post(self, path='/api/query/', **body):
+        return self.client.post(path, body, content_type='application/json')
+
+    def test_query_must_be_a_string(self):
+        for path in ('/api/query/', '/api/retrieve/'):
+            for query in (["a"], 123, {"text": "a"}):
+                with self.subTest(path=path, query=query):
+                    response = self.post(path, query=query)
+                    self.assertEqual(response.status_code, 400)
+                    self.assertEqual(response.json(), {"error": "Query parameter is required"})
+
+    def test_options_must_be_booleans(self):
+        for name in ('ranked', 'stream', 'retrieval'):
+            for value in ("false", "true", 0, 1, None):
+                with self.subTest(name=name, value=value):
+                    response = self.post(query=SUMMARY_QUERY, **{name: value})
+                    self.assertEqual(response.status_code, 400)
+                    self.assertEqual(response.json(), {"error": f"{name} must be true or false"})
+
+    def test_false_option_is_false(self):
+        response = self.post(query=DETAIL_QUERY, stream=False, ranked=False, retrieval=False)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIsInstance(response, StreamingHttpResponse)
+        self.assertIn("next_cursor", response.json())
+
+    def test_batch_item_options_must_be_booleans(self):
+        response = self.client.post(
+            '/api/query/batch/', {'queries': [{'query': DETAIL_QUERY, 'ranked': 'false'}]},
+            content_type='application/json',
+        )
+        self.assertEqual(response.json()["results"][0]["error"], "ranked must be true or false")
+
+
+class RowConversionTests(SimpleTestCase):
+    DESCRIPTION = [(name,) for name in ('id', 'task', 'date', 'created_at', 'estimate', 'due')]
+    ROWS = [
+        (1, 'Plan', datetime.date(2024, 5, 1), datetime.datetime(2024, 5, 1, 9, 30), decimal.Decimal('1.5'), None),
+        (2, 'Ship', datetime.date(2024, 5, 2), None, decimal.Decimal('2'), datetime.date(2024, 6, 1)),
+    ]
+
+    def test_converts_column_wise(self):
+        data = plan_rows(self.DESCRIPTION, self.ROWS[0]).convert(self.ROWS)
+        self.assertEqual(data, [
+            {'id': 1, 'task': 'Plan', 'date': '2024-05-01', 'created_at': '2024-05-01', 'estimate': 1.5, 'due': None},
+            {'id': 2, 'task': 'Ship', 'date': '2024-05-02', 'created_at': None, 'estimate': 2.0, 'due': '2024-06-01'},
+        ])
+
+    def test_plans_are_shared_per_shape(self):
+        plan = plan_rows(self.DESCRIPTION, self.ROWS[0])
+        self.assertIs(plan_rows(self.DESCRIPTION, self.ROWS[0]), plan)
+        self.assertIsNot(plan_rows(self.DESCRIPTION, self.ROWS[1]), plan)
+
+    def test_untyped_columns_pass_through(self):
+        plan = RowPlan(('id', 'task'), (1, 'Plan'))
+        self.assertEqual(plan.conversions, [])
+        self.assertEqual(plan.convert([(1, 'Plan')]), [{'id': 1, 'task': 'Plan'}])
+
+    def test_renderer_matches_drf_json(self):
+        data = {"rows": plan_rows(self.DESCRIPTION, self.ROWS[0]).convert(self.ROWS), "text": "café ✓",
+                "at": datetime.datetime(2024, 5, 1, 9, 30)}
+        rendered = FastJSONRenderer().render(data)
+        self.assertIsInstance(rendered, bytes)
+        self.assertEqual(json.loads(rendered), json.loads(JSONRenderer().render(data)))
+        self.assertEqual(FastJSONRenderer().render(None), b'')
+
+
+class FullTextSearchTests(HotwashTestCase):
+    QUERY = "status for user 3 in the past 7 days"
+
+    def setUp(self):
+        super().setUp()
+        fts.create_index()
+        fts.install_triggers()
+        fts.rebuild_index()
+        # Rolling back straight after the rebuild leaves SQLite unable to open the next savepoint
+        self.addCleanup(fts.drop_index)
+
+    def mentions_user_3(self, row):
+        # Generated usernames end in the user id, after a letter
+        return bool(re.search(r'[a-z]3$', row['username'] or '') or re.search(r'\buser 3\b', row['task'], re.I))
+
+    def test_mentions_are_looked_up_in_the_index(self):
+        self.assertIn('MATCH', self.view.generate_sql_query(self.QUERY).sql)
+        rows = self.all_rows(self.QUERY)
+        with self.settings(RAG_USE_CELL_FTS=False):
+            fts.fts_available.cache_clear()
+            self.assertNotIn('MATCH', self.view.generate_sql_query(self.QUERY).sql)
+            window = self.all_rows("status in the past 7 days")
+        expected = [row for row in window if self.mentions_user_3(row)]
+        self.assertTrue(any(re.search(r'\buser 3\b', row['task']) for row in expected))
+        self.assertEqual(rows, expected)
+
+    def test_ranked_matching_returns_the_same_rows(self):
+        prepared = self.view.generate_sql_query(self.QUERY, ranked=True, page_size=100000)
+        self.assertIn('fts_rank', prepared.sql)
+        ranked = self.view.execute_query(prepared.sql, prepared.params)
+        self.assertEqual(
+            sorted((row['id'], row['status_id']) for row in ranked),
+            sorted((row['id'], row['status_id']) for row in self.all_rows(self.QUERY)),
+        )
+
+    def test_triggers_follow_edits(self):
+        row = next(row for row in self.all_rows("status in the past 7 days") if not self.mentions_user_3(row))
+        with connection.cursor() as cursor:
+            cursor.execute("UPDATE hotwash_rowcell_data SET cell_data = 'Call back for USER 3' WHERE id = %s", [row['id']])
+            self.assertIn(row['id'], {found['id'] for found in self.all_rows(self.QUERY)})
+            cursor.execute("UPDATE hotwash_rowcell_data SET cell_data = 'Call back' WHERE id = %s", [row['id']])
+            self.assertNotIn(row['id'], {found['id'] for found in self.all_rows(self.QUERY)})
+
+
+class RetrievalTests(HotwashTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.build_retrieval_index()
+
+    def documents(self, ids):
+        """Indexed text of each cell: its data plus its column and sheet names"""
+        with connection.cursor() as cursor:
+            cursor.execute(retrieval.DOCUMENTS_SQL, [''])
+            rows = {row[0]: row for row in cursor.fetchall()}
+        return {row_id: ' '.join(part or '' for part in rows[row_id][1:4]).lower() for row_id in ids}
+
+    def edit(self, row_id, text):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "UPDATE hotwash_rowcell_data SET cell_data = %s, "
+                "updated_at = (SELECT datetime(MAX(updated_at), '+1 second') FROM hotwash_rowcell_data) WHERE id = %s",
+                [text, row_id],
+            )
+
+    def test_hits_contain_the_query_terms(self):
+        hits = retrieval.get_index().search('quarterly', k=20)
+        self.assertEqual(len(hits), 20)
+        self.assertEqual([score for _id, score in hits], sorted((score for _id, score in hits), reverse=True))
+        for row_id, text in self.documents([row_id for row_id, _score in hits]).items():
+            self.assertIn('quarterly', text, row_id)
+
+    def test_edited_rows_are_reindexed(self):
+        row_id = retrieval.get_index().search('quarterly', k=1)[0][0]
+        self.edit(row_id, 'Calibrate the zyzzyva sensor')
+        self.assertEqual(retrieval.update_index(), 1)
+        index = retrieval.get_index()
+        self.assertEqual(index.search('zyzzyva', k=5)[0][0], row_id)
+        self.assertEqual(index.stats()["segments"], 2)
+        self.assertEqual(index.stats()["deleted"], 1)
+        self.assertEqual(retrieval.update_index(), 0)
+
+    def test_date_range_limits_hits(self):
+        yesterday = timezone.now().date() - datetime.timedelta(days=1)
+        hits = retrieval.get_index().search('review', k=50, start=yesterday, end=yesterday)
+        self.assertTrue(hits)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT DISTINCT date(cell_date) FROM hotwash_rowcell_data "
+                f"WHERE id IN ({', '.join(['%s'] * len(hits))})", [row_id for row_id, _score in hits],
+            )
+            self.assertEqual(cursor.fetchall(), [(yesterday.isoformat(),)])
+
+    def test_endpoint_returns_ranked_rows(self):
+        response = self.client.post('/api/retrieve/', {'query': 'payment flow', 'k': 5}, content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        body = response.json()
+        self.assertEqual(len(body["hits"]), 5)
+        self.assertLessEqual({row["id"] for row in body["data_fetched"]}, {hit["id"] for hit in body["hits"]})
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT COUNT(*) FROM hotwash_rowcell_data")
+            self.assertEqual(body["index"]["documents"], cursor.fetchone()[0])
+
+
+class BatchQueryTests(HotwashTestCase):
+
+    def batch(self, queries):
+        return self.client.post('/api/query/batch/', {'queries': queries}, content_type='application/json')
+
+    def single(self, query):
+        return self.client.post('/api/query/', {'query': query}, content_type='application/json').json()
+
+    def test_answers_match_single_queries_in_request_order(self):
+        user_3, user_5 = "status for user 3 in the past 7 days", "status for user 5 in the past 7 days"
+        response = self.batch([DETAIL_QUERY, user_3, DETAIL_QUERY, 123, {"query": user_5}])
+        self.assertEqual(response.status_code, 200)
+        body = response.json()
+        results = body["results"]
+        self.assertEqual([result["query"] for result in results], [DETAIL_QUERY, user_3, DETAIL_QUERY, None, user_5])
+        self.assertEqual(results[3]["error"], "Each item must be a query string or an object with a query")
+        for index, query in ((0, DETAIL_QUERY), (1, user_3), (4, user_5)):
+            with self.subTest(query=query):
+                single = self.single(query)
+                self.assertEqual(results[index]["data_fetched"], single["data_fetched"])
+                self.assertEqual(results[index]["next_cursor"], single["next_cursor"])
+        self.assertEqual(results[2]["data_fetched"], results[0]["data_fetched"])
+        self.assertTrue(results[2]["timing"]["deduplicated"])
+        # The two user questions share a template and run as one UNION ALL
+        self.assertEqual(results[1]["timing"]["merged"], 2)
+        self.assertEqual(body["distinct"], 3)
+        self.assertEqual(body["statements"], 2)
+
+    def test_summary_questions_get_their_aggregates(self):
+        result = self.batch([SUMMARY_QUERY]).json()["results"][0]
+        self.assertEqual(result["summary"], self.single(SUMMARY_QUERY)["summary"])
+
+    def test_batch_shape_is_validated(self):
+        self.assertEqual(self.batch([]).status_code, 400)
+        self.assertEqual(self.batch(DETAIL_QUERY).status_code, 400)
+        with self.settings(RAG_MAX_BATCH_SIZE=2):
+            self.assertEqual(self.batch([DETAIL_QUERY] * 3).status_code, 400)
+
+
+class ExecutorTests(SimpleTestCase):
+
+    def setUp(self):
+        self.executor = DatabaseExecutor(max_workers=1, max_queue=0)
+        self.addCleanup(self.executor._pool.shutdown)
+
+    def test_runs_on_a_worker_thread(self):
+        name = asyncio.run(self.executor.run(lambda: threading.current_thread().name))
+        self.assertTrue(name.startswith('rag-db'))
+        self.assertEqual(self.executor.stats()["completed"], 1)
+
+    def test_refuses_work_beyond_the_queue(self):
+        release = threading.Event()
+
+        async def scenario():
+            running = asyncio.ensure_future(self.executor.run(release.wait))
+            await asyncio.sleep(0.05)
+            with self.assertRaises(ExecutorSaturated):
+                await self.executor.run(int)
+            release.set()
+            await running
+
+        asyncio.run(scenario())
+        self.assertEqual(self.executor.stats()["rejected"], 1)
+
+    def test_cancelled_request_keeps_its_slot_until_the_work_ends(self):
+        started, release, finished = threading.Event(), threading.Event(), threading.Event()
+        self.addCleanup(release.set)
+
+        def work():
+            started.set()
+            release.wait()
+            finished.set()
+
+        async def scenario():
+            request = asyncio.ensure_future(self.executor.run(work))
+            await asyncio.to_thread(started.wait)
+            # The client disconnects while the worker is still busy
+            request.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await request
+            with self.assertRaises(ExecutorSaturated):
+                await asyncio.wait_for(self.executor.run(int), 1)
+            release.set()
+            await asyncio.to_thread(finished.wait)
+            await asyncio.sleep(0.05)
+            return await self.executor.run(lambda: 'free')
+
+        self.assertEqual(asyncio.run(scenario()), 'free')
+        self.assertEqual(self.executor.stats()["queued"], 0)
+
+    def test_stream_runs_on_one_worker(self):
+        def rows():
+            for _ in range(5):
+                yield threading.current_thread().name
+
+        async def consume():
+            return [item async for item in self.executor.stream(rows(), max_buffer=2)]
+
+        names = asyncio.run(consume())
+        self.assertEqual(len(names), 5)
+        self.assertEqual(len(set(names)), 1)
+        self.assertEqual(self.executor.stats()["completed"], 1)
+
+    def test_unconsumed_stream_holds_no_slot(self):
+        async def scenario():
+            self.executor.stream(iter([1, 2]))
+            return await self.executor.run(lambda: 'free')
+
+        self.assertEqual(asyncio.run(scenario()), 'free')
+
+
+class SingleFlightTests(SimpleTestCase):
+
+    def run_followers(self, flight, key, fn, count):
+        """Start count callers of key in threads; returns the list their (result, shared) pairs land in"""
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(flight.do(key, fn))) for _ in range(count)]
+        for thread in threads:
+            thread.start()
+        self.addCleanup(lambda: [thread.join() for thread in threads])
+        # Give them time to find the leader's call in flight
+        threading.Event().wait(0.1)
+        return results, threads
+
+    def lead(self, flight, key, fn):
+        """Start the first caller of key in a thread; returns the list its result or error lands in"""
+        leader = []
+
+        def run():
+            try:
+                leader.append(flight.do(key, fn))
+            except RuntimeError as e:
+                leader.append(e)
+
+        thread = threading.Thread(target=run)
+        thread.start()
+        return leader, thread
+
+    def test_concurrent_callers_share_one_run(self):
+        flight, release, calls = SingleFlight(), threading.Event(), []
+
+        def compute():
+            calls.append(1)
+            release.wait()
+            return ["rows"]
+
+        leader, leader_thread = self.lead(flight, 'q', compute)
+        followers, threads = self.run_followers(flight, 'q', compute, 5)
+        release.set()
+        for thread in [leader_thread, *threads]:
+            thread.join()
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(leader, [(["rows"], False)])
+        self.assertEqual(followers, [(["rows"], True)] * 5)
+        self.assertIs(followers[0][0], leader[0][0])
+        self.assertEqual(flight.stats(), {"in_flight": 0, "leaders": 1, "coalesced": 5, "timeouts": 0, "failures": 0})
+
+    def test_other_keys_run_on_their_own(self):
+        flight = SingleFlight()
+        self.assertEqual(flight.do('a', lambda: 1), (1, False))
+        self.assertEqual(flight.do('a', lambda: 2), (2, False))
+        self.assertEqual(flight.stats()["leaders"], 2)
+
+    def test_waiters_run_it_themselves_after_a_timeout(self):
+        flight, release = SingleFlight(timeout=0.01), threading.Event()
+        self.addCleanup(release.set)
+        self.lead(flight, 'q', release.wait)
+        followers, threads = self.run_followers(flight, 'q', lambda: 'own', 1)
+        threads[0].join()
+        self.assertEqual(followers, [('own', False)])
+        self.assertEqual(flight.stats()["timeouts"], 1)
+
+    def test_waiters_retry_when_the_leader_fails(self):
+        flight, release = SingleFlight(), threading.Event()
+
+        def fail():
+            release.wait()
+            raise RuntimeError("disk I/O error")
+
+        leader, leader_thread = self.lead(flight, 'q', fail)
+        followers, threads = self.run_followers(flight, 'q', lambda: 'own', 1)
+        release.set()
+        for thread in [leader_thread, *threads]:
+            thread.join()
+        self.assertIsInstance(leader[0], RuntimeError)
+        self.assertEqual(followers, [('own', False)])
+        self.assertEqual(flight.stats()["failures"], 1)
+
+
+class AsyncViewTests(SimpleTestCase):
+
+    def setUp(self):
+        self.addCleanup(setattr, executor, '_executor', executor._executor)
+        executor._executor = DatabaseExecutor(max_workers=1, max_queue=0)
+        self.addCleanup(executor._executor._pool.shutdown)
+        self.view = AsyncOfflineRAGView.as_view()
+
+    def post(self, body):
+        request = AsyncRequestFactory().post('/api/query/', body, content_type='application/json')
+        return asyncio.run(self.view(request))
+
+    def test_sync_view_runs_on_the_executor(self):
+        response = self.post({"query": ""})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(json.loads(response.content), {"error": "Query parameter is required"})
+        self.assertEqual(executor._executor.stats()["completed"], 1)
+
+    def test_saturated_executor_answers_503(self):
+        executor._executor._admit()
+        self.addCleanup(executor._executor._release)
+        response = self.post({"query": DETAIL_QUERY})
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response['Retry-After'], '1')
+        self.assertEqual(json.loads(response.content)["executor"]["rejected"], 1)
+
+
+class AdmissionTests(HotwashTestCase):
+
+    def statements(self, query=SUMMARY_QUERY):
+        intent = self.view.generate_sql_query(query).intent
+        return [self.view.count_query(query, intent)], window_days(intent.date_window)
+
+    def test_classification_follows_thresholds(self):
+        statements, days = self.statements()
+        for config, verdict in (
+            ({}, 'cheap'),
+            ({'EXPENSIVE_ROWS': 1}, 'expensive'),
+            ({'EXPENSIVE_ROWS': 0, 'REJECT_ROWS': 1}, 'rejected'),
+        ):
+            with self.subTest(config=config), self.settings(RAG_ADMISSION=config):
+                controller = AdmissionController()
+                estimate = controller.estimate(statements, days)
+                self.assertEqual(estimate.verdict, verdict)
+                self.assertGreater(estimate.rows, 0)
+                self.assertEqual(controller.stats()['classified'][verdict], 1)
+
+    def test_unplannable_statement_is_not_refused(self):
+        estimate = AdmissionController().estimate([("SELECT * FROM no_such_table", [])])
+        self.assertEqual(estimate.describe(), {"class": "cheap", "estimated_rows": None})
+
+    def test_rejected_question_is_answered_with_a_count(self):
+        # Like the summaries, the count is of joined rows, one per status option
+        expected = len(self.all_rows(DETAIL_QUERY))
+        with self.settings(RAG_ADMISSION={'EXPENSIVE_ROWS': 0, 'REJECT_ROWS': 1}):
+            response = self.client.post('/api/query/', {'query': DETAIL_QUERY}, content_type='application/json')
+        body = response.json()
+        self.assertEqual(body['admission']['degraded'], 'rejected')
+        self.assertEqual(body['data_fetched'], [])
+        self.assertTrue(body['summary']['count_only'])
+        self.assertEqual(body['summary']['tasks'], expected)
+
+    def test_rejected_stream_sends_only_a_count(self):
+        expected = len(self.all_rows(DETAIL_QUERY))
+        with self.settings(RAG_ADMISSION={'EXPENSIVE_ROWS': 0, 'REJECT_ROWS': 1}):
+            lines = self.stream(DETAIL_QUERY)
+        self.assertEqual(lines[0]['meta']['admission']['class'], 'rejected')
+        self.assertFalse([line for line in lines if 'row' in line])
+        summary = lines[-1]['summary']
+        self.assertEqual(summary['admission']['degraded'], 'rejected')
+        self.assertEqual(summary['count_only']['tasks'], expected)
+        self.assertIsNone(summary['next_cursor'])
+
+    def test_expensive_stream_runs_on_a_budget(self):
+        with self.settings(RAG_ADMISSION={'EXPENSIVE_ROWS': 0, 'BUDGET': 0}):
+            lines = self.stream(DETAIL_QUERY)
+            controller = admission.get_admission_controller()
+            self.assertEqual(controller.stats()['lane_active'], 0)
+            self.assertEqual(controller.stats()['degraded']['budget'], 1)
+        self.assertEqual(lines[0]['meta']['admission']['class'], 'expensive')
+        summary = lines[-1]['summary']
+        self.assertEqual(summary['admission']['degraded'], 'budget')
+        self.assertTrue(summary['count_only']['count_only'])
+        self.assertEqual(summary['count'], len([line for line in lines if 'row' in line]))
+
+    def test_cheap_stream_is_not_degraded(self):
+        lines = self.stream(DETAIL_QUERY)
+        admitted = lines[-1]['summary']['admission']
+        self.assertEqual((admitted['class'], admitted['degraded']), ('cheap', None))
+        self.assertEqual(lines[-1]['summary']['count'], len(self.all_rows(DETAIL_QUERY)))
+
+    def test_rejected_retrieval_returns_only_hits(self):
+        self.build_retrieval_index()
+        with self.settings(RAG_ADMISSION={'EXPENSIVE_ROWS': 0, 'REJECT_ROWS': 0}):
+            response = self.client.post('/api/retrieve/', {'query': 'review quarterly report'}, content_type='application/json')
+        body = response.json()
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(body['hits'])
+        self.assertEqual(body['data_fetched'], [])
+        self.assertEqual(body['admission']['degraded'], 'rejected')
+
+    def test_budget_interrupts_a_statement(self):
+        heavy = (
+            "WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n WHERE i < 100000000) "
+            "SELECT COUNT(*) FROM n"
+        )
+        with TimeBudget(0) as budget, self.assertRaises(OperationalError):
+            with read_connection().cursor() as cursor:
+                cursor.execute(heavy)
+        self.assertTrue(budget.expired)
+
+        with TimeBudget(60) as budget, read_connection().cursor() as cursor:
+            cursor.execute("SELECT COUNT(*) FROM hotwash_rowcell_data")
+            self.assertEqual(cursor.fetchone()[0], 600)
+        self.assertFalse(budget.expired)
+
+
+@override_settings(RAG_READ_DATABASE='default', RAG_HISTORY_WRITER={'ENABLED': False})
+class HistoryTests(TestCase):
+    ROWS = [{"id": 1, "cell_data": "Review budget"}, {"id": 2, "cell_data": "Draft plan"}]
+
+    def entry(self, query, data):
+        return {"query": query, "sql_query": "SELECT 1", "response": "ok", "data_fetched": data}
+
+    def test_identical_results_share_a_payload(self):
+        write_history([self.entry("a", self.ROWS), self.entry("b", list(self.ROWS))])
+        write_history([self.entry("c", [dict(row) for row in self.ROWS]), self.entry("d", [])])
+        self.assertEqual(QueryHistory.objects.count(), 4)
+        self.assertEqual(QueryPayload.objects.count(), 2)
+        self.assertEqual(QueryHistory.objects.get(query="c").data_fetched, self.ROWS)
+        self.assertEqual(QueryHistory.objects.get(query="d").data_fetched, [])
+
+    def test_compaction_keeps_referenced_payloads(self):
+        write_history([
+            self.entry("old shared", self.ROWS), self.entry("old only", self.ROWS[:1]),
+            self.entry("new", self.ROWS),
+        ])
+        QueryHistory.objects.filter(query__startswith="old").update(
+            created_at=timezone.now() - datetime.timedelta(days=45)
+        )
+        out = StringIO()
+        call_command('compact_history', days=30, chunk_size=1, stdout=out)
+        self.assertIn("Deleted 2 history row(s)", out.getvalue())
+        self.assertIn("Deleted 1 unreferenced payload(s)", out.getvalue())
+        self.assertEqual(list(QueryHistory.objects.values_list('query', flat=True)), ["new"])
+        self.assertEqual(QueryHistory.objects.get().data_fetched, self.ROWS)
+        self.assertEqual(QueryPayload.objects.count(), 1)
+
+
+@override_settings(RAG_READ_DATABASE='default', RAG_HISTORY_WRITER={'ENABLED': False})
+class HistoryPagingTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        write_history([
+            {"query": f"{'status' if i % 2 else 'tasks'} {i}", "sql_query": "SELECT 1", "response": "ok",
+             "data_fetched": [{"id": i}]}
+            for i in range(7)
+        ])
+        now = timezone.now()
+        # The newest rows share a timestamp, so pages must break ties on id
+        for item in QueryHistory.objects.all():
+            offset = min(item.id, 4)
+            QueryHistory.objects.filter(pk=item.pk).update(created_at=now - datetime.timedelta(days=10 - offset))
+        cls.newest_first = list(QueryHistory.objects.order_by('-created_at', '-id').values_list('id', flat=True))
+
+    def page(self, **params):
+        response = self.client.get('/api/history/', params)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_pages_walk_every_entry_once(self):
+        ids, cursor = [], None
+        while True:
+            body = self.page(limit=3, **({'cursor': cursor} if cursor else {}))
+            ids += [entry["id"] for entry in body["history"]]
+            cursor = body["next_cursor"]
+            if cursor is None:
+                break
+        self.assertEqual(ids, self.newest_first)
+
+    def test_entries_leave_out_their_data(self):
+        entry = self.page(limit=1)["history"][0]
+        self.assertNotIn("data_fetched", entry)
+        self.assertTrue(entry["has_data"])
+        item = self.client.get(f'/api/history/{entry["id"]}/').json()
+        self.assertEqual(item["data_fetched"], [{"id": int(entry["query"].split()[-1])}])
+        self.assertEqual(self.client.get('/api/history/999999/').status_code, 404)
+
+    def test_filters(self):
+        self.assertEqual({entry["query"] for entry in self.page(prefix='status')["history"]}, {"status 1", "status 3", "status 5"})
+        oldest = QueryHistory.objects.order_by('created_at').first().created_at
+        until = self.page(until=(oldest + datetime.timedelta(seconds=1)).isoformat())["history"]
+        self.assertEqual(len(until), 1)
+        self.assertEqual(len(self.page(since=(oldest + datetime.timedelta(seconds=1)).isoformat())["history"]), 6)
+
+    def test_bad_parameters_are_rejected(self):
+        for params in ({'limit': 0}, {'limit': 'x'}, {'since': 'yesterday'}, {'cursor': 'nope'}):
+            with self.subTest(params=params):
+                self.assertEqual(self.client.get('/api/history/', params).status_code, 400)
+
+
+class IdleHistoryWriter(HistoryWriter):
+    """A writer whose worker never starts, so the queue only fills"""
+
+    def _ensure_started(self):
+        pass
+
+
+# The writer thread opens its own connection, which must see committed rows
+@override_settings(RAG_READ_DATABASE='default')
+class HistoryWriterTests(TransactionTestCase):
+
+    def entry(self, query):
+        return {"query": query, "sql_query": "SELECT 1", "response": "ok", "data_fetched": [{"id": 1}]}
+
+    def test_rows_are_written_in_batches_in_the_background(self):
+        writer = HistoryWriter(batch_size=3, flush_interval=0.05)
+        for i in range(7):
+            writer.submit(**self.entry(f"q{i}"))
+        writer.stop()
+        self.assertEqual(QueryHistory.objects.count(), 7)
+        self.assertEqual(QueryPayload.objects.count(), 1)
+        self.assertEqual(writer.stats(), {"queued": 0, "written": 7, "dropped": 0, "failed": 0})
+
+    def test_full_queue_drops_rows_instead_of_waiting(self):
+        writer = IdleHistoryWriter(max_queue=2)
+        for i in range(3):
+            writer.submit(**self.entry(f"q{i}"))
+        self.assertEqual(writer.stats(), {"queued": 2, "written": 0, "dropped": 1, "failed": 0})
+
+    def test_failed_batches_are_counted(self):
+        writer = HistoryWriter(flush_interval=0.05)
+        with self.assertLogs('rag_app.history', 'ERROR'):
+            writer.submit(query="no payload")
+            writer.stop()
+        self.assertEqual(writer.stats()["failed"], 1)
+        self.assertFalse(QueryHistory.objects.exists())
+
+    @override_settings(RAG_HISTORY_WRITER={'ENABLED': True, 'FLUSH_INTERVAL': 0.05})
+    def test_record_query_goes_through_the_writer(self):
+        self.addCleanup(setattr, history, '_writer', None)
+        history._writer = None
+        record_query(**self.entry("queued"))
+        history.get_history_writer().stop()
+        self.assertEqual(QueryHistory.objects.get().query, "queued")
+
+
+class SummaryTests(HotwashTestCase):
+
+    def test_summary_aggregates_the_whole_window(self):
+        rows = self.all_rows(DETAIL_QUERY)
+        self.assertGreater(len(rows), summary_sample_size())
+        body = self.client.post('/api/query/', {'query': SUMMARY_QUERY}, content_type='application/json').json()
+        summary = body["summary"]
+        self.assertEqual(summary["tasks"], len(rows))
+        self.assertEqual((summary["first_date"], summary["last_date"]), (min(r['date'] for r in rows), max(r['date'] for r in rows)))
+        self.assertEqual(summary["users"], len({row['username'] for row in rows}))
+        self.assertEqual(sum(group["tasks"] for group in summary["by_status"]), len(rows))
+        # Only a sample of the rows is sent
+        self.assertEqual(len(body["data_fetched"]), summary_sample_size())
+        self.assertIn(str(len(rows)), body["response"])
+
+    def test_groups_are_largest_first_and_bounded(self):
+        with self.settings(RAG_SUMMARY_GROUP_LIMIT=3):
+            intent = self.view.generate_sql_query(SUMMARY_QUERY).intent
+            summary = self.view.execute_summary(*self.view.summary_query(SUMMARY_QUERY, intent))
+        for dimension in ('by_user', 'by_workspace', 'by_status'):
+            with self.subTest(dimension=dimension):
+                counts = [group["tasks"] for group in summary[dimension]]
+                self.assertEqual(len(counts), 3)
+                self.assertEqual(counts, sorted(counts, reverse=True))
+
+
+class TaskFactsTests(HotwashTestCase):
+
+    def setUp(self):
+        super().setUp()
+        call_command('build_task_facts', stdout=StringIO())
+        facts.facts_available.cache_clear()
+
+    def test_facts_answer_like_the_join(self):
+        self.assertTrue(facts.check_consistency()["consistent"])
+        for query in (DETAIL_QUERY, "status for user 3 in the past 7 days"):
+            with self.subTest(query=query):
+                self.assertIn(facts.FACTS_TABLE, self.view.generate_sql_query(query).sql)
+                rows = self.all_rows(query)
+                with self.settings(RAG_USE_TASK_FACTS=False):
+                    facts.facts_available.cache_clear()
+                    self.assertEqual(rows, self.all_rows(query))
+                facts.facts_available.cache_clear()
+
+    def test_triggers_follow_writes_to_every_source_table(self):
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT id, sheet_id FROM hotwash_rowcell_data ORDER BY id LIMIT 3")
+            (edited, _), (moved, _), (deleted, _) = cursor.fetchall()
+            cursor.execute("SELECT MAX(id) FROM hotwash_sheet")
+            other_sheet = cursor.fetchone()[0]
+            cursor.execute("UPDATE hotwash_rowcell_data SET cell_data = 'Edited' WHERE id = %s", [edited])
+            cursor.execute("UPDATE hotwash_rowcell_data SET sheet_id = %s WHERE id = %s", [other_sheet, moved])
+            cursor.execute("DELETE FROM hotwash_rowcell_data WHERE id = %s", [deleted])
+            cursor.execute("UPDATE hotwash_status_dropdown SET status_text = 'Renamed' WHERE id = 1")
+            cursor.execute("UPDATE hotwash_groups_header SET name = 'Renamed' WHERE id = 1")
+            cursor.execute("UPDATE hotwash_sheet SET name = 'Renamed', workspace_id = 2 WHERE id = 1")
+            cursor.execute("UPDATE hotwash_workspace SET user_id = 3 WHERE id = 4")
+            cursor.execute("UPDATE authentication_user SET username = 'renamed' WHERE id = 5")
+            cursor.execute("DELETE FROM hotwash_status_dropdown WHERE id = 2")
+        report = facts.check_consistency()
+        self.assertTrue(report["consistent"], report)
+
+    def test_check_reports_drift_without_triggers(self):
+        facts.drop_triggers()
+        with connection.cursor() as cursor:
+            cursor.execute("DELETE FROM hotwash_rowcell_data WHERE id = (SELECT MIN(id) FROM hotwash_rowcell_data)")
+        with self.assertRaises(CommandError):
+            call_command('build_task_facts', check=True, stdout=StringIO())
+        call_command('build_task_facts', refresh=True, stdout=StringIO())
+        self.assertTrue(facts.check_consistency()["consistent"])
+
+
+class RollupTests(HotwashTestCase):
+    QUERIES = [SUMMARY_QUERY, "tasks yesterday", "tasks this week", "tasks for user 3 in the past 7 days"]
+
+    def setUp(self):
+        super().setUp()
+        fts.create_index()
+        fts.rebuild_index()
+        self.today = timezone.now().date()
+        rollups.refresh(self.today)
+        clear_process_state()
+
+    def live_summary(self, query):
+        intent = self.view.generate_sql_query(query).intent
+        parsed = parse_query(query)
+        sql, _ = get_summary_template(intent)
+        params = user_params(parsed.user_filter, parsed.user_value, summary_intent(intent).match_mode)
+        return self.view.execute_summary(sql, params + date_params(intent.date_window) + [10] * 3)
+
+    def rollup_summary(self, query):
+        intent = self.view.generate_sql_query(query).intent
+        statement = rollups.summary_query(intent, parse_query(query).user_value, 10, self.today)
+        self.assertIsNotNone(statement, query)
+        return self.view.execute_summary(*statement)
+
+    def answered_summary(self, query):
+        intent = self.view.generate_sql_query(query).intent
+        return self.view.execute_summary(*self.view.summary_query(query, intent))
+
+    def assertFallsBackToLive(self):
+        for query in self.QUERIES:
+            with self.subTest(query=query):
+                self.assertEqual(self.answered_summary(query), self.live_summary(query))
+        # Both windows hold yesterday, which every change below touches
+        for query in (SUMMARY_QUERY, "tasks yesterday"):
+            intent = self.view.generate_sql_query(query).intent
+            self.assertIsNone(rollups.summary_query(intent, None, 10, self.today))
+
+    def assertSummariesEqual(self):
+        for query in self.QUERIES:
+            with self.subTest(query=query):
+                live, rolled = self.live_summary(query), self.rollup_summary(query)
+                # Top tasks are summed from per-day top lists, so only they may differ
+                live.pop('by_task', None)
+                rolled.pop('by_task', None)
+                self.assertEqual(rolled, live)
+
+    def test_rollups_match_live_summaries(self):
+        self.assertEqual(rollups.check_consistency(self.today)["differences"], [])
+        self.assertSummariesEqual()
+
+    def test_moved_cell_leaves_its_old_day(self):
+        yesterday = self.today - datetime.timedelta(days=1)
+        moved_to = self.today - datetime.timedelta(days=3)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT id FROM hotwash_rowcell_data WHERE cell_date = %s LIMIT 3", [yesterday.isoformat()]
+            )
+            ids = [row[0] for row in cursor.fetchall()]
+            self.assertTrue(ids)
+            # Generated edits run up to three days ahead, so stamp past the newest one
+            cursor.execute(
+                "UPDATE hotwash_rowcell_data SET cell_date = %s, "
+                "updated_at = (SELECT datetime(MAX(updated_at), '+1 second') FROM hotwash_rowcell_data) "
+                f"WHERE id IN ({', '.join(['%s'] * len(ids))})",
+                [moved_to.isoformat(), *ids],
+            )
+        self.assertEqual(rollups.refresh(self.today), (0, 2))
+        self.assertEqual(rollups.check_consistency(self.today)["differences"], [])
+        self.assertSummariesEqual()
+
+    def test_deleted_cells_are_not_counted(self):
+        yesterday = self.today - datetime.timedelta(days=1)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "DELETE FROM hotwash_rowcell_data WHERE id IN "
+                "(SELECT id FROM hotwash_rowcell_data WHERE cell_date = %s LIMIT 3)", [yesterday.isoformat()],
+            )
+            self.assertTrue(cursor.rowcount)
+        self.assertFallsBackToLive()
+        self.assertEqual(rollups.refresh(self.today), (0, 1))
+        self.assertEqual(rollups.check_consistency(self.today)["differences"], [])
+        self.assertSummariesEqual()
+
+    def test_status_edit_re_rolls_its_days(self):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "UPDATE hotwash_status_dropdown SET status_text = 'Renamed' "
+                "WHERE id = (SELECT MIN(id) FROM hotwash_status_dropdown)"
+            )
+        self.assertFallsBackToLive()
+        _built, patched = rollups.refresh(self.today)
+        self.assertTrue(patched)
+        self.assertSummariesEqual()
+        self.assertEqual(rollups.check_consistency(self.today)["differences"], [])
+        with connection.cursor() as cursor:
+            cursor.execute(f"SELECT COALESCE(SUM(tasks), 0) FROM {rollups.ROLLUP_TABLE} "
+                           "WHERE status = 'Renamed' AND subject_id IS owner_id")
+            rolled = cursor.fetchone()[0]
+            cursor.execute(
+                "SELECT COUNT(*) FROM hotwash_rowcell_data gcd JOIN hotwash_status_dropdown sd "
+                "ON gcd.sheet_id = sd.sheet_id AND gcd.column_id = sd.column_id "
+                "WHERE sd.status_text = 'Renamed' AND gcd.cell_date < %s", [self.today.isoformat()],
+            )
+            self.assertEqual(rolled, cursor.fetchone()[0])
+
+
+# Shard connections take the read alias's pragmas, which here would be the writer's WAL switch
+@override_settings(RAG_SHARDS={'ENABLED': True}, RAG_SQLITE_PRAGMAS={})
+class ShardTests(HotwashTestCase):
+
+    def setUp(self):
+        super().setUp()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = Path(directory.name)
+
+    def split(self, count):
+        """split_shards from a file copy of the test database, which is in memory and mid-transaction"""
+        with connection.cursor() as cursor:
+            cursor.execute(shards.WORKSPACE_LOAD_SQL)
+            workspaces = cursor.fetchall()
+        # The map split() will write, so the copy routes sheets the same way
+        shards.write_map(
+            shards.plan_shards(workspaces, count), {workspace: owner for workspace, owner, _cells in workspaces},
+        )
+        source = self.directory / 'source.sqlite3'
+        source.unlink(missing_ok=True)
+        copy = sqlite3.connect(source)
+        tables = [*SCHEMA_TABLES, shards.SHARD_MAP_TABLE]
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"SELECT name, sql FROM sqlite_master WHERE type = 'table' AND name IN ({', '.join(['%s'] * len(tables))})",
+                tables,
+            )
+            for name, ddl in cursor.fetchall():
+                copy.execute(ddl)
+                cursor.execute(f"SELECT * FROM {name}")
+                rows = cursor.fetchall()
+                if rows:
+                    copy.executemany(f"INSERT INTO {name} VALUES ({', '.join('?' * len(rows[0]))})", rows)
+        copy.commit()
+        copy.close()
+        report = shards.split(count, self.directory, str(source))
+        shards.shards_available.cache_clear()
+        return report
+
+    def delete_cells(self, ids):
+        with connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM hotwash_rowcell_data WHERE id IN ({', '.join(['%s'] * len(ids))})", ids)
+
+    def page_through(self, query, page_size=25):
+        seen, cursor = [], None
+        while True:
+            response = self.client.post(
+                '/api/query/', {'query': query, 'page_size': page_size, 'cursor': cursor},
+                content_type='application/json',
+            )
+            self.assertEqual(response.status_code, 200)
+            body = response.json()
+            seen += [(row['id'], row['status_id']) for row in body['data_fetched']]
+            cursor = body['next_cursor']
+            if cursor is None:
+                return seen
+
+    def test_split_covers_every_cell(self):
+        report = self.split(3)
+        self.assertEqual(sum(shard['cells'] for shard in report), 600)
+        self.assertTrue(shards.check_consistency()['consistent'])
+
+    def test_pages_follow_the_shards_not_the_main_database(self):
+        expected = [(row['id'], row['status_id']) for row in self.all_rows(DETAIL_QUERY)]
+        self.split(2)
+        # The main database moves on; the snapshot the rows come from does not
+        self.delete_cells([cell for cell, _status in expected])
+        self.assertEqual(self.page_through(DETAIL_QUERY), expected)
+
+    def test_resplit_is_read_without_a_restart(self):
+        self.split(2)
+        first = self.page_through(DETAIL_QUERY, page_size=500)
+        gone = sorted({cell for cell, _status in first})[:5]
+        self.delete_cells(gone)
+        self.split(2)
+        again = self.page_through(DETAIL_QUERY, page_size=500)
+        self.assertFalse({cell for cell, _status in again} & set(gone))
+        self.assertEqual(len(again), len(first) - 2 * len(gone))
+        self.split(3)
+        self.assertEqual(sorted(shards.get_shard_map().paths), [0, 1, 2])
+        self.assertEqual(self.page_through(DETAIL_QUERY, page_size=500), again)
+
+    @override_settings(RAG_RESULT_CACHE={'BACKEND': 'rag_app.result_cache.LocMemResultCache', 'WATERMARK_TTL': 0})
+    def test_cached_answers_follow_the_shards(self):
+        result_cache.install_triggers()
+        self.split(2)
+
+        def ask():
+            body = self.client.post('/api/query/', {'query': DETAIL_QUERY}, content_type='application/json').json()
+            return [row['id'] for row in body['data_fetched']], body['result_cache']['hit']
+
+        ids, _hit = ask()
+        self.delete_cells(ids[:1])
+        # Still what the shards hold
+        self.assertEqual(ask(), (ids, True))
+        self.split(2)
+        fresh, hit = ask()
+        self.assertFalse(hit)
+        self.assertNotIn(ids[0], fresh)
+
+
+class MetricsTests(HotwashTestCase):
+
+    def sample(self, line_prefix):
+        """The value of the first sample on /metrics/ starting with line_prefix, or None"""
+        text = self.client.get('/metrics/').content.decode()
+        for line in text.splitlines():
+            if line.startswith(line_prefix + ' '):
+                return float(line.rsplit(' ', 1)[1])
+        return None
+
+    def test_requests_and_stages_are_counted(self):
+        requests = 'rag_requests_total{view="query",code="200"}'
+        before = self.sample(requests) or 0
+        response = self.client.post('/api/query/', {'query': DETAIL_QUERY}, content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('total;dur=', response['Server-Timing'])
+        self.assertEqual(self.sample(requests), before + 1)
+        self.assertGreaterEqual(self.sample('rag_stage_duration_seconds_count{view="query",stage="total"}'), 1)
+
+    def test_executor_is_reported_once_started(self):
+        self.addCleanup(setattr, executor, '_executor', executor._executor)
+        executor._executor = None
+        self.assertIsNone(self.sample('rag_db_executor_active'))
+        self.assertIsNone(executor._executor)
+        started = executor.get_db_executor()
+        self.addCleanup(started._pool.shutdown)
+        self.assertEqual(self.sample('rag_db_executor_active'), 0)
+
+    def test_counters_are_exact_under_concurrency(self):
+        registry = MetricsRegistry()
+        cache = result_cache.LocMemResultCache()
+        cache.set('key', 1, {})
+
+        def work():
+            for i in range(500):
+                registry.count_request('query', 200)
+                cache.get('key', i % 2)
+
+        threads = [threading.Thread(target=work) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertIn('rag_requests_total{view="query",code="200"} 4000', registry.render())
+        self.assertEqual({key: cache.stats()[key] for key in ('hits', 'misses')}, {"hits": 2000, "misses": 2000})
+
+
+class WarmupTests(HotwashTestCase):
+
+    def warmup(self, *args):
+        out = StringIO()
+        call_command('warmup', *args, stdout=out)
+        return out.getvalue()
+
+    def test_every_step_is_reported_with_its_time(self):
+        output = self.warmup()
+        for step in warmup.STEPS:
+            self.assertRegex(output, rf'(?m)^{step}: .* in \d+\.\d\ds$')
+        self.assertRegex(output, r'Ready in \d+\.\d\ds')
+
+    def test_missing_table_fails_the_preflight(self):
+        with connection.cursor() as cursor:
+            cursor.execute("ALTER TABLE hotwash_workspace RENAME TO hotwash_workspace_old")
+        with self.assertRaisesMessage(CommandError, '1 schema problem(s)'):
+            self.warmup('--steps', 'schema')
+        self.assertEqual(warmup.check_schema()['problems'], ['hotwash_workspace does not exist'])
+
+    def test_missing_indexes_are_listed(self):
+        facts.create_table()
+        with connection.cursor() as cursor:
+            cursor.execute("DROP INDEX task_facts_summary")
+        self.assertIn('task_facts_summary on task_facts', warmup.check_indexes()['missing'])
+        self.assertIn('advise_indexes --apply', self.warmup('--steps', 'indexes'))
+
+    def test_only_stale_statistics_are_analyzed(self):
+        tables = warmup.hot_tables()
+        self.assertEqual(warmup.stale_statistics(tables), [])
+        with connection.cursor() as cursor:
+            cursor.execute("DELETE FROM sqlite_stat1 WHERE tbl = 'hotwash_sheet'")
+        self.assertEqual([table for table, *_rows in warmup.stale_statistics(tables)], ['hotwash_sheet'])
+        self.assertEqual(len(warmup.analyze(tables)['analyzed']), 1)
+        self.assertEqual(warmup.stale_statistics(tables), [])
+
+    def test_unknown_steps_are_refused(self):
+        with self.assertRaisesMessage(CommandError, 'Unknown step(s) vacuum'):
+            self.warmup('--steps', 'schema,vacuum')
+
+    @override_settings(RAG_RESULT_CACHE={'BACKEND': 'rag_app.result_cache.LocMemResultCache'})
+    def test_frequent_questions_prime_the_caches(self):
+        result_cache.install_triggers()
+        for query in [DETAIL_QUERY] * 3 + [SUMMARY_QUERY] * 2 + ['status of tasks for user 99999999']:
+            QueryHistory.objects.create(query=query, sql_query='', response='[]')
+        self.assertEqual(warmup.frequent_queries(2), [DETAIL_QUERY, SUMMARY_QUERY])
+
+        template_cache.clear()
+        self.assertIn('caches: primed 2 question(s)', self.warmup('--steps', 'caches', '--queries', '2'))
+        self.assertGreater(template_cache.stats()['size'], 0)
+        self.assertEqual(QueryHistory.objects.count(), 6)
+
+        response = self.client.post('/api/query/', {'query': DETAIL_QUERY}, content_type='application/json')
+        self.assertTrue(response.json()['result_cache']['hit'])
+
+    @override_settings(RAG_WARMUP={'ON_START': False})
+    def test_nothing_starts_unless_enabled(self):
+        self.assertIsNone(warmup.start_background())
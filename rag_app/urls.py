@@ -1,9 +1,25 @@
+from django.conf import settings
 from django.urls import path
-from .views import OfflineRAGView, SchemaInfoView, QueryHistoryView
+
+if getattr(settings, 'RAG_ASYNC_VIEWS', False):
+    from .async_views import (
+        AsyncBatchQueryView as BatchQueryView,
+        AsyncOfflineRAGView as OfflineRAGView,
+        AsyncQueryHistoryItemView as QueryHistoryItemView,
+        AsyncQueryHistoryView as QueryHistoryView,
+        AsyncRetrievalView as RetrievalView,
+        AsyncSchemaInfoView as SchemaInfoView,
+    )
+else:
+    from .views import (
+        OfflineRAGView, SchemaInfoView, QueryHistoryView, QueryHistoryItemView, RetrievalView, BatchQueryView,
+    )
 
 urlpatterns = [
     path('query/', OfflineRAGView.as_view(), name='rag_query'),
+    path('query/batch/', BatchQueryView.as_view(), name='rag_query_batch'),
     path('schema/', SchemaInfoView.as_view(), name='schema_info'),
     path('history/', QueryHistoryView.as_view(), name='query_history'),
+    path('history/<int:pk>/', QueryHistoryItemView.as_view(), name='query_history_item'),
+    path('retrieve/', RetrievalView.as_view(), name='retrieve'),
 ]
-
@@ -1,151 +1,301 @@
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status
-from django.db import connection
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from django.http import HttpResponse, StreamingHttpResponse
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+from django.utils.decorators import method_decorator
+from django.views.decorators.http import condition
 from datetime import datetime, timedelta
+import contextlib
 import json
-import re
-from decimal import Decimal
+import time
+from .admission import LaneSaturated, TimeBudget, budget_seconds, get_admission_controller, window_days
+from .coalesce import get_single_flight
+from .db import read_alias, read_connection
+from .facts import facts_available
+from .fts import fts_available
+from .history import get_history_writer, record_query
+from .intent import parse_query
+from .metrics import NULL_TIMER, StageTimer, log_slow_query, registry
 from .models import QueryHistory
+from .pagination import (
+    HISTORY_CURSOR_SALT, cursor_after, decode_cursor, default_page_size, encode_cursor,
+    history_page_size, max_batch_size, max_history_page_size, max_page_size, max_stream_rows,
+    summary_sample_size,
+)
+from .renderers import dumps
+from .result_cache import current_watermark, get_result_cache, make_cache_key
+from .retrieval import RetrievalUnavailable, get_index
+from .rollups import summary_query as rollup_summary_query
+from .rows import plan_rows
+from .schema import schema_registry
+from .shards import (
+    get_shard_executor, get_shard_map, merge_counts, merge_rows, merge_summary, shards_available,
+)
+from .sql_templates import (
+    DATE_CONDITIONS, PreparedQuery, QueryIntent, date_params, get_count_template, get_sql_template,
+    get_shard_template, get_summary_template, get_union_template, resolve_date_window, retrieval_template,
+    summary_intent, template_cache, user_params,
+)
 
 class OfflineRAGView(APIView):
+    metrics_name = 'query'
     
-    def __init__(self):
-        super().__init__()
-        self.schema_info = {
-            'hotwash_rowcell_data': {
-                'columns': ['id', 'sheet_id', 'column_id', 'row_id', 'column_index', 'column_type', 'cell_data', 'cell_date', 'created_at', 'updated_at'],
-                'description': 'Main cell data with tasks and dates'
-            },
-            'hotwash_groups_header': {
-                'columns': ['id', 'name', 'column_type', 'column_index', 'sheet_id', 'group_id'],
-                'description': 'Column headers and types for sheets'
-            },
-            'hotwash_sheet': {
-                'columns': ['id', 'name', 'privacy_type', 'user_id', 'workspace_id'],
-                'description': 'Sheet information'
-            },
-            'hotwash_workspace': {
-                'columns': ['id', 'workspace_name', 'description', 'user_id'],
-                'description': 'Workspace information'
-            },
-            'authentication_user': {
-                'columns': ['id', 'name', 'username', 'email', 'studid'],
-                'description': 'User information'
-            },
-            'hotwash_status_dropdown': {
-                'columns': ['id', 'sheet_id', 'column_id', 'status_text', 'status_color', 'status_type'],
-                'description': 'Status options for cells'
-            }
-        }
-    
-    def generate_sql_query(self, user_query):
-        """Generate SQL query based on user input using rule-based approach"""
-        query_lower = user_query.lower()
-        
-        # Extract user ID or username from query
-        user_id_match = re.search(r'user\s*(?:id\s*)?(\d+)', query_lower)
-        username_match = re.search(r'user\s*(?:name\s*)?"?([a-zA-Z0-9_]+)"?', query_lower)
-        
-        # Extract date information
-        date_keywords = ['today', 'yesterday', 'this week', 'last week', 'past 7 days']
-        date_condition = ""
-        
-        if 'today' in query_lower:
-            date_condition = f"DATE(gcd.cell_date) = DATE('now')"
-        elif 'yesterday' in query_lower:
-            date_condition = f"DATE(gcd.cell_date) = DATE('now', '-1 day')"
-        elif 'past 7 days' in query_lower or 'last week' in query_lower:
-            date_condition = f"DATE(gcd.cell_date) >= DATE('now', '-7 days')"
-        elif 'this week' in query_lower:
-            date_condition = f"DATE(gcd.cell_date) >= DATE('now', 'weekday 0', '-7 days')"
-        else:
-            # Default to past 7 days for context
-            date_condition = f"DATE(gcd.cell_date) >= DATE('now', '-7 days')"
-        
-        # Base query to get name, task, date, status
-        base_query = """
-        SELECT 
-            gcd.id,
-            gcd.cell_data as task,
-            gcd.cell_date as date,
-            gcd.column_type,
-            gcd.column_index,
-            gh.name as column_name,
-            gh.column_type as header_type,
-            hs.name as sheet_name,
-            hw.workspace_name,
-            au.name as user_name,
-            au.username,
-            sd.status_text as status,
-            sd.status_color
-        FROM hotwash_rowcell_data gcd
-        LEFT JOIN hotwash_groups_header gh ON gcd.column_id = gh.id
-        LEFT JOIN hotwash_sheet hs ON gcd.sheet_id = hs.id
-        LEFT JOIN hotwash_workspace hw ON hs.workspace_id = hw.id
-        LEFT JOIN authentication_user au ON hw.user_id = au.id
-        LEFT JOIN hotwash_status_dropdown sd ON (gcd.sheet_id = sd.sheet_id AND gcd.column_id = sd.column_id)
-        WHERE 1=1
+    @property
+    def schema_info(self):
+        return schema_registry.get().schema
+
+    def read_flag(self, data, name):
+        """A boolean option of the request body; raises ValueError unless it is a JSON boolean"""
+        value = data.get(name, False)
+        if not isinstance(value, bool):
+            raise ValueError(f"{name} must be true or false")
+        return value
+
+    def generate_sql_query(self, user_query, ranked=False, cursor=None, page_size=None):
+        """Resolve the query into an intent plus bind parameters and look up its SQL template.
+
+        cursor is a decoded (cell_date, created_at, id, status_id) position to continue after.
         """
+        # User reference and date window (default: past 7 days) from the memoized parser
+        parsed = parse_query(user_query)
+        user_filter, user_value, date_window = parsed.user_filter, parsed.user_value, parsed.date_window
         
-        conditions = []
-        
-        # Add user filtering - search in cell data content for user references
-        if user_id_match:
-            conditions.append(f"(au.id = {user_id_match.group(1)} OR gcd.cell_data LIKE '%user {user_id_match.group(1)}%')")
-        elif username_match:
-            conditions.append(f"(au.username LIKE '%{username_match.group(1)}%' OR gcd.cell_data LIKE '%{username_match.group(1)}%')")
-        
-        # Add date condition
-        if date_condition:
-            conditions.append(date_condition)
+        # Match cell_data mentions through the FTS index when it has been built
+        match_mode = 'like'
+        if user_filter and fts_available():
+            match_mode = 'fts_ranked' if ranked else 'fts'
         
-        # Add conditions to query
-        if conditions:
-            base_query += " AND " + " AND ".join(conditions)
+        # Read the denormalized task_facts table instead of the five-way join when it exists
+        source = 'facts' if facts_available() else 'join'
         
-        base_query += " ORDER BY gcd.cell_date DESC, gcd.created_at DESC LIMIT 50"
+        intent = QueryIntent(user_filter, date_window, match_mode, cursor is not None, source)
+        sql_query, cache_hit = get_sql_template(intent)
+        params = user_params(user_filter, user_value, match_mode) + date_params(date_window)
+        if cursor is not None:
+            params += list(cursor)
+        params.append(page_size or default_page_size())
         
-        return base_query
+        return PreparedQuery(intent, sql_query, params, cache_hit)
+    
+    def summary_query(self, query, intent):
+        """Return (sql, params) aggregating the whole window of a summary question.
+
+        Closed days are read from the daily roll-ups when they cover the window, unless
+        the question is answered from the shards, which the roll-ups aren't built from.
+        """
+        parsed = parse_query(query)
+        group_limit = getattr(settings, 'RAG_SUMMARY_GROUP_LIMIT', 10)
+        rollup = None if shards_available() else rollup_summary_query(intent, parsed.user_value, group_limit)
+        if rollup is not None:
+            return rollup
+        sql_query, _ = get_summary_template(intent)
+        params = user_params(parsed.user_filter, parsed.user_value, summary_intent(intent).match_mode)
+        return sql_query, params + date_params(intent.date_window) + [group_limit] * 3
+    
+    def count_query(self, query, intent):
+        """Return (sql, params) counting the whole window, the answer to questions too expensive to list"""
+        parsed = parse_query(query)
+        sql_query, _ = get_count_template(intent)
+        params = user_params(parsed.user_filter, parsed.user_value, summary_intent(intent).match_mode)
+        return sql_query, params + date_params(intent.date_window)
+    
+    def execute_summary(self, sql_query, params, timer=NULL_TIMER):
+        """Run a summary query and shape it into totals plus per user, workspace and status groups"""
+        try:
+            rows = list(self.iter_query(sql_query, params, timer=timer))
+        except Exception as e:
+            return {"error": str(e)}
+        return self.summarize(rows)
+    
+    def summarize(self, rows):
+        """Shape summary rows into totals plus per user, workspace and status groups"""
+        summary = {"by_user": [], "by_workspace": [], "by_status": []}
+        for row in rows:
+            if row['dimension'] == 'total':
+                summary.update(
+                    tasks=row['tasks'], first_date=row['first_date'], last_date=row['last_date'],
+                    users=row['users'], workspaces=row['workspaces'],
+                )
+            else:
+                summary.setdefault(f"by_{row['dimension']}", []).append({
+                    "name": row['label'], "tasks": row['tasks'],
+                    "first_date": row['first_date'], "last_date": row['last_date'],
+                })
+        return summary
     
-    def execute_query(self, sql_query):
+    def iter_query(self, sql_query, params=None, chunk_size=500, timer=NULL_TIMER):
+        """Yield result rows as JSON serializable dicts, reading the cursor in chunks"""
+        sql_seconds = 0.0
+        with read_connection().cursor() as cursor:
+            started = time.perf_counter()
+            cursor.execute(sql_query, params or [])
+            elapsed = time.perf_counter() - started
+            # Converters are planned once per result shape from the first row
+            plan = None
+            while True:
+                timer.add('sql', elapsed)
+                sql_seconds += elapsed
+                started = time.perf_counter()
+                results = cursor.fetchmany(chunk_size)
+                elapsed = time.perf_counter() - started
+                if not results:
+                    break
+                with timer.stage('convert'):
+                    if plan is None:
+                        plan = plan_rows(cursor.description, results[0])
+                    data = plan.convert(results)
+                yield from data
+        timer.add('sql', elapsed)
+        log_slow_query(sql_query, params, sql_seconds + elapsed)
+    
+    def execute_query(self, sql_query, params=None, timer=NULL_TIMER):
         """Execute SQL query and return results"""
         try:
-            with connection.cursor() as cursor:
-                cursor.execute(sql_query)
-                columns = [col[0] for col in cursor.description]
-                results = cursor.fetchall()
-                
-                # Convert to list of dictionaries with JSON serializable values
-                data = []
-                for row in results:
-                    row_dict = {}
-                    for i, value in enumerate(row):
-                        # Convert date objects to strings for JSON serialization
-                        if hasattr(value, 'strftime'):  # date/datetime objects
-                            row_dict[columns[i]] = value.strftime('%Y-%m-%d') if hasattr(value, 'date') else str(value)
-                        elif isinstance(value, Decimal):
-                            row_dict[columns[i]] = float(value)
-                        else:
-                            row_dict[columns[i]] = value
-                    data.append(row_dict)
-                
-                return data
+            return list(self.iter_query(sql_query, params, timer=timer))
         except Exception as e:
             return {"error": str(e)}
     
-    def generate_response(self, query, data):
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        self.timer = StageTimer(self.metrics_name)
+    
+    def finalize_response(self, request, response, *args, **kwargs):
+        """Render inside the timer and report the stages in a Server-Timing header"""
+        response = super().finalize_response(request, response, *args, **kwargs)
+        timer = getattr(self, 'timer', None)
+        if timer is not None:
+            if not response.streaming:
+                with timer.stage('render'):
+                    response.render()
+            response['Server-Timing'] = timer.server_timing()
+            timer.finish(response.status_code)
+        return response
+    
+    def stream_rows(self, query, prepared, page_size, estimate=None):
+        """NDJSON lines: a meta line, one line per row, then a summary with the next cursor.
+
+        With an estimate from admission control, a rejected stream sends only the count of
+        matching rows, and an expensive one holds a slot in the expensive lane and runs on
+        a time budget for as long as it streams; running out of budget ends it with the
+        count and a cursor to continue from.
+        """
+        controller = get_admission_controller() if estimate is not None else None
+        admission = dict(estimate.describe(), degraded=None) if estimate is not None else None
+        meta = {
+            "query": query,
+            "sql_query": prepared.sql,
+            "sql_params": prepared.params,
+            "timestamp": datetime.now().isoformat(),
+        }
+        if admission is not None:
+            meta["admission"] = admission
+        yield dumps({"meta": meta}) + b"\n"
+        
+        count = 0
+        last_row = None
+        sample = []
+        budget = None
+        if admission is not None and estimate.verdict == 'rejected':
+            admission['degraded'] = 'rejected'
+        else:
+            expensive = admission is not None and estimate.verdict == 'expensive'
+            lane = controller.expensive_lane() if expensive else contextlib.nullcontext()
+            try:
+                with lane:
+                    with TimeBudget(budget_seconds()) if expensive else contextlib.nullcontext() as budget:
+                        for row in self.iter_query(prepared.sql, prepared.params):
+                            count += 1
+                            last_row = row
+                            if len(sample) < default_page_size():
+                                sample.append(row)
+                            yield dumps({"row": row}) + b"\n"
+            except LaneSaturated as e:
+                yield dumps({"error": f"Server busy: {e}"}) + b"\n"
+                return
+            except Exception as e:
+                if budget is None or not budget.expired:
+                    yield dumps({"error": str(e)}) + b"\n"
+                    return
+                admission['degraded'] = 'budget'
+        
+        summary = None
+        if admission is not None and admission['degraded']:
+            controller.count_degraded(admission['degraded'])
+            summary = self.count_only(query, prepared.intent, NULL_TIMER)
+            next_cursor = cursor_after(last_row) if last_row is not None else None
+            detail = summary["error"] if "error" in summary else self.generate_response(query, [], summary)
+            response_text = f"Streamed {count} task records before stopping.\n{detail}"
+        else:
+            next_cursor = cursor_after(last_row) if count == page_size else None
+            response_text = f"Streamed {count} task records."
+        record_query(query=query, sql_query=prepared.sql, response=response_text, data_fetched=sample)
+        line = {
+            "count": count,
+            "response": response_text,
+            "next_cursor": next_cursor,
+        }
+        if admission is not None:
+            line.update(admission=admission, count_only=summary)
+        yield dumps({"summary": line}) + b"\n"
+    
+    def retrieve(self, query, date_window=None, k=None):
+        """Pick rows with the retrieval index and fetch them through the usual join, best first.
+
+        Returns (hits, sql, params, data, admission); raises RetrievalUnavailable when there
+        is no index. Fetching the rows is admitted like /query/: when it is rejected or runs
+        out of budget, data is empty and only the hits are returned. admission is None when
+        admission control is off.
+        """
+        start, end = resolve_date_window(date_window) if date_window else (None, None)
+        timer = getattr(self, 'timer', NULL_TIMER)
+        with timer.stage('search'):
+            hits = get_index().search(query, k or default_page_size(), start, end)
+        params = [json.dumps([row_id for row_id, _score in hits])]
+        sql_query = retrieval_template('facts' if facts_available() else 'join')
+        controller = get_admission_controller()
+        admission = None
+        if controller is None:
+            data = self.execute_query(sql_query, params, timer=timer)
+        else:
+            with timer.stage('admit'):
+                estimate = controller.estimate([(sql_query, params)])
+            admission = dict(estimate.describe(), degraded=None)
+            if estimate.verdict == 'cheap':
+                data = self.execute_query(sql_query, params, timer=timer)
+            elif estimate.verdict == 'expensive':
+                with controller.expensive_lane(), TimeBudget(budget_seconds()) as budget:
+                    data = self.execute_query(sql_query, params, timer=timer)
+                if budget.expired:
+                    admission['degraded'] = 'budget'
+            else:
+                admission['degraded'] = 'rejected'
+            if admission['degraded']:
+                controller.count_degraded(admission['degraded'])
+                data = []
+        if isinstance(data, list):
+            rank = {row_id: position for position, (row_id, _score) in enumerate(hits)}
+            data.sort(key=lambda row: rank[row['id']])
+        return hits, sql_query, params, data, admission
+    
+    def generate_response(self, query, data, summary=None):
         """Generate human-readable response focused on name, task, date, status"""
         if isinstance(data, dict) and "error" in data:
             return f"Error executing query: {data['error']}"
         
+        if summary is not None and "error" not in summary:
+            return self.summary_response(data, summary)
+        
         if not data:
             return "No data found for the specified query."
         
-        query_lower = query.lower()
         response_parts = []
         
-        if 'status' in query_lower or 'what' in query_lower:
+        if parse_query(query).style == 'detail':
             response_parts.append("Tasks and Activities:")
             
             for i, row in enumerate(data[:10]):  # Limit to 10 records
@@ -191,102 +341,723 @@ class OfflineRAGView(APIView):
         
         return "\n".join(response_parts)
     
+    def summary_response(self, data, summary):
+        """Describe a whole window from its aggregates, with a few of the fetched rows as samples"""
+        if not summary['tasks']:
+            return "No data found for the specified query."
+        
+        if summary.get('count_only'):
+            return "\n".join([
+                f"Found {summary['tasks']} task records.",
+                f"Date range: {summary['first_date']} to {summary['last_date']}",
+                "Listing them is too expensive right now, so only the count is shown. "
+                "Name a user or a shorter date window to see the tasks.",
+            ])
+        
+        response_parts = [f"Found {summary['tasks']} task records."]
+        response_parts.append(f"Date range: {summary['first_date']} to {summary['last_date']}")
+        
+        for label, groups, total in (
+            ("Users", summary['by_user'], summary['users']),
+            ("Workspaces", summary['by_workspace'], summary['workspaces']),
+        ):
+            names = [group['name'] for group in groups if group['name']]
+            if names:
+                more = f" and {total - len(names)} more" if total > len(names) else ""
+                response_parts.append(f"{label}: {', '.join(names)}{more}")
+        statuses = [f"{group['name']} ({group['tasks']})" for group in summary['by_status'] if group['name']]
+        if statuses:
+            response_parts.append(f"Statuses: {', '.join(statuses)}")
+        # Only summaries read from the daily roll-ups count tasks by text
+        top_tasks = [f"{group['name']} ({group['tasks']})" for group in summary.get('by_task', [])[:5]]
+        if top_tasks:
+            response_parts.append(f"Top tasks: {', '.join(top_tasks)}")
+        
+        response_parts.append("\nSample tasks:")
+        for i, row in enumerate(data[:3]):
+            task = row.get('task', 'No task')
+            date = row.get('date', 'No date')
+            status = row.get('status', 'No status')
+            response_parts.append(f"  {i+1}. {date}: {task} [{status}]")
+        
+        return "\n".join(response_parts)
+    
+    def run_statements(self, query, prepared, summary_sql, timer, budget=None):
+        """Run the row query and, when summary_sql is given, the summary aggregates"""
+        if shards_available():
+            return self.run_sharded(query, prepared, summary_sql, timer, budget)
+        data = self.execute_query(prepared.sql, prepared.params, timer=timer)
+        summary = None
+        if summary_sql is not None and isinstance(data, list):
+            summary = self.execute_summary(*summary_sql, timer=timer)
+        return data, summary
+    
+    def run_sharded(self, query, prepared, summary_sql, timer, budget=None):
+        """run_statements over the shard files the question can touch, in parallel, merging their results"""
+        targets = get_shard_map().targets(prepared.intent, parse_query(query).user_value)
+        executor = get_shard_executor()
+        ranked = prepared.intent.user_filter is not None and prepared.intent.match_mode == 'fts_ranked'
+        try:
+            with timer.stage('sql'):
+                sql_query, _ = get_shard_template(prepared.intent)
+                pages = executor.scatter(sql_query, prepared.params, targets, budget)
+            with timer.stage('merge'):
+                data = merge_rows(pages, prepared.params[-1], ranked)
+            summary = None
+            if summary_sql is not None:
+                with timer.stage('sql'):
+                    parts = executor.scatter(*summary_sql, targets, budget)
+                with timer.stage('merge'):
+                    summary = self.summarize(merge_summary(parts, summary_sql[1][-1]))
+        except Exception as e:
+            return {"error": str(e)}, None
+        return data, summary
+    
+    def count_only(self, query, intent, timer):
+        """Count the window's rows within the count budget, in place of listing them"""
+        with TimeBudget(budget_seconds('COUNT_BUDGET')) as budget:
+            if shards_available():
+                targets = get_shard_map().targets(intent, parse_query(query).user_value)
+                try:
+                    with timer.stage('sql'):
+                        parts = get_shard_executor().scatter(*self.count_query(query, intent), targets, budget)
+                    rows = merge_counts(parts)
+                except Exception as e:
+                    rows = {"error": str(e)}
+            else:
+                rows = self.execute_query(*self.count_query(query, intent), timer=timer)
+        if budget.expired:
+            return {"error": "Even counting the matching tasks took too long; narrow the question"}
+        if isinstance(rows, dict):
+            return rows
+        return dict(rows[0], count_only=True)
+    
+    def estimate_cost(self, prepared, summary_sql):
+        """Admission control's estimate for the row query and summary aggregates, or None when it is off"""
+        controller = get_admission_controller()
+        if controller is None:
+            return None
+        statements = [(prepared.sql, prepared.params)] + ([summary_sql] if summary_sql else [])
+        with self.timer.stage('admit'):
+            return controller.estimate(statements, window_days(prepared.intent.date_window))
+    
+    def compute_result(self, query, prepared, summary_mode, estimate=None):
+        """Run the row query (and the summary aggregates) and describe them.
+
+        Returns (data, summary, response, admission); admission is None when admission
+        control is off. Statements estimated to be expensive run in the expensive lane on
+        a time budget; rejected ones, and ones that run out of budget, are answered with a
+        count of the matching rows only. estimate is one the caller already made.
+        """
+        timer = self.timer
+        summary_sql = self.summary_query(query, prepared.intent) if summary_mode else None
+        controller = get_admission_controller()
+        admission = None
+        if controller is None:
+            data, summary = self.run_statements(query, prepared, summary_sql, timer)
+        else:
+            if estimate is None:
+                estimate = self.estimate_cost(prepared, summary_sql)
+            admission = dict(estimate.describe(), degraded=None)
+            if estimate.verdict == 'cheap':
+                data, summary = self.run_statements(query, prepared, summary_sql, timer)
+            elif estimate.verdict == 'expensive':
+                started = time.perf_counter()
+                with controller.expensive_lane():
+                    timer.add('admit', time.perf_counter() - started)
+                    with TimeBudget(budget_seconds()) as budget:
+                        data, summary = self.run_statements(query, prepared, summary_sql, timer, budget)
+                if budget.expired:
+                    admission['degraded'] = 'budget'
+            else:
+                admission['degraded'] = 'rejected'
+            if admission['degraded']:
+                controller.count_degraded(admission['degraded'])
+                data, summary = [], self.count_only(query, prepared.intent, timer)
+                if "error" in summary:
+                    data, summary = summary, None
+        
+        with timer.stage('respond'):
+            response_text = self.generate_response(query, data, summary)
+        return data, summary, response_text, admission
+    
+    def answer(self, query, prepared, summary_mode, cursor_token=None, page_size=None, estimate=None):
+        """(data, summary, response text, admission, cached, coalesced) for one page of a question.
+
+        Served from the result cache while the data watermark is unchanged, and shared
+        with an identical question already running in another request.
+        """
+        timer = self.timer
+        result_cache = get_result_cache()
+        single_flight = get_single_flight()
+        cached = watermark = cache_key = None
+        if result_cache is not None or single_flight is not None:
+            cache_key = make_cache_key(
+                query, prepared.intent, resolve_date_window(prepared.intent.date_window),
+                cursor_token, page_size,
+            )
+        if result_cache is not None:
+            with timer.stage('cache'):
+                watermark = current_watermark()
+                if watermark is not None:
+                    cached = result_cache.get(cache_key, watermark)
+        
+        coalesced = False
+        admission = None
+        if cached is not None:
+            data, response_text = cached['data_fetched'], cached['response']
+            summary = cached.get('summary')
+        else:
+            def compute():
+                return self.compute_result(query, prepared, summary_mode, estimate)
+            
+            # Identical questions already running in another request share its result
+            if single_flight is not None:
+                started = time.perf_counter()
+                (data, summary, response_text, admission), coalesced = single_flight.do(cache_key, compute)
+                if coalesced:
+                    timer.add('coalesce', time.perf_counter() - started)
+            else:
+                data, summary, response_text, admission = compute()
+            
+            # Count-only answers depend on load, so they aren't cached
+            degraded = admission is not None and admission['degraded']
+            if (watermark is not None and not coalesced and not degraded
+                    and not (isinstance(data, dict) and "error" in data)):
+                result_cache.set(cache_key, watermark, {
+                    "data_fetched": data, "response": response_text, "summary": summary,
+                })
+        
+        return data, summary, response_text, admission, cached is not None, coalesced
+    
     def post(self, request):
         try:
             query = request.data.get('query', '')
+            cursor_token = request.data.get('cursor') or None
             
-            if not query:
+            if not query or not isinstance(query, str):
                 return Response(
                     {"error": "Query parameter is required"}, 
                     status=status.HTTP_400_BAD_REQUEST
                 )
+            try:
+                ranked = self.read_flag(request.data, 'ranked')
+                retrieval = self.read_flag(request.data, 'retrieval')
+                stream = self.read_flag(request.data, 'stream')
+            except ValueError as e:
+                return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+            
+            # The first page of a summary question is answered by aggregates plus a small sample
+            summary_mode = (
+                parse_query(query).style == 'summary' and not cursor_token and not stream and not retrieval
+            )
+            
+            # Page size defaults to 50 rows (the sample size for summaries), or to the stream bound when streaming
+            limit = max_stream_rows() if stream else max_page_size()
+            if stream:
+                default_size = limit
+            else:
+                default_size = summary_sample_size() if summary_mode else default_page_size()
+            try:
+                page_size = int(request.data.get('page_size') or default_size)
+            except (TypeError, ValueError):
+                page_size = 0
+            if not 1 <= page_size <= limit:
+                return Response(
+                    {"error": f"page_size must be between 1 and {limit}"},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+            
+            cursor = None
+            if cursor_token:
+                if ranked:
+                    return Response(
+                        {"error": "cursor cannot be combined with ranked matching"},
+                        status=status.HTTP_400_BAD_REQUEST
+                    )
+                try:
+                    cursor = decode_cursor(cursor_token)
+                except ValueError as e:
+                    return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
             
             # Generate SQL query
-            sql_query = self.generate_sql_query(query)
+            timer = self.timer
+            with timer.stage('parse'):
+                prepared = self.generate_sql_query(query, ranked=ranked, cursor=cursor, page_size=page_size)
+            sql_query = prepared.sql
             
-            # Execute query
-            data = self.execute_query(sql_query)
+            if retrieval:
+                return self.retrieval_response(query, prepared.intent.date_window, page_size)
             
-            # Generate response
-            response_text = self.generate_response(query, data)
+            if stream:
+                # Streams are admitted like pages: estimated here, gated while they run
+                return StreamingHttpResponse(
+                    self.stream_rows(query, prepared, page_size, self.estimate_cost(prepared, None)),
+                    content_type='application/x-ndjson'
+                )
             
-            # Save to history
-            QueryHistory.objects.create(
-                query=query,
-                sql_query=sql_query,
-                response=response_text,
-                data_fetched=data if not isinstance(data, dict) or "error" not in data else {}
+            # Serve repeated questions from the result cache while the data watermark is unchanged
+            data, summary, response_text, admission, cached, coalesced = self.answer(
+                query, prepared, summary_mode, cursor_token, page_size,
             )
+            result_cache = get_result_cache()
+            
+            # With the window's total known, a sample that covers the whole window has no next page
+            more = summary is None or "error" in summary or summary['tasks'] > page_size
+            next_cursor = None
+            if isinstance(data, list) and len(data) == page_size and not ranked and more:
+                with timer.stage('paginate'):
+                    next_cursor = cursor_after(data[-1], shards_available())
+            
+            # Save to history; queued for the background writer so the response doesn't wait
+            with timer.stage('history'):
+                record_query(
+                    query=query,
+                    sql_query=sql_query,
+                    response=response_text,
+                    data_fetched=data if not isinstance(data, dict) or "error" not in data else {}
+                )
             
             return Response({
                 "query": query,
                 "sql_query": sql_query,
+                "sql_params": prepared.params,
+                "sql_cache": dict(template_cache.stats(), hit=prepared.cache_hit),
+                "result_cache": dict(result_cache.stats(), hit=cached) if result_cache else None,
+                "coalesced": coalesced,
+                "admission": admission,
                 "response": response_text,
+                "summary": summary,
                 "data_fetched": data,
+                "next_cursor": next_cursor,
                 "timestamp": datetime.now().isoformat()
             })
             
+        except LaneSaturated as e:
+            return Response(
+                {"error": f"Server busy: {e}"},
+                status=status.HTTP_503_SERVICE_UNAVAILABLE,
+                headers={'Retry-After': '1'},
+            )
         except Exception as e:
             return Response(
                 {"error": f"Internal server error: {str(e)}"}, 
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
             )
 
+    def retrieval_response(self, query, date_window, k):
+        """Answer /query/ from the rows the retrieval index ranks highest instead of the regex filters"""
+        try:
+            hits, sql_query, params, data, admission = self.retrieve(query, date_window, k)
+        except RetrievalUnavailable as e:
+            return Response({"error": str(e)}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+        
+        response_text = self.generate_response(query, data)
+        record_query(
+            query=query,
+            sql_query=sql_query,
+            response=response_text,
+            data_fetched=data if not isinstance(data, dict) or "error" not in data else {}
+        )
+        return Response({
+            "query": query,
+            "sql_query": sql_query,
+            "sql_params": params,
+            "retrieval_hits": [{"id": row_id, "score": score} for row_id, score in hits],
+            "admission": admission,
+            "response": response_text,
+            "data_fetched": data,
+            "timestamp": datetime.now().isoformat()
+        })
+
+class RetrievalView(OfflineRAGView):
+    """View to rank hotwash cells against free text with the offline retrieval index"""
+    metrics_name = 'retrieve'
+    
+    def post(self, request):
+        query = request.data.get('query', '')
+        date_window = request.data.get('date_window') or None
+        
+        if not query or not isinstance(query, str):
+            return Response(
+                {"error": "Query parameter is required"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        if date_window is not None and date_window not in DATE_CONDITIONS:
+            return Response(
+                {"error": f"date_window must be one of {', '.join(DATE_CONDITIONS)}"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        try:
+            k = int(request.data.get('k') or 10)
+        except (TypeError, ValueError):
+            k = 0
+        if not 1 <= k <= max_page_size():
+            return Response(
+                {"error": f"k must be between 1 and {max_page_size()}"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        try:
+            hits, _sql, _params, data, admission = self.retrieve(query, date_window, k)
+            index_stats = get_index().stats()
+        except RetrievalUnavailable as e:
+            return Response({"error": str(e)}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+        except LaneSaturated as e:
+            return Response(
+                {"error": f"Server busy: {e}"},
+                status=status.HTTP_503_SERVICE_UNAVAILABLE,
+                headers={'Retry-After': '1'},
+            )
+        
+        return Response({
+            "query": query,
+            "hits": [{"id": row_id, "score": score} for row_id, score in hits],
+            "admission": admission,
+            "data_fetched": data,
+            "index": index_stats
+        })
+
+class BatchQueryView(OfflineRAGView):
+    """View to answer the questions a dashboard asks at once in one request.
+
+    Questions that resolve to the same SQL and parameters run once, distinct
+    bindings of one template are merged into a single UNION ALL statement, and
+    everything runs in one read transaction so the answers agree with each other.
+    Admission control classifies each distinct question first: only cheap ones are
+    merged, the others are answered as /query/ answers them, in the expensive lane on
+    a time budget or with a count only. When the shards are in use every distinct
+    question is answered that way, scattered over the shards and shared with identical
+    running requests.
+    """
+    metrics_name = 'batch'
+    
+    def parse_item(self, item):
+        """Return (query, page_size, ranked, error) for one entry of queries"""
+        if isinstance(item, str):
+            item = {"query": item}
+        if not isinstance(item, dict):
+            return None, None, False, "Each item must be a query string or an object with a query"
+        query = item.get('query', '')
+        if not query or not isinstance(query, str):
+            return query, None, False, "Query parameter is required"
+        summary_mode = parse_query(query).style == 'summary'
+        try:
+            page_size = int(item.get('page_size') or (summary_sample_size() if summary_mode else default_page_size()))
+        except (TypeError, ValueError):
+            page_size = 0
+        if not 1 <= page_size <= max_page_size():
+            return query, None, False, f"page_size must be between 1 and {max_page_size()}"
+        try:
+            ranked = self.read_flag(item, 'ranked')
+        except ValueError as e:
+            return query, None, False, str(e)
+        return query, page_size, ranked, None
+    
+    def group_lead(self, group):
+        """The entry to ask for a group sharing one (sql, params): a summary question when there is one"""
+        return next((entry for entry in group if entry["summary_mode"]), group[0])
+    
+    def estimate_group(self, group):
+        """Admission control's estimate for the statements a group needs, or None when it is off"""
+        lead = self.group_lead(group)
+        summary_sql = self.summary_query(lead["query"], lead["prepared"].intent) if lead["summary_mode"] else None
+        return self.estimate_cost(lead["prepared"], summary_sql)
+    
+    def answer_group(self, group, estimate=None):
+        """Answer the entries that share one (sql, params) through answer(), like /query/.
+
+        Returns the number of statements run.
+        """
+        lead = self.group_lead(group)
+        started = time.perf_counter()
+        try:
+            data, summary, _response, admission, _cached, coalesced = self.answer(
+                lead["query"], lead["prepared"], lead["summary_mode"], None, lead["page_size"], estimate,
+            )
+        except LaneSaturated as e:
+            data, summary, admission, coalesced = {"error": f"Server busy: {e}"}, None, None, False
+        elapsed_ms = round((time.perf_counter() - started) * 1000, 3)
+        degraded = admission is not None and admission['degraded']
+        for position, entry in enumerate(group):
+            entry.update(
+                data=data, summary=summary if entry["summary_mode"] or degraded else None,
+                admission=admission, coalesced=coalesced, elapsed_ms=elapsed_ms, merged=1,
+                deduplicated=position > 0,
+            )
+        if coalesced:
+            return 0
+        return 2 if lead["summary_mode"] and not degraded else 1
+    
+    def run_template(self, sql_query, bindings):
+        """Execute distinct bindings of one template; returns one result per binding"""
+        if len(bindings) == 1:
+            return [self.execute_query(sql_query, bindings[0], timer=self.timer)]
+        union_sql, _ = get_union_template(sql_query, len(bindings))
+        merged_params = [param for params in bindings for param in params]
+        results = [[] for _ in bindings]
+        try:
+            for row in self.iter_query(union_sql, merged_params, timer=self.timer):
+                results[row.pop('batch_slot')].append(row)
+        except Exception:
+            # Run them one by one so an error is reported against the item that caused it
+            return [self.execute_query(sql_query, params, timer=self.timer) for params in bindings]
+        return results
+    
+    def post(self, request):
+        items = request.data.get('queries')
+        if not isinstance(items, list) or not items:
+            return Response(
+                {"error": "queries must be a non-empty list"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        if len(items) > max_batch_size():
+            return Response(
+                {"error": f"A batch may contain at most {max_batch_size()} queries"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        started = time.perf_counter()
+        result_cache = get_result_cache()
+        watermark = current_watermark() if result_cache is not None else None
+        
+        results = [None] * len(items)
+        entries = []
+        # (sql, params) -> entries that need exactly that result
+        distinct = {}
+        for index, item in enumerate(items):
+            query, page_size, ranked, error = self.parse_item(item)
+            if error:
+                results[index] = {"query": query, "error": error}
+                continue
+            prepared = self.generate_sql_query(query, ranked=ranked, page_size=page_size)
+            entry = {"index": index, "query": query, "prepared": prepared, "page_size": page_size,
+                     "ranked": ranked, "summary_mode": parse_query(query).style == 'summary',
+                     "cache_key": None, "cached": None}
+            if watermark is not None:
+                entry["cache_key"] = make_cache_key(
+                    query, prepared.intent, resolve_date_window(prepared.intent.date_window),
+                    None, page_size,
+                )
+                entry["cached"] = result_cache.get(entry["cache_key"], watermark)
+            entries.append(entry)
+            if entry["cached"] is None:
+                distinct.setdefault((prepared.sql, tuple(prepared.params)), []).append(entry)
+        
+        # Questions answered one by one as /query/ answers them: all of them on the shards,
+        # otherwise the ones admission control doesn't class as cheap
+        estimates = {}
+        if shards_available():
+            separate = list(distinct)
+        else:
+            for key, group in distinct.items():
+                estimate = estimates[key] = self.estimate_group(group)
+                if estimate is not None:
+                    for entry in group:
+                        entry["admission"] = dict(estimate.describe(), degraded=None)
+            separate = [
+                key for key, estimate in estimates.items() if estimate is not None and estimate.verdict != 'cheap'
+            ]
+        
+        # The other distinct bindings grouped by template, merged at most RAG_BATCH_MERGE_LIMIT at a time
+        by_template = {}
+        for sql_query, params in distinct:
+            if (sql_query, params) not in separate:
+                by_template.setdefault(sql_query, []).append(list(params))
+        merge_limit = getattr(settings, 'RAG_BATCH_MERGE_LIMIT', 16)
+        
+        statements = 0
+        with transaction.atomic(using=read_alias()):
+            for key in separate:
+                statements += self.answer_group(distinct[key], estimates.get(key))
+            
+            for sql_query, bindings in by_template.items():
+                for offset in range(0, len(bindings), merge_limit):
+                    chunk = bindings[offset:offset + merge_limit]
+                    statement_started = time.perf_counter()
+                    chunk_results = self.run_template(sql_query, chunk)
+                    elapsed_ms = round((time.perf_counter() - statement_started) * 1000, 3)
+                    statements += 1
+                    for params, data in zip(chunk, chunk_results):
+                        for position, entry in enumerate(distinct[(sql_query, tuple(params))]):
+                            entry.update(data=data, elapsed_ms=elapsed_ms, merged=len(chunk),
+                                         deduplicated=position > 0)
+            
+            # Summary questions also get their window aggregates, once per distinct (sql, params)
+            summaries = {}
+            for entry in entries:
+                if entry["cached"] is not None or not entry["summary_mode"] or "summary" in entry:
+                    continue
+                if isinstance(entry["data"], dict):
+                    continue
+                sql_query, params = self.summary_query(entry["query"], entry["prepared"].intent)
+                key = (sql_query, tuple(params))
+                if key not in summaries:
+                    statement_started = time.perf_counter()
+                    summaries[key] = self.execute_summary(sql_query, params, timer=self.timer)
+                    entry["elapsed_ms"] = entry.get("elapsed_ms", 0.0) + round((time.perf_counter() - statement_started) * 1000, 3)
+                    statements += 1
+                entry["summary"] = summaries[key]
+            
+            for entry in entries:
+                query, prepared, cached = entry["query"], entry["prepared"], entry["cached"]
+                if cached is not None:
+                    data, response_text = cached['data_fetched'], cached['response']
+                    summary = cached.get('summary')
+                else:
+                    data, summary = entry["data"], entry.get("summary")
+                    response_text = self.generate_response(query, data, summary)
+                    # Count-only answers depend on load, so they aren't cached
+                    degraded = entry.get("admission") is not None and entry["admission"]['degraded']
+                    if (entry["cache_key"] is not None and not degraded
+                            and not (isinstance(data, dict) and "error" in data)):
+                        result_cache.set(entry["cache_key"], watermark, {
+                            "data_fetched": data, "response": response_text, "summary": summary,
+                        })
+                
+                failed = isinstance(data, dict) and "error" in data
+                more = summary is None or "error" in summary or summary['tasks'] > entry["page_size"]
+                next_cursor = None
+                if not failed and len(data) == entry["page_size"] and not entry["ranked"] and more:
+                    next_cursor = cursor_after(data[-1], shards_available())
+                
+                record_query(
+                    query=query,
+                    sql_query=prepared.sql,
+                    response=response_text,
+                    data_fetched={} if failed else data
+                )
+                results[entry["index"]] = {
+                    "query": query,
+                    "response": response_text,
+                    "summary": summary,
+                    "data_fetched": data,
+                    "next_cursor": next_cursor,
+                    "admission": entry.get("admission"),
+                    "error": data["error"] if failed else None,
+                    "timing": {
+                        "cached": cached is not None,
+                        "coalesced": entry.get("coalesced", False),
+                        "deduplicated": entry.get("deduplicated", False),
+                        "merged": entry.get("merged", 0),
+                        "elapsed_ms": entry.get("elapsed_ms", 0.0),
+                    },
+                }
+        
+        return Response({
+            "results": results,
+            "distinct": len(distinct),
+            "statements": statements,
+            "elapsed_ms": round((time.perf_counter() - started) * 1000, 3),
+            "timestamp": datetime.now().isoformat()
+        })
+
 class SchemaInfoView(APIView):
     """View to get database schema information"""
     
+    @method_decorator(condition(
+        etag_func=lambda request: schema_registry.get().etag,
+        last_modified_func=lambda request: schema_registry.get().loaded_at,
+    ))
     def get(self, request):
-        schema_info = {
-            'hotwash_rowcell_data': {
-                'columns': ['id', 'sheet_id', 'column_id', 'row_id', 'column_index', 'column_type', 'cell_data', 'cell_date', 'created_at', 'updated_at'],
-                'description': 'Main cell data with tasks and dates'
-            },
-            'hotwash_groups_header': {
-                'columns': ['id', 'name', 'column_type', 'column_index', 'sheet_id', 'group_id'],
-                'description': 'Column headers and types for sheets'
-            },
-            'hotwash_sheet': {
-                'columns': ['id', 'name', 'privacy_type', 'user_id', 'workspace_id'],
-                'description': 'Sheet information'
-            },
-            'hotwash_workspace': {
-                'columns': ['id', 'workspace_name', 'description', 'user_id'],
-                'description': 'Workspace information'
-            },
-            'authentication_user': {
-                'columns': ['id', 'name', 'username', 'email', 'studid'],
-                'description': 'User information'
-            },
-            'hotwash_status_dropdown': {
-                'columns': ['id', 'sheet_id', 'column_id', 'status_text', 'status_color', 'status_type'],
-                'description': 'Status options for cells'
-            }
-        }
-        
+        snapshot = schema_registry.get()
         return Response({
-            "schema": schema_info,
+            "schema": snapshot.schema,
+            "schema_version": snapshot.version,
             "description": "Database schema information for RAG queries"
         })
 
 class QueryHistoryView(APIView):
-    """View to get query history"""
+    """View to get query history, newest first.
+
+    Query parameters: limit, cursor (next_cursor of the previous page), since and
+    until (ISO dates or datetimes, until exclusive) and prefix (start of the query text).
+    """
+    
+    def parse_time(self, value):
+        parsed = parse_datetime(value)
+        if parsed is None:
+            day = parse_date(value)
+            if day is None:
+                raise ValueError(f"Invalid date or datetime: {value!r}")
+            parsed = datetime.combine(day, datetime.min.time())
+        if timezone.is_naive(parsed):
+            parsed = timezone.make_aware(parsed)
+        return parsed
     
     def get(self, request):
-        history = QueryHistory.objects.all().order_by('-created_at')[:20]
-        history_data = []
-        
-        for item in history:
-            history_data.append({
-                "id": item.id,
-                "query": item.query,
-                "sql_query": item.sql_query,
-                "response": item.response,
-                "created_at": item.created_at.isoformat()
-            })
+        params = request.query_params
+        try:
+            limit = int(params.get('limit') or history_page_size())
+        except (TypeError, ValueError):
+            limit = 0
+        if not 1 <= limit <= max_history_page_size():
+            return Response(
+                {"error": f"limit must be between 1 and {max_history_page_size()}"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        history = QueryHistory.objects.order_by('-created_at', '-id')
+        try:
+            if params.get('since'):
+                history = history.filter(created_at__gte=self.parse_time(params['since']))
+            if params.get('until'):
+                history = history.filter(created_at__lt=self.parse_time(params['until']))
+            if params.get('cursor'):
+                created_at, last_id = decode_cursor(params['cursor'], salt=HISTORY_CURSOR_SALT, size=2)
+                created_at = self.parse_time(created_at)
+                history = history.filter(Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=last_id))
+        except ValueError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        if params.get('prefix'):
+            history = history.filter(query__startswith=params['prefix'])
         
+        # Only the listed columns; data_fetched stays in its payload until /history/<id>/ asks for it
+        rows = list(history.values(
+            'id', 'query', 'sql_query', 'response', 'created_at', 'payload_id',
+        )[:limit + 1])
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            last = rows[-1]
+            next_cursor = encode_cursor([last['created_at'].isoformat(), last['id']], salt=HISTORY_CURSOR_SALT)
+        
+        history_data = [{
+            "id": row['id'],
+            "query": row['query'],
+            "sql_query": row['sql_query'],
+            "response": row['response'],
+            "has_data": row['payload_id'] is not None,
+            "created_at": row['created_at'].isoformat()
+        } for row in rows]
+        
+        writer = get_history_writer()
         return Response({
             "history": history_data,
-            "count": len(history_data)
+            "count": len(history_data),
+            "next_cursor": next_cursor,
+            "writer": writer.stats() if writer else None
         })
 
-# Create your views here.
+class QueryHistoryItemView(APIView):
+    """View to get one history entry together with the rows it fetched"""
+    
+    def get(self, request, pk):
+        item = QueryHistory.objects.select_related('payload').filter(pk=pk).first()
+        if item is None:
+            return Response({"error": "History entry not found"}, status=status.HTTP_404_NOT_FOUND)
+        return Response({
+            "id": item.id,
+            "query": item.query,
+            "sql_query": item.sql_query,
+            "response": item.response,
+            "data_fetched": item.data_fetched,
+            "created_at": item.created_at.isoformat()
+        })
+
+
+class MetricsView(APIView):
+    """Request and stage metrics of this process in the Prometheus text format"""
+    
+    def get(self, request):
+        return HttpResponse(registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -0,0 +1,208 @@
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.db import DatabaseError, connection
+from django.db.models import Count
+
+from .db import read_connection
+from .facts import COLUMNS as FACTS_COLUMNS, FACTS_TABLE, INDEXES as FACTS_INDEXES
+from .fts import FTS_TABLE
+from .indexes import existing_indexes, missing_indexes
+from .intent import parse_query
+from .metrics import NULL_TIMER
+from .models import QueryHistory
+from .pagination import default_page_size, summary_sample_size
+from .rollups import ROLLUP_DAYS_TABLE, ROLLUP_TABLE, ROLLUP_TASKS_TABLE
+from .schema import schema_registry
+from .views import OfflineRAGView
+
+logger = logging.getLogger(__name__)
+
+# Preflight and warm-up, in the order they run. After a deploy the SQLite page cache
+# is cold and every template, plan and result cache is empty; these steps check the
+# database the views need and load what the first requests would otherwise pay for.
+STEPS = ('schema', 'indexes', 'analyze', 'pages', 'caches')
+# Steps run in each server process on start (RAG_WARMUP['ON_START']); checks and
+# ANALYZE write nothing a process keeps, so they are left to manage.py warmup
+STARTUP_STEPS = ('pages', 'caches')
+
+# Tables besides the hotwash ones whose pages and statistics the views read
+HOT_TABLES = (FACTS_TABLE, f'{FTS_TABLE}_data', f'{FTS_TABLE}_idx', f'{FTS_TABLE}_docsize',
+              ROLLUP_TABLE, ROLLUP_TASKS_TABLE, ROLLUP_DAYS_TABLE)
+# sqlite_stat1 is stale when a table's row count moved by more than this share since ANALYZE
+STALE_STATS_FRACTION = 0.1
+
+
+def table_names():
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT name FROM sqlite_master WHERE type = 'table'")
+        return {row[0] for row in cursor.fetchall()}
+
+
+def hot_tables():
+    """Tables the views read that exist in this database"""
+    existing = table_names()
+    return [table for table in [*schema_registry.tables, *HOT_TABLES] if table in existing]
+
+
+def check_schema():
+    """Problems with the tables and columns the views read; also reloads the schema registry"""
+    schema_registry.invalidate()
+    snapshot = schema_registry.get()
+    problems = []
+    for table, info in snapshot.schema.items():
+        if not info['exists']:
+            problems.append(f"{table} does not exist")
+        elif info['missing_columns']:
+            problems.append(f"{table} lacks column(s) {', '.join(info['missing_columns'])}")
+    if FACTS_TABLE in table_names():
+        with connection.cursor() as cursor:
+            cursor.execute(f"PRAGMA table_info({FACTS_TABLE})")
+            columns = {row[1] for row in cursor.fetchall()}
+        missing = [name for name, _type, _expr in FACTS_COLUMNS if name not in columns]
+        if missing:
+            problems.append(f"{FACTS_TABLE} lacks column(s) {', '.join(missing)}; run build_task_facts --rebuild")
+    return {"tables": len(snapshot.schema), "problems": problems}
+
+
+def check_indexes():
+    """Recommended indexes that are missing, on the hotwash tables and on task_facts"""
+    missing = [f"{name} on {table}" for name, table, _ddl in missing_indexes()]
+    if FACTS_TABLE in table_names():
+        present = existing_indexes()
+        missing += [f"{name} on {FACTS_TABLE}" for name in FACTS_INDEXES if name not in present]
+    return {"missing": missing}
+
+
+def stale_statistics(tables):
+    """[(table, rows in sqlite_stat1 or None, rows now)] for tables ANALYZE should refresh"""
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT count(*) FROM sqlite_master WHERE name = 'sqlite_stat1'")
+        analyzed = {}
+        if cursor.fetchone()[0]:
+            cursor.execute("SELECT tbl, stat FROM sqlite_stat1")
+            for table, stat in cursor.fetchall():
+                rows = int(stat.split()[0]) if stat and stat.split()[0].isdigit() else 0
+                analyzed[table] = max(analyzed.get(table, 0), rows)
+        stale = []
+        for table in tables:
+            cursor.execute(f'SELECT count(*) FROM "{table}"')
+            rows = cursor.fetchone()[0]
+            recorded = analyzed.get(table)
+            if recorded is None or abs(rows - recorded) > STALE_STATS_FRACTION * max(recorded, 1):
+                stale.append((table, recorded, rows))
+    return stale
+
+
+def analyze(tables):
+    """ANALYZE the tables whose statistics are missing or stale"""
+    stale = stale_statistics(tables)
+    with connection.cursor() as cursor:
+        for table, _recorded, _rows in stale:
+            cursor.execute(f'ANALYZE "{table}"')
+    return {"analyzed": [f"{table} ({recorded} -> {rows} rows)" for table, recorded, rows in stale]}
+
+
+def touch_pages(tables):
+    """Read every b-tree of the hot tables and their indexes on the read connection.
+
+    count(*) visits every page of the b-tree it counts, so this loads the indexes and
+    the table rows (not overflow pages) into the OS page cache, which the reader's
+    memory-mapped I/O and every later connection share.
+    """
+    btrees = 0
+    with read_connection().cursor() as cursor:
+        for table in tables:
+            cursor.execute(f'SELECT count(*) FROM "{table}" NOT INDEXED')
+            btrees += 1
+            cursor.execute(f'PRAGMA index_list("{table}")')
+            for index in [row[1] for row in cursor.fetchall()]:
+                try:
+                    cursor.execute(f'SELECT count(*) FROM "{table}" INDEXED BY "{index}"')
+                except DatabaseError:
+                    # Partial indexes can't answer an unfiltered count
+                    continue
+                btrees += 1
+    return {"btrees": btrees}
+
+
+def frequent_queries(limit):
+    """The limit most frequent /query/ questions in the history, most frequent first"""
+    rows = QueryHistory.objects.values('query').annotate(asked=Count('id')).order_by('-asked', 'query')
+    return [row['query'] for row in rows[:limit]]
+
+
+def prime_caches(limit):
+    """Answer the most frequent questions once, filling the SQL template, plan and result caches.
+
+    Questions are answered as a first page with the default page size, the way they
+    are usually asked; nothing is written to the history.
+    """
+    view = OfflineRAGView()
+    view.timer = NULL_TIMER
+    primed, failed = 0, []
+    for query in frequent_queries(limit):
+        summary_mode = parse_query(query).style == 'summary'
+        page_size = summary_sample_size() if summary_mode else default_page_size()
+        try:
+            prepared = view.generate_sql_query(query, page_size=page_size)
+            data = view.answer(query, prepared, summary_mode, page_size=page_size)[0]
+        except Exception as e:
+            failed.append(f"{query}: {e}")
+            continue
+        if isinstance(data, dict) and "error" in data:
+            failed.append(f"{query}: {data['error']}")
+        else:
+            primed += 1
+    return {"primed": primed, "failed": failed}
+
+
+def run(steps=STEPS, queries=None, report=None):
+    """Run the named steps in STEPS order; returns [(step, seconds, result)].
+
+    report, if given, is called with each (step, seconds, result) as it finishes.
+    """
+    if queries is None:
+        queries = getattr(settings, 'RAG_WARMUP', {}).get('QUERIES', 20)
+    tables = None
+    results = []
+    for step in STEPS:
+        if step not in steps:
+            continue
+        started = time.perf_counter()
+        if step == 'schema':
+            result = check_schema()
+        elif step == 'indexes':
+            result = check_indexes()
+        elif step == 'caches':
+            result = prime_caches(queries)
+        else:
+            tables = tables or hot_tables()
+            result = analyze(tables) if step == 'analyze' else touch_pages(tables)
+        outcome = (step, time.perf_counter() - started, result)
+        results.append(outcome)
+        if report is not None:
+            report(*outcome)
+    return results
+
+
+def start_background():
+    """Run STARTUP_STEPS on a daemon thread when RAG_WARMUP['ON_START'] is set"""
+    if not getattr(settings, 'RAG_WARMUP', {}).get('ON_START', False):
+        return None
+
+    def warm():
+        try:
+            for step, seconds, result in run(STARTUP_STEPS):
+                logger.info("warm-up %s in %.2fs: %s", step, seconds, result)
+        except Exception:
+            logger.exception("warm-up failed")
+        finally:
+            connection.close()
+            read_connection().close()
+
+    thread = threading.Thread(target=warm, name='rag-warmup', daemon=True)
+    thread.start()
+    return thread